@@ -0,0 +1,17 @@
+-- Functions for full-text search of resources.
+-- The search_tsv column is computed from a JSON array of texts by weight [A, B, C] built by the datastore.
+-- Search terms must be parsed with the same text search configuration.
+
+CREATE OR REPLACE FUNCTION json_fulltext(parts json) RETURNS tsvector AS
+$$
+SELECT setweight(to_tsvector('english'::regconfig, coalesce(parts->>0, '')), 'A') ||
+       setweight(to_tsvector('english'::regconfig, coalesce(parts->>1, '')), 'B') ||
+       setweight(to_tsvector('english'::regconfig, coalesce(parts->>2, '')), 'C');
+$$
+LANGUAGE SQL IMMUTABLE STRICT;
+
+CREATE OR REPLACE FUNCTION fulltext_query(terms text) RETURNS tsquery AS
+$$
+SELECT plainto_tsquery('english'::regconfig, terms);
+$$
+LANGUAGE SQL IMMUTABLE STRICT;
@@ -0,0 +1,69 @@
+-- Functions to query JSONB document columns (requires Postgres 9.4+).
+-- Overloads of the json functions in db_init.sql for datastores with jsonb document storage.
+-- Attribute access is native; the other functions delegate to the json implementation.
+
+
+-- String, boolean and null attributes are native. Numbers, arrays, objects and missing paths
+-- delegate to the json implementation for its JavaScript string conversion.
+CREATE OR REPLACE FUNCTION json_string(data jsonb, key text) RETURNS TEXT AS
+$$
+SELECT CASE jsonb_typeof(data #> string_to_array(key, '.'))
+    WHEN 'string' THEN data #>> string_to_array(key, '.')
+    WHEN 'boolean' THEN CASE WHEN (data #> string_to_array(key, '.'))::text = 'true' THEN 'True' ELSE 'False' END
+    WHEN 'null' THEN NULL
+    ELSE json_string(data::json, key)
+END
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Results in a list of attributes
+CREATE OR REPLACE FUNCTION json_attrs(data jsonb) RETURNS TEXT[] AS
+$$
+SELECT ARRAY(SELECT jsonb_object_keys(data))
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Results in a list of nested object types
+CREATE OR REPLACE FUNCTION json_nested(data jsonb) RETURNS TEXT[] AS
+$$
+SELECT json_nested(data::json)
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Results in a list of keywords
+CREATE OR REPLACE FUNCTION json_keywords(data jsonb) RETURNS TEXT[] AS
+$$
+SELECT CASE WHEN jsonb_typeof(data->'keywords') = 'array'
+    THEN ARRAY(SELECT jsonb_array_elements_text(data->'keywords'))
+    ELSE '{}'::text[]
+END
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Results in a special attribute extracted from object
+CREATE OR REPLACE FUNCTION json_specialattr(data jsonb) RETURNS TEXT AS
+$$
+SELECT json_specialattr(data::json)
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Results in a list of alternative id namespaces
+CREATE OR REPLACE FUNCTION json_altids_ns(data jsonb) RETURNS TEXT[] AS
+$$
+SELECT json_altids_ns(data::json)
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Results in a list of alternative ids
+CREATE OR REPLACE FUNCTION json_altids_id(data jsonb) RETURNS TEXT[] AS
+$$
+SELECT json_altids_id(data::json)
+$$
+LANGUAGE sql IMMUTABLE STRICT;
+
+-- Results in all attributes in one big string for full text query
+CREATE OR REPLACE FUNCTION json_allattr(data jsonb) RETURNS TEXT AS
+$$
+SELECT json_allattr(data::json)
+$$
+LANGUAGE sql IMMUTABLE STRICT;
@@ -1,3 +1,3 @@
-CREATE TABLE "%(ds)s" (id varchar(300) PRIMARY KEY, rev int, doc json);
+CREATE TABLE "%(ds)s" (id varchar(300) PRIMARY KEY, rev int, doc %(doc_type)s);
 
 GRANT SELECT, INSERT, UPDATE, DELETE on "%(ds)s" TO ion;
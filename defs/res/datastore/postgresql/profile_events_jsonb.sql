@@ -0,0 +1,5 @@
+-- Events table indexes for jsonb document storage.
+-- Applied when creating a datastore with doc_storage jsonb and when migrating to jsonb.
+
+-- Attribute containment queries (doc @> '{"attr": value}')
+CREATE INDEX IF NOT EXISTS "%(ds)s_doc_idx" ON "%(ds)s" USING GIN (doc jsonb_path_ops);
@@ -0,0 +1,22 @@
+-- Events table range partitioned by ts_created (Postgres 11+).
+-- Used instead of profile_events.sql if events_partitioning is daily or monthly.
+-- Partitions are created by the datastore before inserts and ahead of time, and dropped after retention.
+CREATE TABLE "%(ds)s" (id varchar(300) NOT NULL, rev int, doc %(doc_type)s, type_ varchar(80),
+    origin varchar(300), origin_type varchar(80), sub_type varchar(120), ts_created varchar(14) NOT NULL,
+    PRIMARY KEY (id, ts_created)) PARTITION BY RANGE (ts_created);
+
+-- Catches events without a valid ts_created or for which a partition could not be created
+CREATE TABLE "%(ds)s_default" PARTITION OF "%(ds)s" DEFAULT;
+
+GRANT SELECT, INSERT, UPDATE, DELETE on "%(ds)s" TO ion;
+
+-- Events table indexes (created on every partition)
+CREATE INDEX "%(ds)s_type_idx" ON "%(ds)s" (type_, ts_created);
+
+CREATE INDEX "%(ds)s_origin_idx" ON "%(ds)s" (origin, ts_created);
+
+CREATE INDEX "%(ds)s_origin_type_idx" ON "%(ds)s" (origin_type);
+
+CREATE INDEX "%(ds)s_sub_type_idx" ON "%(ds)s" (sub_type);
+
+CREATE INDEX "%(ds)s_ts_created_idx" ON "%(ds)s" (ts_created);
@@ -1,10 +1,10 @@
 -- Resource tables
-CREATE TABLE "%(ds)s" (id varchar(300) PRIMARY KEY, rev int, doc json,
+CREATE TABLE "%(ds)s" (id varchar(300) PRIMARY KEY, rev int, doc %(doc_type)s,
     type_ varchar(80), lcstate varchar(10), availability varchar(14), visibility int,
     name varchar(300),
     ts_created varchar(14), ts_updated varchar(14),
     vertical_range numrange, temporal_range numrange,
-    deleted boolean);
+    deleted boolean, search_tsv tsvector);
 
 SELECT AddGeometryColumn('public', '%(ds)s', 'geom', 4326, 'POINT', 2);
 
@@ -14,14 +14,14 @@ SELECT AddGeometryColumn('public', '%(ds)s', 'geom_mpoly', 4326, 'MULTIPOLYGON',
 
 GRANT SELECT, INSERT, UPDATE, DELETE on "%(ds)s" TO ion;
 
-CREATE TABLE "%(ds)s_assoc" (id varchar(300) PRIMARY KEY, rev int, doc json,
+CREATE TABLE "%(ds)s_assoc" (id varchar(300) PRIMARY KEY, rev int, doc %(doc_type)s,
     s varchar(300) REFERENCES %(ds)s (id) ON DELETE CASCADE, st varchar(80), p varchar(40),
     o varchar(300) REFERENCES %(ds)s (id) ON DELETE CASCADE, ot varchar(80), retired boolean,
     CONSTRAINT "%(ds)s_assoc_entry_unique" UNIQUE (s, p, o));
 
 GRANT SELECT, INSERT, UPDATE, DELETE on "%(ds)s_assoc" TO ion;
 
-CREATE TABLE "%(ds)s_dir" (id varchar(300) PRIMARY KEY, rev int, doc json,
+CREATE TABLE "%(ds)s_dir" (id varchar(300) PRIMARY KEY, rev int, doc %(doc_type)s,
     org varchar(60), parent varchar(300), key varchar(300),
     CONSTRAINT "%(ds)s_dir_entry_unique" UNIQUE (org, parent, key));
 
@@ -51,6 +51,8 @@ CREATE INDEX "%(ds)s_name_full_idx" ON "%(ds)s" USING GIST (name gist_trgm_ops);
 
 CREATE INDEX "%(ds)s_keywords_idx" ON "%(ds)s" USING GIN (json_keywords(doc));
 
+CREATE INDEX "%(ds)s_search_idx" ON "%(ds)s" USING GIN (search_tsv);
+
 CREATE INDEX "%(ds)s_nested_idx" ON "%(ds)s" USING GIN (json_nested(doc));
 
 CREATE INDEX "%(ds)s_specialattr_idx" ON "%(ds)s" (json_specialattr(doc));
@@ -0,0 +1,19 @@
+-- Resource table indexes for jsonb document storage.
+-- Applied when creating a datastore with doc_storage jsonb and when migrating to jsonb.
+
+-- Attribute containment queries (doc @> '{"attr": value}')
+CREATE INDEX IF NOT EXISTS "%(ds)s_doc_idx" ON "%(ds)s" USING GIN (doc jsonb_path_ops);
+
+CREATE INDEX IF NOT EXISTS "%(ds)s_dir_doc_idx" ON "%(ds)s_dir" USING GIN (doc jsonb_path_ops);
+
+
+-- Per type expression indexes on commonly filtered attributes.
+-- Attribute filters (json_string(doc,'attr')) together with a type_ filter use these.
+CREATE INDEX IF NOT EXISTS "%(ds)s_actor_email_idx" ON "%(ds)s" (json_string(doc, 'details.contact.email'))
+    WHERE type_='ActorIdentity';
+
+CREATE INDEX IF NOT EXISTS "%(ds)s_org_govname_idx" ON "%(ds)s" (json_string(doc, 'org_governance_name'))
+    WHERE type_='Org';
+
+CREATE INDEX IF NOT EXISTS "%(ds)s_role_govname_idx" ON "%(ds)s" (json_string(doc, 'governance_name'))
+    WHERE type_='UserRole';
@@ -25,6 +25,8 @@ class DatastoreAdmin(ImmediateProcess):
     bin/pycc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=dump path=res/preload/local/my_dump
     bin/pycc -fc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=load path=res/preload/local/my_dump
     bin/pycc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=dumpres
+    bin/pycc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=migrate_jsonb
+    bin/pycc -x ion.processes.bootstrap.datastore_loader.DatastoreLoader op=migrate_fulltext
     """
     def on_init(self):
         pass
@@ -55,6 +57,10 @@ class DatastoreAdmin(ImmediateProcess):
                 self.da.get_blame_objects()
             elif op == "clear":
                 self.da.clear_datastore(datastore, prefix)
+            elif op == "migrate_jsonb":
+                self.da.migrate_jsonb(datastore)
+            elif op == "migrate_fulltext":
+                self.da.migrate_fulltext(datastore)
             else:
                 raise iex.BadRequest("Operation unknown")
         else:
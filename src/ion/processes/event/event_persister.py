@@ -3,6 +3,7 @@
 """Process that subscribes to ALL events and persists them efficiently in bulk into the events datastore"""
 
 import pprint
+import time
 from gevent.queue import Queue
 from gevent.event import Event
 
@@ -23,6 +24,13 @@ class EventPersister(StandaloneProcess):
 
         self.persist_blacklist = self.CFG.get_safe("process.event_persister.persist_blacklist", {})
 
+        # Number of events received and acked at once from the event queue
+        self.listen_batch_size = int(self.CFG.get_safe("process.event_persister.listen_batch_size", 1))
+
+        # Time in between creating and purging partitions of a time partitioned events datastore
+        self.partition_maintenance_interval = float(self.CFG.get_safe("process.event_persister.partition_maintenance_interval", 0) or 0)
+        self._last_maintenance = 0
+
         self._event_type_blacklist = [entry['event_type'] for entry in self.persist_blacklist if entry.get('event_type', None) and len(entry) == 1]
         self._complex_blacklist = [entry for entry in self.persist_blacklist if not (entry.get('event_type', None) and len(entry) == 1)]
         if self._complex_blacklist:
@@ -64,7 +72,8 @@ class EventPersister(StandaloneProcess):
         # Event subscription
         self.event_sub = EventSubscriber(pattern=EventSubscriber.ALL_EVENTS,
                                          callback=self._on_event,
-                                         queue_name="event_persister")
+                                         queue_name="event_persister",
+                                         batch_size=self.listen_batch_size)
 
         self.event_sub.start()
 
@@ -134,6 +143,8 @@ class EventPersister(StandaloneProcess):
                     self._process_events(events_to_process)
                 self.events_to_persist = None
                 self.failure_count = 0
+
+                self._maintain_partitions()
             except Exception as ex:
                 # Note: Persisting events may fail occasionally during test runs (when the "events" datastore is force
                 # deleted and recreated). We'll log and keep retrying forever.
@@ -145,6 +156,15 @@ class EventPersister(StandaloneProcess):
         if event_list:
             self.container.event_repository.put_events(event_list)
 
+    def _maintain_partitions(self):
+        if not self.partition_maintenance_interval or time.time() - self._last_maintenance < self.partition_maintenance_interval:
+            return
+        self._last_maintenance = time.time()
+        try:
+            self.container.event_repository.maintain_partitions()
+        except Exception:
+            log.exception("Error maintaining events datastore partitions")
+
     def _process_events(self, event_list):
         for plugin_name, plugin in self.process_plugins.iteritems():
             try:
@@ -109,4 +109,15 @@ class ContainerProfiler(StandaloneProcess):
             proc_cpu = proc.get_cpu_percent(),
             proc_mem = proc.get_memory_info(),
         )
+
+        # Database connection pool gauges and checkout wait time histogram
+        from pyon.datastore.postgresql import base_store
+        if base_store.pg_connection_pool:
+            pool_stats = base_store.pg_connection_pool.get_stats()
+            for stat_name in ("size", "idle", "in_use", "waiting", "checkouts", "checkout_timeouts",
+                              "wait_time_avg", "wait_time_max", "recycled", "validation_failures"):
+                profile["db_pool_%s" % stat_name] = pool_stats[stat_name]
+            for bucket, count in pool_stats["wait_hist"].iteritems():
+                profile["db_pool_wait_%s" % bucket] = count
+
         return profile
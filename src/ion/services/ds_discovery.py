@@ -48,6 +48,7 @@ class DatastoreDiscovery(object):
 
         # Query matchers
         self._qmatchers = [self._qmatcher_andor,
+                           self._qmatcher_fulltext,
                            self._qmatcher_allmatch,
                            self._qmatcher_field_time,
                            self._qmatcher_fieldeq,
@@ -57,6 +58,14 @@ class DatastoreDiscovery(object):
                           ]
 
     def execute_query(self, discovery_query, id_only=True, query_args=None, query_params=None):
+        """
+        Executes a discovery query or datastore query against the datastore.
+        @param query_args  Optional dict of query settings: query_info to append a query info dict to
+                           the results; count to return a list with the count of matching objects only;
+                           aggregate (distinct or group_count) with aggregate_cols to return a list of
+                           distinct value lists (with count) computed within the datastore;
+                           attribute_filter to return dicts with only these attributes if not id_only.
+        """
         try:
             if "QUERYEXP" in discovery_query:
                 ds_query, ds_name = discovery_query, discovery_query["query_args"].get("datastore", DataStore.DS_RESOURCES)
@@ -69,6 +78,9 @@ class DatastoreDiscovery(object):
             if query_params:
                 ds_query["query_params"].update(query_params)
             ds_query["query_params"]["current_actor"] = current_actor_id
+            if query_args:
+                self._set_aggregate(ds_query, query_args)
+                self._set_projection(ds_query, query_args)
 
             log.debug("DatastoreDiscovery.execute_query(): ds_query=\n%s", pprint.pformat(ds_query))
 
@@ -128,6 +140,33 @@ class DatastoreDiscovery(object):
         qb.build_query(where=where, order_by=order_by)
         return qb.get_query(), ds_name
 
+    def _set_aggregate(self, ds_query, query_args):
+        """Sets an aggregate function in the datastore query from the count or aggregate query args"""
+        if query_args.get("count", False):
+            aggregate, agg_cols = DQ.AGG_COUNT, []
+        elif query_args.get("aggregate", None):
+            aggregate = query_args["aggregate"]
+            if not aggregate.startswith(DQ.AGG_PREFIX):
+                aggregate = DQ.AGG_PREFIX + aggregate
+            agg_cols = query_args.get("aggregate_cols", None) or []
+            if type(agg_cols) not in (list, tuple):
+                agg_cols = [agg_cols]
+            agg_cols = [COL_MAP.get(col, col) for col in agg_cols]
+        else:
+            return
+        if aggregate not in (DQ.AGG_COUNT, DQ.AGG_DISTINCT, DQ.AGG_GROUP_COUNT):
+            raise BadRequest("Unknown aggregate: %s" % aggregate)
+        if aggregate != DQ.AGG_COUNT and not agg_cols:
+            raise BadRequest("Aggregate %s requires aggregate_cols" % aggregate)
+        ds_query["query_args"]["aggregate"] = aggregate
+        ds_query["query_args"]["aggregate_cols"] = [col.split(":", 1)[-1] for col in agg_cols]
+
+    def _set_projection(self, ds_query, query_args):
+        """Sets the attribute_filter query arg as projection in the datastore query, if objects are returned"""
+        attr_filter = query_args.get("attribute_filter", None)
+        if attr_filter and type(attr_filter) in (list, tuple) and not ds_query["query_args"].get("id_only", True):
+            ds_query["query_args"]["projection"] = [str(attr) for attr in attr_filter]
+
     def _get_datastore(self, ds_name):
         ds = None
         if ds_name == DataStore.DS_RESOURCES:
@@ -171,6 +210,15 @@ class DatastoreDiscovery(object):
 
         return qb.all_match(match)
 
+    def _qmatcher_fulltext(self, query, qb):
+        query_exp = query.get("query", query)
+        field = query_exp.get("field", "_all")
+        fulltext = query_exp.get("fulltext", None)
+        if field != "_all" or not fulltext:
+            return
+
+        return qb.fulltext(fulltext)
+
     def _qmatcher_field_time(self, query, qb):
         query_exp = query.get("query", query)
         field = query_exp.get("field", None)
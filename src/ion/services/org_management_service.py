@@ -60,6 +60,9 @@ class OrgManagementService(BaseOrgManagementService):
         self.negotiation_handler = Negotiation(self, negotiation_rules, self.event_pub)
         self.root_org_id = None
 
+    def on_quit(self):
+        self.event_pub.close()
+
     def _get_root_org_name(self):
         if self.container is None or self.container.governance_controller is None:
             return CFG.get_safe("system.root_org", "ION")
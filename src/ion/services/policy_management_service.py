@@ -19,6 +19,10 @@ class PolicyManagementService(BasePolicyManagementService):
     def on_start(self):
         self.event_pub = EventPublisher(process=self)
 
+    def on_quit(self):
+        if self.event_pub:
+            self.event_pub.close()
+
     # -------------------------------------------------------------------------
     # Policy management
 
@@ -319,6 +319,7 @@ class PDLocalBackend(object):
             except Exception:
                 log.warn("Ignoring error while killing spawn greenlets", exc_info=True)
             self._spawn_greenlets.clear()
+        self.event_pub.close()
 
     def set_system_boot(self, system_boot):
         pass
@@ -7,7 +7,8 @@ import re
 from pyon.agent.agent import ResourceAgentClient
 from pyon.core.bootstrap import get_service_registry
 from pyon.datastore.datastore_query import QUERY_EXP_KEY, DQ
-from pyon.public import log, IonObject, Unauthorized, ResourceQuery, PRED, CFG, RT, log, BadRequest, NotFound
+from pyon.ion.resource import create_access_args
+from pyon.public import log, IonObject, Unauthorized, ResourceQuery, PRED, CFG, RT, log, BadRequest, NotFound, get_ion_actor_id
 from pyon.util.config import Config
 from pyon.util.containers import get_safe, named_any, get_ion_ts, is_basic_identifier
 
@@ -119,14 +120,12 @@ class ResourceManagementService(BaseResourceManagementService):
         elif 'query' not in query:
             raise BadRequest('Unsupported request. %s' % query)
 
-        # if count requested, run id_only query without limit/skip
-        count = search_args.get("count", False)
-        if count:
-            # Only return the count of ID only search
-            query.pop("limit", None)
-            query.pop("skip", None)
+        # if count or aggregate requested, return the values computed in the datastore
+        if search_args.get("count", False) or search_args.get("aggregate", None):
             res = self.ds_discovery.execute_query(query, id_only=True, query_args=search_args, query_params=query_params)
-            return [len(res)]
+            if search_args.get("count", False) and not res:
+                return [0]
+            return res
 
         # TODO: Not all queries are permissible by all users
 
@@ -146,7 +145,10 @@ class ResourceManagementService(BaseResourceManagementService):
             raise BadRequest("Illegal argument type: attribute_filter")
 
         if not id_only and attr_filter:
-            filtered_res = [dict(__noion__=True, **{k: v for k, v in obj.__dict__.iteritems() if k in attr_filter or k in {"_id", "type_"}}) for obj in query_results]
+            # Datastore queries return dicts with projected attributes already
+            filtered_res = [obj if isinstance(obj, dict) else
+                            dict(__noion__=True, **{k: v for k, v in obj.__dict__.iteritems() if k in attr_filter or k in {"_id", "type_"}})
+                            for obj in query_results]
             return filtered_res
         return query_results
 
@@ -301,17 +303,36 @@ class ResourceManagementService(BaseResourceManagementService):
         if res_filter and type(res_filter) not in (list, tuple):
             raise BadRequest("Illegal value for argument res_filter")
 
-        # NOTE: This can alternatively be implemented as a SELECT DISTINCT query, but this is not
-        # supported by the underlying datastore interface.
+        # SELECT DISTINCT within the datastore. Values are returned as text and converted here
         rq = ResourceQuery()
         if res_filter:
             rq.set_filter(rq.eq(rq.ATT_TYPE, restype), res_filter)
         else:
             rq.set_filter(rq.eq(rq.ATT_TYPE, restype))
-        res_list = self.clients.resource_registry.find_resources_ext(query=rq.get_query(), id_only=False)
-
-        log.debug("Found %s resources of type %s", len(res_list), restype)
-        att_values = sorted({tuple(getattr(res, an) for an in attr_list) for res in res_list})
+        rq.set_aggregate(rq.AGG_DISTINCT, *attr_list)
+        rr = self.container.resource_registry
+        access_args = create_access_args(current_actor_id=get_ion_actor_id(self),
+                                         superuser_actor_ids=rr.get_superuser_actors())
+        value_rows = rr.rr_store.find_by_query(rq.get_query(), access_args=access_args)
+
+        def convert_value(an, value):
+            # Numbers come as text in JavaScript notation, e.g. 1e+21
+            att_schema = type_cls._schema[an]
+            if value is None:
+                return att_schema.get("default", None)
+            try:
+                if att_schema["type"] == "int":
+                    try:
+                        return int(value)
+                    except ValueError:
+                        return int(float(value))
+                elif att_schema["type"] == "float":
+                    return float(value)
+            except (ValueError, OverflowError):
+                log.warn("Cannot convert value %r of attribute %s to %s", value, an, att_schema["type"])
+            return value
+
+        att_values = sorted({tuple(convert_value(an, val) for an, val in zip(attr_list, row)) for row in value_rows})
 
         log.debug("Found %s distinct vales for attribute(s): %s", len(att_values), attr_list)
 
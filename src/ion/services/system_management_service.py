@@ -19,7 +19,10 @@ class SystemManagementService(BaseSystemManagementService):
     def perform_action(self, predicate=None, action=None):
         userid = None  # get from context
         event_pub = EventPublisher(process=self)
-        event_pub.publish_event(event_type=OT.ContainerManagementRequest, origin=userid, predicate=predicate, action=action)
+        try:
+            event_pub.publish_event(event_type=OT.ContainerManagementRequest, origin=userid, predicate=predicate, action=action)
+        finally:
+            event_pub.close()
 
     def set_log_level(self, logger='', level='', recursive=False):
         self.perform_action(ALL_CONTAINERS_INSTANCE, IonObject(OT.ChangeLogLevel, logger=logger, level=level, recursive=recursive))
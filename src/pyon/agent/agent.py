@@ -266,8 +266,12 @@ class ResourceAgent(BaseResourceAgent, StatefulProcessMixin):
                    process_id=self.id,
                    agent_state=self._fsm.get_current_state(),
                    execution_status=ResourceAgentExecutionStatus.OK)
-        self._event_publisher.publish_event(**evt)
-        log.debug('agent lifecycle event published: %s', evt)
+        try:
+            self._event_publisher.publish_event(**evt)
+            log.debug('agent lifecycle event published: %s', evt)
+        finally:
+            # Release the publisher's cached channels
+            self._event_publisher.close()
 
     ##############################################################
     # Governance interfaces and helpers
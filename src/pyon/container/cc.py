@@ -165,6 +165,10 @@ class Container(BaseContainerAgent):
             else:
                 log.debug("start(): Capability '%s' disabled by config '%s'", cap, enabled_config)
 
+        if self.has_capability(CCAP.RESOURCE_REGISTRY) and self.has_capability(CCAP.EXCHANGE_MANAGER):
+            # Resource cache invalidation requires the exchange, which starts after the resource registry
+            self.resource_registry.start_cache_listener()
+
         if self.has_capability(CCAP.EVENT_PUBLISHER):
             self.event_pub.publish_event(event_type="ContainerLifecycleEvent",
                                          origin=self.id, origin_type="CapabilityContainer",
@@ -287,6 +291,9 @@ class Container(BaseContainerAgent):
             except Exception as ex:
                 log.exception(ex)
 
+        if self.has_capability(CCAP.RESOURCE_REGISTRY):
+            self.resource_registry.stop_cache_listener()
+
         while self._capabilities:
             capability = self._capabilities.pop()
             #log.debug("stop(): Stopping '%s'" % capability)
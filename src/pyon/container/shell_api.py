@@ -231,6 +231,51 @@ def start_mx():
     container.spawn_process("admin_ui", "ion.processes.ui.admin_ui", "AdminUI")
     print "pycc: SciON Admin UI started ... listening on http://localhost:%s" % port
 
+def dbstats(by_op=True, limit=20, save=False, reset=False):
+    """Prints database statement statistics of the query profiler (see dbprofile).
+    @param by_op  Aggregate per statement shape and calling service op (True) or per shape only
+    @param save  Also write all statistics to a CSV file
+    @param reset  Clear statistics after printing
+    """
+    from pyon.datastore.postgresql import pg_profiler
+    profiler = pg_profiler.query_profiler
+    if not profiler:
+        print "Query profiler not enabled. Use dbprofile()"
+        return
+    profiler.print_stats(by_op=by_op, limit=limit)
+    if save:
+        print "Saved to %s" % profiler.save_csv(by_op=by_op)
+    if reset:
+        profiler.reset()
+
+def dbprofile(enable=True, slow_threshold=None, explain_slow=None):
+    """Enables or disables the database query profiler"""
+    from pyon.public import CFG
+    from pyon.datastore.postgresql import pg_profiler
+    if not enable:
+        pg_profiler.stop_query_profiler()
+        return
+    profiler = pg_profiler.start_query_profiler(CFG.get_safe("server.postgresql.query_profiler", None))
+    if slow_threshold is not None:
+        profiler.slow_threshold = float(slow_threshold)
+    if explain_slow is not None:
+        profiler.explain_slow = bool(explain_slow)
+
+
+def rpcstats(reset=False):
+    """Prints call count and latency statistics of the RPC operations served in this container.
+    @param reset  Clear statistics after printing
+    """
+    from pyon.net.endpoint import RPCOpTable
+    all_stats = RPCOpTable.get_all_stats(reset=reset)
+    print "%8s %8s %10s %8s %8s  %s" % ("count", "errors", "total", "avg", "max", "service.op")
+    rows = [(svc_name, op_name, op_stats) for svc_name, svc_stats in all_stats.iteritems()
+            for op_name, op_stats in svc_stats.iteritems()]
+    rows.sort(key=lambda row: row[2]["total_time"], reverse=True)
+    for svc_name, op_name, op_stats in rows:
+        print "%8s %8s %10.3f %8.4f %8.4f  %s.%s" % (op_stats["count"], op_stats["errors"], op_stats["total_time"],
+                                                    op_stats["avg_time"], op_stats["max_time"], svc_name, op_name)
+
 
 def ionhelp():
     print "ScionCC interactive shell"
@@ -239,7 +284,7 @@ def ionhelp():
     print "Available variables: %s" % ", ".join(sorted(public_vars.keys()))
 
 # This defines the public API of functions
-public_api = [ionhelp, ps, procs, ms, apps, svc_defs, obj_defs, type_defs, lsdir, spawn, start_mx]
+public_api = [ionhelp, ps, procs, ms, apps, svc_defs, obj_defs, type_defs, lsdir, spawn, start_mx, dbstats, dbprofile, rpcstats]
 public_vars = None
 
 
@@ -12,7 +12,8 @@ from putil.timer import get_accumulators
 from pyon.public import log, IonObject, BadRequest, CFG
 from pyon.util.containers import get_ion_ts
 
-DEFAULT_SNAPSHOTS = ["basic", "config", "processes", "policy", "accumulators", "gevent", "gevent_block"]
+DEFAULT_SNAPSHOTS = ["basic", "config", "processes", "policy", "accumulators", "gevent", "gevent_block", "resource_cache",
+                     "db_pool"]
 
 
 class ContainerSnapshot(object):
@@ -199,3 +200,18 @@ class ContainerSnapshot(object):
                     )
 
         return all_acc_dict
+
+    def _snap_db_pool(self, **kwargs):
+        from pyon.datastore.postgresql import base_store
+        snap_result = {}
+        if base_store.pg_connection_pool:
+            snap_result["stats"] = base_store.pg_connection_pool.get_stats()
+
+        return snap_result
+
+    def _snap_resource_cache(self, **kwargs):
+        snap_result = {}
+        if self.container.has_capability(self.container.CCAP.RESOURCE_REGISTRY):
+            snap_result["stats"] = self.container.resource_registry.get_cache_stats()
+
+        return snap_result
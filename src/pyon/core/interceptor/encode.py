@@ -3,7 +3,9 @@
 """Messaging object encoder/decoder for IonObjects and numpy data"""
 
 import msgpack
+import struct
 import sys
+import zlib
 import numpy as np
 
 from pyon.core.bootstrap import get_obj_registry
@@ -19,10 +21,40 @@ numpy_bool = (np.bool, )
 numpy_complex = (np.complex, np.complex64, np.complex128)
 
 
+
+def _zlib_decompress(data, max_size):
+    decomp = zlib.decompressobj()
+    result = decomp.decompress(data, max_size)
+    if decomp.unconsumed_tail or decomp.decompress('', 1):
+        raise BadRequest('The decompressed message is larger than the max_message_size value of %s' % max_size)
+    return result
+
+# Available payload compression methods: name -> (compress, decompress(data, max_size))
+compression_methods = {'zlib': (lambda data: zlib.compress(data, 1), _zlib_decompress)}
+try:
+    try:
+        from lz4.block import compress as lz4_compress, decompress as lz4_decompress
+    except ImportError:
+        from lz4 import compress as lz4_compress, decompress as lz4_decompress
+
+    def _lz4_decompress(data, max_size):
+        # lz4 block data is prefixed with its uncompressed size (little-endian uint32)
+        if len(data) < 4 or struct.unpack('<I', data[:4])[0] > max_size:
+            raise BadRequest('The decompressed message is larger than the max_message_size value of %s' % max_size)
+        return lz4_decompress(data)
+
+    compression_methods['lz4'] = (lz4_compress, _lz4_decompress)
+except ImportError:
+    pass
+
+ENCODING_MSGPACK = 'msgpack'
+
+
 class EncodeTypes(object):
     SET = 's'
     LIST = 'l'
     NPARRAY = 'a'
+    NPARRAY_BUF = 'b'
     COMPLEX = 'c'
     DTYPE = 'd'
     SLICE = 'i'
@@ -49,6 +81,11 @@ def decode_ion(obj):
         if obj_registry is None:
             obj_registry = get_obj_registry()
 
+        codec = obj_registry.get_codec(obj["type_"])
+        if codec is not None:
+            # Note: Translates unicode values to utf8, but not recursive within dicts/list or any other types
+            return codec.decode(obj, validate=obj_registry.validate_setattr)
+
         ion_obj = obj_registry.new(obj["type_"])
         for k, v in obj.iteritems():
             # unicode translate to utf8
@@ -67,7 +104,11 @@ def decode_ion(obj):
     if objt == EncodeTypes.LIST:
         return list(obj['o'])
 
+    elif objt == EncodeTypes.NPARRAY_BUF:
+        return decode_ndarray(obj['o'], obj['d'], obj['s'])
+
     elif objt == EncodeTypes.NPARRAY:
+        # Legacy format with list of elements
         return np.array(obj['o'], dtype=np.dtype(obj['d']))
 
     elif objt == EncodeTypes.COMPLEX:
@@ -89,6 +130,18 @@ def decode_ion(obj):
     return obj
 
 
+def decode_ndarray(buf, dtype_str, shape):
+    """
+    Returns a writeable numpy array from the raw C-contiguous buffer of its elements.
+    """
+    dtype = np.dtype(dtype_str)
+    shape = tuple(shape)
+    if not buf:
+        return np.zeros(shape, dtype=dtype)
+    # A str buffer is immutable; the single copy into a bytearray makes the array writeable
+    return np.frombuffer(bytearray(buf), dtype=dtype).reshape(shape)
+
+
 def encode_ion(obj):
     """
     msgpack object hook to encode granule/numpy types and IonObjects.
@@ -109,7 +162,11 @@ def encode_ion(obj):
         return {'t': EncodeTypes.SET, 'o': tuple(obj)}
 
     if isinstance(obj, np.ndarray):
-        return {'t': EncodeTypes.NPARRAY, 'o': obj.tolist(), 'd': obj.dtype.str}
+        if obj.dtype.hasobject or obj.dtype.names:
+            # Object and structured arrays have no portable raw buffer representation
+            return {'t': EncodeTypes.NPARRAY, 'o': obj.tolist(), 'd': obj.dtype.str}
+        return {'t': EncodeTypes.NPARRAY_BUF, 'o': np.ascontiguousarray(obj).tostring(), 'd': obj.dtype.str,
+                's': obj.shape}
 
     if isinstance(obj, complex):
         return {'t': EncodeTypes.COMPLEX, 'o': (obj.real, obj.imag)}
@@ -136,10 +193,19 @@ class EncodeInterceptor(Interceptor):
 
     def __init__(self):
         self.max_message_size = sys.maxint  # Will be set appropriately from interceptor config
+        self.compress_threshold = 0         # Payloads larger than this are compressed (0 to disable)
+        self.compress_method = 'zlib'
 
     def configure(self, config):
         self.max_message_size = get_safe(config, 'max_message_size', 20000000)
-        log.debug("EncodeInterceptor enabled")
+        self.compress_threshold = get_safe(config, 'compress_threshold', 0) or 0
+        # zlib is understood by every receiver; lz4 is opt-in once all receivers have lz4 installed
+        compress_method = get_safe(config, 'compress_method', 'zlib') or 'zlib'
+        if compress_method not in compression_methods:
+            log.warn("Message compression method %s not available - using zlib", compress_method)
+            compress_method = 'zlib'
+        self.compress_method = compress_method
+        log.debug("EncodeInterceptor enabled, compress_threshold=%s (%s)", self.compress_threshold, compress_method)
 
     def outgoing(self, invocation):
         payload = invocation.message
@@ -164,6 +230,9 @@ class EncodeInterceptor(Interceptor):
         if nonelist:
             raise BadRequest("Invalid headers containing None values: %s" % str(nonelist))
 
+        if self.compress_threshold and len(invocation.message) > self.compress_threshold:
+            self._compress(invocation)
+
         msg_size = len(invocation.message)
         if msg_size > self.max_message_size:
             raise BadRequest('The message size %s is larger than the max_message_size value of %s' % (
@@ -172,7 +241,31 @@ class EncodeInterceptor(Interceptor):
         return invocation
 
 
+    def _compress(self, invocation):
+        """Compresses the encoded message and signals the compression in the encoding header"""
+        compress_fn = compression_methods[self.compress_method][0]
+        compressed = compress_fn(invocation.message)
+        if len(compressed) < len(invocation.message):
+            invocation.message = compressed
+            invocation.headers['encoding'] = "%s+%s" % (ENCODING_MSGPACK, self.compress_method)
+
+    def _decompress(self, invocation):
+        """Decompresses the message if the encoding header indicates a compression method"""
+        encoding = invocation.headers.get('encoding', None)
+        if not encoding or '+' not in encoding:
+            return
+        compress_method = encoding.split('+', 1)[1]
+        if compress_method not in compression_methods:
+            raise BadRequest("Unsupported message encoding: %s" % encoding)
+        try:
+            invocation.message = compression_methods[compress_method][1](invocation.message, self.max_message_size)
+        except (zlib.error, ValueError) as ex:
+            raise BadRequest("Invalid %s message: %s" % (encoding, ex))
+        invocation.headers['encoding'] = ENCODING_MSGPACK
+
     def incoming(self, invocation):
+        self._decompress(invocation)
+
         # Un-Msgpack the content from binary string - does IonObject decoding
         invocation.message = msgpack.unpackb(invocation.message, object_hook=decode_ion, use_list=1)
 
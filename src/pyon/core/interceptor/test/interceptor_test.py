@@ -2,7 +2,9 @@
 
 __author__ = 'Luke Campbell <lcampbell@asascience.com>'
 
+import msgpack
 import unittest
+import zlib
 from nose.plugins.attrib import attr
 
 from pyon.util.unit_test import PyonTestCase
@@ -37,6 +39,10 @@ class InterceptorTest(PyonTestCase):
         b = received.message
         self.assertTrue((a==b).all())
 
+        # Decoded arrays can be modified in place
+        b[0] = 1
+        self.assertEquals(b[0], 1)
+
         # Rank 1, length 1 works:
         a = np.array([90,8010,3,14112,3.14159265358979323846264],dtype='float32')
         mangled = encode.outgoing(invoke)
@@ -121,6 +127,38 @@ class InterceptorTest(PyonTestCase):
 
         self.assertEquals(a,b)
 
+    def test_compression(self):
+        encode = EncodeInterceptor()
+        encode.configure({'compress_threshold': 1000})
+        self.assertEquals(encode.compress_method, 'zlib')
+
+        # Small messages are not compressed
+        invoke = Invocation(message={'key': 'value'}, headers={'encoding': 'msgpack'})
+        mangled = encode.outgoing(invoke)
+        self.assertEquals(mangled.headers['encoding'], 'msgpack')
+
+        a = {'values': ['value %s' % i for i in xrange(1000)]}
+        invoke = Invocation(message=a, headers={'encoding': 'msgpack'})
+        mangled = encode.outgoing(invoke)
+        self.assertEquals(mangled.headers['encoding'], 'msgpack+zlib')
+        self.assertLess(len(mangled.message), 5000)
+
+        received = encode.incoming(mangled)
+        self.assertEquals(received.headers['encoding'], 'msgpack')
+        self.assertEquals(received.message, a)
+
+        # Compression counts against the max message size
+        encode.max_message_size = 5000
+        encode.outgoing(Invocation(message=a, headers={}))
+
+        invoke = Invocation(message='x', headers={'encoding': 'msgpack+unknown'})
+        self.assertRaises(BadRequest, encode.incoming, invoke)
+
+        # Decompressed size is limited by the max message size
+        encode.max_message_size = len(msgpack.packb(a)) - 1
+        invoke = Invocation(message=zlib.compress(msgpack.packb(a)), headers={'encoding': 'msgpack+zlib'})
+        self.assertRaises(BadRequest, encode.incoming, invoke)
+
 
 
     def test_decorator_validation(self):
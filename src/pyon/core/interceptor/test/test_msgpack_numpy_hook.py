@@ -120,6 +120,26 @@ class NumpyMsgPackTestCase(unittest.TestCase, PackRunBase ):
         unittest.TestCase.__init__(self,*args, **kwargs)
         PackRunBase.__init__(self,*args, **kwargs)
 
+    def test_buffer_encoding(self):
+        # Non-contiguous and non-native byte order arrays keep values and dtype
+        array = numpy.arange(24, dtype='>i4').reshape((4, 6))[:, ::2]
+        encoded = encode_ion(array)
+        self.assertEquals(encoded['t'], 'b')
+        self.assertEquals(len(encoded['o']), 12 * 4)
+
+        new_array = unpackb(packb(array, default=encode_ion), object_hook=decode_ion)
+        self.assertEquals(new_array.dtype, numpy.dtype('>i4'))
+        self.assertEquals(new_array.shape, (4, 3))
+        self.assertTrue((array == new_array).all())
+
+        empty = unpackb(packb(numpy.zeros((0, 3), 'float32'), default=encode_ion), object_hook=decode_ion)
+        self.assertEquals(empty.shape, (0, 3))
+
+    def test_legacy_decoding(self):
+        msg = packb({'t': 'a', 'o': [[1.5, 2.5], [3.5, 4.5]], 'd': '<f8'})
+        new_array = unpackb(msg, object_hook=decode_ion)
+        self.assertTrue((new_array == numpy.array([[1.5, 2.5], [3.5, 4.5]])).all())
+
 
 
 if __name__ == '__main__':
@@ -803,6 +803,12 @@ class ServiceObjectGenerator:
 
             def_docstring, def_spec, def_in, def_out, def_throws = op_def.get('docstring', "@todo document this interface!!!"), op_def.get('spec', None), op_def.get('in', None), op_def.get('out', None), op_def.get('throws', None)
             methods_schema[op_name] = {"in": def_in, "out": def_out, "throws": def_throws, "doc": def_docstring, "spec": def_spec}
+            if op_def.get('exclusive', False):
+                # Op must not run concurrently with other calls in the same process
+                methods_schema[op_name]["exclusive"] = True
+            if op_def.get('timeout', None):
+                # Default timeout (seconds) for calls to the op that do not define one
+                methods_schema[op_name]["timeout"] = float(op_def['timeout'])
             # multiline docstring for method
             docstring_lines = def_docstring.split('\n')
 
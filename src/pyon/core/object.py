@@ -319,6 +319,79 @@ class IonMessageObjectBase(IonObjectBase):
     pass
 
 
+class IonObjectCodec(object):
+    """
+    Encoder/decoder for the objects of one IonObject class, prepared once from the class _schema.
+    Decoding fills the new object's __dict__ directly instead of instantiating the object with
+    all defaults and then overwriting each attribute with setattr.
+    Use get_object_codec to get the codec cached for a class.
+    """
+    def __init__(self, clzz):
+        self.clzz = clzz
+        self.type_name = clzz.__name__
+        self.fields = tuple(sorted(clzz._schema.keys()))
+        self.num_fields = len(self.fields)
+        self.built_in_attrs = tuple(sorted(BUILT_IN_ATTRS))
+
+    def encode(self, obj):
+        """Returns a dict with the schema and built-in attributes of given object (incl type_)"""
+        od = obj.__dict__
+        res = {k: od[k] for k in self.fields if k in od}
+        for k in self.built_in_attrs:
+            if k in od:
+                res[k] = od[k]
+        if 'type_' not in res:
+            res['type_'] = self.type_name
+        return res
+
+    def decode(self, objdict, discard_extra=False, validate=False):
+        """
+        Returns a new object with the values of given dict. Unicode values are converted to utf8.
+        Fields missing in the dict get their defaults. Attributes not in the schema are set
+        unless discard_extra is True, or raise AttributeError if validate is True.
+        """
+        clzz = self.clzz
+        obj = clzz.__new__(clzz)
+        od = obj.__dict__
+        found = 0
+        for k in self.fields:
+            if k in objdict:
+                v = objdict[k]
+                if v.__class__ is unicode:
+                    v = v.encode('utf8')
+                od[k] = v
+                found += 1
+        if found < self.num_fields:
+            # Incomplete (e.g. older version) object: instantiate with defaults and apply values
+            obj = clzz()
+            obj.__dict__.update(od)
+            od = obj.__dict__
+        od['type_'] = self.type_name
+
+        if len(objdict) > found + 1:
+            for k, v in objdict.iteritems():
+                if k in od or k == 'type_':
+                    continue
+                if k not in BUILT_IN_ATTRS and discard_extra:
+                    log.info('discard %s not in current schema' % k)
+                    continue
+                if k not in BUILT_IN_ATTRS and validate:
+                    raise AttributeError("'%s' object has no attribute '%s'" % (self.type_name, k))
+                if v.__class__ is unicode:
+                    v = v.encode('utf8')
+                od[k] = v
+        return obj
+
+
+def get_object_codec(clzz):
+    """Returns the IonObjectCodec for given IonObject class, creating and caching it on the class"""
+    codec = clzz.__dict__.get('_codec', None)
+    if codec is None:
+        codec = IonObjectCodec(clzz)
+        clzz._codec = codec
+    return codec
+
+
 def walk(o, cb, modify_key_value='value'):
     """
     Utility method to do recursive walking of a possible iterable (incl dicts) and return a
@@ -386,11 +459,7 @@ class IonObjectSerializer(IonObjectSerializationBase):
         def _transform(obj):
 
             if isinstance(obj, IonObjectBase):
-                res = {k:v for k, v in obj.__dict__.iteritems() if k in obj._schema or k in BUILT_IN_ATTRS}
-                if not 'type_' in res:
-                    res['type_'] = obj._get_type()
-
-                return res
+                return get_object_codec(obj.__class__).encode(obj)
 
             return obj
         return _transform
@@ -438,6 +507,10 @@ class IonObjectDeserializer(IonObjectSerializationBase):
             objc  = obj
             otype = objc['type_'].encode('ascii')   # Correct?
 
+            codec = self._obj_registry.get_codec(otype)
+            if codec is not None:
+                return codec.decode(objc, discard_extra=True)
+
             # don't supply a dict - we want the object to initialize with all its defaults intact,
             # which preserves things like IonEnumObject and invokes the setattr behavior we want there.
             ion_obj = self._obj_registry.new(otype)
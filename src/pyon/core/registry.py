@@ -6,7 +6,7 @@ import inspect
 from copy import deepcopy
 
 from pyon.core.exception import NotFound
-from pyon.core.object import walk
+from pyon.core.object import walk, get_object_codec
 
 import interface.objects
 import interface.messages
@@ -138,6 +138,27 @@ class IonObjectRegistry(object):
 
         from pyon.core.bootstrap import CFG
         self.validate_setattr = CFG.get_safe('container.objects.validate.setattr', False)
+        self._codecs = {}
+
+    def get_codec(self, _def):
+        """Returns the IonObjectCodec for given object type name, or None for enum types.
+        @param _def    Name of object type
+        """
+        codec = self._codecs.get(_def, None)
+        if codec is None:
+            if _def in model_classes:
+                clzz = model_classes[_def]
+            elif _def in message_classes:
+                clzz = message_classes[_def]
+            elif _def in enum_classes:
+                return None
+            else:
+                raise NotFound("No matching class found for name %s" % _def)
+            if self.validate_setattr:
+                self._set_validating_setattr(clzz)
+            codec = get_object_codec(clzz)
+            self._codecs[_def] = codec
+        return codec
 
     def new(self, _def, _dict=None, **kwargs):
         """Instantiates an IonObject based on given object type name and initial values.
@@ -157,13 +178,7 @@ class IonObjectRegistry(object):
 
         # Conditionally override the __setattr__ method to include additional client side validation
         if self.validate_setattr:
-            def validating_setattr(self, name, value):
-                from pyon.core.object import BUILT_IN_ATTRS
-                if name not in self._schema and name not in BUILT_IN_ATTRS:
-                    raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
-                self.__dict__[name] = value
-            setattrmethod = validating_setattr
-            setattr(clzz, "__setattr__", setattrmethod)
+            self._set_validating_setattr(clzz)
 
         if _dict:
             # Traverse input parameters looking for dict values being passed in as
@@ -187,3 +202,13 @@ class IonObjectRegistry(object):
             obj = clzz(**kwargs)
 
         return obj
+
+    def _set_validating_setattr(self, clzz):
+        """Overrides the __setattr__ method of given class to reject attributes not in the schema"""
+        def validating_setattr(self, name, value):
+            from pyon.core.object import BUILT_IN_ATTRS
+            if name not in self._schema and name not in BUILT_IN_ATTRS:
+                raise AttributeError("'%s' object has no attribute '%s'" % (type(self).__name__, name))
+            self.__dict__[name] = value
+        setattrmethod = validating_setattr
+        setattr(clzz, "__setattr__", setattrmethod)
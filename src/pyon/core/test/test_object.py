@@ -64,6 +64,46 @@ class ObjectTest(IonIntegrationTestCase):
         msg_obj.object = IonObject("Association")
         self.assertRaises(AttributeError, msg_obj._validate)
 
+    def test_codec(self):
+        from pyon.core.object import IonObjectSerializer, IonObjectDeserializer
+        obj = self.registry.new('Resource', name=u'caf\u00e9', description="desc")
+        obj.addl = {'key': 'value'}
+
+        codec = self.registry.get_codec('Resource')
+        self.assertIs(codec, self.registry.get_codec('Resource'))
+        self.assertEqual(codec.fields, tuple(sorted(obj._schema)))
+
+        obj_dict = codec.encode(obj)
+        self.assertEqual(obj_dict['type_'], 'Resource')
+        self.assertEqual(set(obj_dict.keys()), set(obj._schema.keys()) | {'type_'})
+
+        new_obj = codec.decode(obj_dict)
+        self.assertIsInstance(new_obj, type(obj))
+        self.assertEqual(new_obj.name, 'caf\xc3\xa9')
+        self.assertEqual(new_obj.addl, {'key': 'value'})
+        self.assertEqual(new_obj.type_, 'Resource')
+
+        # Missing fields get defaults, extra fields are kept or discarded
+        new_obj = codec.decode({'type_': 'Resource', 'name': 'foo', '_id': 'ID1', 'old_field': 1})
+        self.assertEqual(new_obj.name, 'foo')
+        self.assertEqual(new_obj.description, '')
+        self.assertEqual(new_obj._id, 'ID1')
+        self.assertEqual(new_obj.old_field, 1)
+        new_obj = codec.decode({'type_': 'Resource', 'name': 'foo', 'old_field': 1}, discard_extra=True)
+        self.assertFalse(hasattr(new_obj, 'old_field'))
+        with self.assertRaises(AttributeError):
+            codec.decode({'type_': 'Resource', 'name': 'foo', 'old_field': 1}, validate=True)
+        new_obj = codec.decode({'type_': 'Resource', 'name': 'foo', '_id': 'ID1'}, validate=True)
+        self.assertEqual(new_obj._id, 'ID1')
+
+        # Round trip through the datastore serializers
+        serializer = IonObjectSerializer()
+        deserializer = IonObjectDeserializer(obj_registry=self.registry)
+        obj.name = 'foo'
+        obj_dict = serializer.serialize(obj)
+        self.assertEqual(obj_dict['type_'], 'Resource')
+        self.assertEqual(deserializer.deserialize(obj_dict), obj)
+
     def test_bootstrap(self):
         """ Use the factory and singleton from bootstrap.py/public.py """
         obj = IonObject('SampleObject')
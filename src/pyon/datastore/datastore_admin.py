@@ -171,6 +171,44 @@ class DatastoreAdmin(object):
         finally:
             ds.close()
 
+    def migrate_jsonb(self, ds_name=None):
+        """
+        Converts the document storage of a datastore (or of all ION datastores) from json to jsonb
+        in place and creates the jsonb indexes declared by the datastore's profile.
+        Set server.postgresql.doc_storage to jsonb to create new datastores with jsonb and use
+        jsonb specific queries; restart running containers after migration.
+        @retval  dict of datastore name to list of converted tables
+        """
+        ds_list = [ds_name] if ds_name else ['resources', 'objects', 'state', 'events']
+        migrated = {}
+        for dsn in ds_list:
+            ds = DatastoreFactory.get_datastore(datastore_name=dsn, config=self.config, scope=self.sysname)
+            try:
+                if not hasattr(ds, "migrate_doc_storage"):
+                    raise BadRequest("Datastore does not support jsonb storage: %s" % dsn)
+                if not ds.datastore_exists(dsn):
+                    log.warn("Datastore does not exist: %s" % dsn)
+                    continue
+                migrated[dsn] = ds.migrate_doc_storage(dsn)
+            finally:
+                ds.close()
+        return migrated
+
+    def migrate_fulltext(self, ds_name=None):
+        """
+        Adds the full-text search column and index to a resources datastore created by an earlier
+        version and indexes all existing resources. Restart running containers afterwards.
+        @retval  number of resources indexed
+        """
+        ds_name = ds_name or 'resources'
+        ds = DatastoreFactory.get_datastore(datastore_name=ds_name, config=self.config, scope=self.sysname)
+        try:
+            if not hasattr(ds, "migrate_fulltext"):
+                raise BadRequest("Datastore does not support full-text search: %s" % ds_name)
+            return ds.migrate_fulltext(ds_name)
+        finally:
+            ds.close()
+
     def get_blame_objects(self):
         ds_list = ['resources', 'objects', 'state', 'events']
         blame_objs = {}
@@ -11,7 +11,9 @@ and sent as service arguments.
 
 __author__ = 'Michael Meisinger'
 
+import base64
 import datetime
+import json
 import time
 
 from pyon.core.exception import BadRequest
@@ -50,6 +52,7 @@ class DatastoreQueryConst(object):
     XOP_KEYWORD = XOP_PREFIX + "keyword"    # Find objects with 1..n keywords
     XOP_ALTID = XOP_PREFIX + "altid"        # Find objects with an altid in given values
     XOP_ISTYPE = XOP_PREFIX + "istype"      # Find objects with type or base type equal to given value (e.g. events)
+    XOP_FULLTEXT = XOP_PREFIX + "fulltext"  # Find resources matching given full-text search terms (ordered by rank)
 
     GOP_PREFIX = "gop:"                               # Geospatial operators prefix
     GOP_OVERLAPS_BBOX = GOP_PREFIX + "overlaps"       # Find objects with geometry overlapping given bbox
@@ -101,6 +104,12 @@ class DatastoreQueryConst(object):
     QTYPE_ASSOC = "qt:association"
     QTYPE_OBJ = "qt:object"
 
+    # Aggregates
+    AGG_PREFIX = "agg:"
+    AGG_COUNT = AGG_PREFIX + "count"                # Count of matching objects
+    AGG_DISTINCT = AGG_PREFIX + "distinct"          # Distinct values of given attributes
+    AGG_GROUP_COUNT = AGG_PREFIX + "group_count"    # Distinct values of given attributes with count of objects
+
     # Order
     ORDER_ASC = "asc"
     ORDER_DESC = "desc"
@@ -283,6 +292,13 @@ class DatastoreQueryBuilder(DatastoreQueryConst):
         else:
             return self.op_expr(self.XOP_ATTILIKE, attr, value)
 
+    def fulltext(self, value):
+        """
+        Full-text search for resources matching all given words in name, description, keywords
+        and configured attributes. Results are ordered by relevance unless order_by is set.
+        """
+        return self.op_expr(self.XOP_FULLTEXT, value)
+
     # --- Range operators
 
     def overlaps_range(self, col, x1, y1):
@@ -376,6 +392,51 @@ class DatastoreQueryBuilder(DatastoreQueryConst):
         if id_only is not None:
             qargs["id_only"] = id_only
 
+    def set_keyset_paging(self, limit, page_token=None):
+        """
+        Sets keyset (seek) pagination instead of skip. Results are ordered by the order_by columns
+        (which must all have the same sort order) and id. The datastore returns an opaque token in the
+        query result (_result.next_page_token) that continues after the last row of the current page
+        when given for the next page.
+        """
+        qargs = self.query["query_args"]
+        qargs["keyset"] = True
+        qargs["limit"] = limit
+        qargs["skip"] = 0
+        qargs["page_token"] = page_token or ""
+
+    def set_projection(self, *attrs):
+        """
+        Sets a list of attribute names (or attribute paths such as details.name) to return instead of
+        full objects, if not id_only. The datastore then returns dicts with these attributes and _id
+        and type_ without creating objects. Call without arguments to return full objects again.
+        """
+        qargs = self.query["query_args"]
+        if attrs:
+            qargs["projection"] = [self._get_attname(attr) for attr in attrs]
+        else:
+            qargs.pop("projection", None)
+
+    def set_aggregate(self, aggregate, *columns):
+        """
+        Sets an aggregate function so that the query returns a count of matching objects (AGG_COUNT),
+        the distinct values of the given columns (AGG_DISTINCT) or the distinct values of the given
+        columns with a count for each (AGG_GROUP_COUNT) instead of the objects themselves.
+        Columns are standard attributes (e.g. ra:lcstate) or attribute paths (e.g. details.name).
+        Set aggregate to None to remove the aggregate function.
+        """
+        qargs = self.query["query_args"]
+        if not aggregate:
+            qargs.pop("aggregate", None)
+            qargs.pop("aggregate_cols", None)
+            return
+        if aggregate not in (self.AGG_COUNT, self.AGG_DISTINCT, self.AGG_GROUP_COUNT):
+            raise BadRequest("Unknown aggregate: %s" % aggregate)
+        if aggregate != self.AGG_COUNT and not columns:
+            raise BadRequest("Aggregate %s requires columns" % aggregate)
+        qargs["aggregate"] = aggregate
+        qargs["aggregate_cols"] = [self._get_attname(col) for col in columns]
+
     def set_query_parameters(self, params):
         if not params:
             return
@@ -405,6 +466,22 @@ class DatastoreQueryBuilder(DatastoreQueryConst):
             return str(int(value))
         return str(value)
 
+    @classmethod
+    def create_page_token(cls, key_values):
+        """Returns an opaque continuation token for keyset paging from the last row's order key values"""
+        return base64.urlsafe_b64encode(json.dumps(list(key_values)))
+
+    @classmethod
+    def parse_page_token(cls, page_token):
+        """Returns the list of order key values from a continuation token for keyset paging"""
+        try:
+            key_values = json.loads(base64.urlsafe_b64decode(str(page_token)))
+        except Exception:
+            raise BadRequest("Invalid page token")
+        if type(key_values) is not list:
+            raise BadRequest("Invalid page token")
+        return key_values
+
     @classmethod
     def check_query(cls, query):
         """Check a query expression (dict) for basic compliance"""
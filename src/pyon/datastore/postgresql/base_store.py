@@ -4,12 +4,17 @@
 
 __author__ = 'Michael Meisinger'
 
+import calendar
+import datetime
 import getpass
 import os.path
+import re
+import time
 from uuid import uuid4
 # Note: standard json is faster than simplejson for dumps
 # See https://confluence.oceanobservatories.org/display/CIDev/Container+Messaging+Performance
 import json
+import gevent.pool
 
 try:
     import psycopg2
@@ -25,7 +30,8 @@ from pyon.datastore.datastore_common import DataStore, get_obj_geospatial_bounds
     get_obj_temporal_bounds, get_obj_vertical_bounds, get_obj_geometry
 from pyon.datastore.datastore_query import DQ
 from pyon.datastore.postgresql.pg_util import PostgresConnectionPool, StatementBuilder, psycopg2_connect, TracingCursor
-from pyon.util.containers import create_basic_identifier, parse_ion_ts, DotDict
+from pyon.datastore.postgresql.pg_profiler import start_query_profiler
+from pyon.util.containers import create_basic_identifier, get_ion_ts, get_safe, parse_ion_ts, DotDict
 from pyon.util.tracer import CallTracer
 
 TABLE_PREFIX = "ion_"
@@ -33,19 +39,51 @@ DEFAULT_USER = "ion"
 DEFAULT_DBNAME = "ion"
 DEFAULT_PROFILE = "BASIC"
 GEOSPATIAL_COLS = {"geom", "geom_loc", "geom_mpoly"}
+DOC_STORAGE_TYPES = {"json", "jsonb"}
+PARTITION_INTERVALS = {"none", "daily", "monthly"}
+PARTITION_RETRY_INTERVAL = 600      # Seconds before inserts retry to create a partition that failed
 NUMRANGE_COLS = {"vertical_range", "temporal_range"}
+FULLTEXT_COL = "search_tsv"
 
 # Mapping of object type to table name extension and special attribute names
-OBJ_SPECIAL = {"R": ("", ("type_", "lcstate", "availability", "visibility", "name", "ts_created", "ts_updated", "geom", "geom_loc", "geom_mpoly", "vertical_range", "temporal_range")),
+OBJ_SPECIAL = {"R": ("", ("type_", "lcstate", "availability", "visibility", "name", "ts_created", "ts_updated", "geom", "geom_loc", "geom_mpoly", "vertical_range", "temporal_range", FULLTEXT_COL)),
                "A": ("_assoc", ("s", "st", "p", "o", "ot", "retired")),
                "D": ("_dir", ("org", "parent", "key")),
                "E": ("", ("origin", "origin_type", "sub_type", "ts_created", "type_")),
                }
 OBJ_TYPE_PRECED = {"R": 1, "A": 2, "D": 3}
+# Column types for special attribute columns other than varchar (for casts from text in bulk inserts)
+COLUMN_TYPES = {"visibility": "int", "retired": "boolean"}
 
 # Shared connection pool for container
 pg_connection_pool = None
 
+_RE_PARTITION_END = re.compile(r"TO \('(\d+)'\)")
+
+
+def _datetime_to_ion_ts(dt):
+    return str(calendar.timegm(dt.timetuple()) * 1000)
+
+
+def get_partition_range(ts, interval):
+    """
+    Returns a tuple (name suffix, start ts, end ts) for the ts_created range partition containing
+    the given ION timestamp (millis in UNIX epoch as str). Partition boundaries are in UTC.
+    @param interval  Partition interval: daily or monthly
+    """
+    dt = datetime.datetime.utcfromtimestamp(parse_ion_ts(ts))
+    if interval == "daily":
+        start_dt = datetime.datetime(dt.year, dt.month, dt.day)
+        end_dt = start_dt + datetime.timedelta(days=1)
+        suffix = start_dt.strftime("p%Y%m%d")
+    elif interval == "monthly":
+        start_dt = datetime.datetime(dt.year, dt.month, 1)
+        end_dt = datetime.datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+        suffix = start_dt.strftime("p%Y%m")
+    else:
+        raise BadRequest("Unknown partition interval: %s" % interval)
+    return suffix, _datetime_to_ion_ts(start_dt), _datetime_to_ion_ts(end_dt)
+
 
 class PostgresDataStore(DataStore):
     """
@@ -74,7 +112,29 @@ class PostgresDataStore(DataStore):
         self.database = self.config.get('database', None) or DEFAULT_DBNAME
         self.default_database = self.config.get('default_database', None) or 'postgres'
         self.pool_maxsize = int(self.config.get('connection_pool_max', 4))
+        self.prepare_statements = bool(self.config.get('prepare_statements', True))
+        self.max_prepared = int(self.config.get('max_prepared_statements', 200))
+        self.pool_args = dict(max_prepared=self.max_prepared,
+                              checkout_timeout=float(self.config.get('connection_checkout_timeout', 0) or 0),
+                              max_lifetime=float(self.config.get('connection_max_lifetime', 0) or 0),
+                              idle_timeout=float(self.config.get('connection_idle_timeout', 0) or 0))
+        self.pool_validate_interval = float(self.config.get('connection_validate_interval', 0) or 0)
+        self.iter_chunk_size = int(self.config.get('iter_chunk_size', 1000))
+        self.read_chunk_size = int(self.config.get('read_chunk_size', 2000))
+        self.read_parallel = min(int(self.config.get('read_parallel', 3)), self.pool_maxsize)
         self.db_init = self.config.get('db_init', None) or "res/datastore/postgresql/db_init.sql"
+        self.doc_storage = self.config.get('doc_storage', None) or "json"
+        if self.doc_storage not in DOC_STORAGE_TYPES:
+            raise BadRequest("Unknown doc_storage: %s" % self.doc_storage)
+        self._doc_types = {}    # Cache of document column type per table
+        self.events_partitioning = self.config.get('events_partitioning', None) or "none"
+        if self.events_partitioning not in PARTITION_INTERVALS:
+            raise BadRequest("Unknown events_partitioning: %s" % self.events_partitioning)
+        self.events_retention_days = float(self.config.get('events_retention_days', 0) or 0)
+        self._partitions = {}   # Cache of existing partition names per partitioned table (None if not partitioned)
+        self._partition_failures = {}   # Partition name -> time after which inserts may retry a failed create
+        self.fulltext_attributes = self.config.get('fulltext_attributes', None) or {}
+        self._table_columns = {}    # Cache of optional column existence per (table, column)
 
         # Database (Postgres database) and datastore (database table) name handling.
         # Scope database with given scope (e.g. sysname).
@@ -95,7 +155,11 @@ class PostgresDataStore(DataStore):
         log.debug("Using Postgres connection DSN: %s", clean_dsn)
         global pg_connection_pool
         if not pg_connection_pool:
-            pg_connection_pool = PostgresConnectionPool(dsn, maxsize=self.pool_maxsize)
+            pg_connection_pool = PostgresConnectionPool(dsn, maxsize=self.pool_maxsize, **self.pool_args)
+            pg_connection_pool.start_validation(self.pool_validate_interval)
+            profiler_cfg = self.config.get('query_profiler', None) or {}
+            if profiler_cfg.get('enabled', False):
+                start_query_profiler(profiler_cfg)
         self.pool = pg_connection_pool
         try:
             with self.pool.connection() as conn:
@@ -112,6 +176,9 @@ class PostgresDataStore(DataStore):
         if self.datastore_name:
             if not self.datastore_exists():
                 self.create_datastore()
+            if self.profile == DataStore.DS_PROFILE.RESOURCES:
+                # Determine once outside of statement transactions
+                self._has_column(self._get_datastore_name(), FULLTEXT_COL)
 
         log.debug("PostgresDataStore: created instance database=%s, datastore_name=%s, profile=%s, scope=%s",
                  self.database, self.datastore_name, self.profile, self.scope)
@@ -153,6 +220,7 @@ class PostgresDataStore(DataStore):
         global pg_connection_pool
         if pg_connection_pool:
             log.info("Closing %s shared Postgres datastore connections", pg_connection_pool.size)
+            log.debug("Connection pool stats: %s", pg_connection_pool.get_stats())
             pg_connection_pool.closeall()
             pg_connection_pool = None
 
@@ -227,9 +295,19 @@ class PostgresDataStore(DataStore):
         profile = profile.lower()
         if not os.path.exists("res/datastore/postgresql/profile_%s.sql" % profile):
             profile = "basic"
+        profile_file = "res/datastore/postgresql/profile_%s.sql" % profile
+        if profile == "events" and self.events_partitioning != "none":
+            # Range partitioned by ts_created (Postgres 11+)
+            profile_file = "res/datastore/postgresql/profile_events_partitioned.sql"
         profile_sql = None
-        with open("res/datastore/postgresql/profile_%s.sql" % profile, "r") as f:
+        with open(profile_file, "r") as f:
             profile_sql = f.read()
+        if profile == "resources":
+            # Functions for the full-text search column
+            profile_sql = self._get_fulltext_init_sql() + "\n" + profile_sql
+        if self.doc_storage == "jsonb":
+            # Functions for jsonb documents and jsonb specific indexes
+            profile_sql = self._get_jsonb_init_sql() + "\n" + profile_sql + "\n" + self._get_jsonb_profile_sql(profile)
 
         with psycopg2_connect(c_host=self.host, c_port=self.port, c_dbname=self.database,
                               c_user=self.admin_username, c_password=self.admin_password,
@@ -237,7 +315,7 @@ class PostgresDataStore(DataStore):
             conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
             with conn.cursor() as cur:
                 try:
-                    cur.execute(profile_sql % dict(ds=qual_ds_name))
+                    cur.execute(profile_sql % dict(ds=qual_ds_name, doc_type=self.doc_storage))
                 except ProgrammingError as err:
                     # Todo: correct error messages
                     raise BadRequest("Datastore error " + err.message)
@@ -245,8 +323,268 @@ class PostgresDataStore(DataStore):
                     raise BadRequest("Datastore %s create error: %s" % (datastore_name, de))
                 except Exception as de:
                     raise BadRequest("Datastore %s create error: %s" % (datastore_name, de))
+        self._doc_types.pop(qual_ds_name, None)
+        self._partitions.pop(qual_ds_name, None)
+        self._table_columns.clear()
         log.debug("Datastore '%s' created" % (qual_ds_name))
 
+        if profile == "events" and self.events_partitioning != "none":
+            self.maintain_partitions(datastore_name)
+
+    def _get_jsonb_init_sql(self):
+        """Returns the SQL defining the query functions for jsonb documents (escaped for profile formatting)"""
+        jsonb_init = os.path.join(os.path.dirname(self.db_init), "db_init_jsonb.sql")
+        with open(jsonb_init, "r") as f:
+            return f.read().replace("%", "%%")
+
+    def _get_fulltext_init_sql(self):
+        """Returns the SQL defining the functions for full-text search (escaped for profile formatting)"""
+        fulltext_init = os.path.join(os.path.dirname(self.db_init), "db_init_fulltext.sql")
+        with open(fulltext_init, "r") as f:
+            return f.read().replace("%", "%%")
+
+    def _get_jsonb_profile_sql(self, profile):
+        """Returns the SQL creating the jsonb specific indexes of a profile, or empty string"""
+        profile_file = "res/datastore/postgresql/profile_%s_jsonb.sql" % profile
+        if not os.path.exists(profile_file):
+            return ""
+        with open(profile_file, "r") as f:
+            return f.read()
+
+    def get_doc_type(self, datastore_name=None, table_ext=""):
+        """
+        Returns the type of the document column (json or jsonb) of a datastore table.
+        Determined from the database once per table, because the column type may differ
+        from configured doc_storage for datastores created before a change.
+        """
+        table_name = self._get_datastore_name(datastore_name) + table_ext
+        doc_type = self._doc_types.get(table_name, None)
+        if doc_type is None:
+            with self.pool.cursor(**self.cursor_args) as cur:
+                cur.execute("SELECT data_type FROM information_schema.columns WHERE table_name=%s AND column_name='doc'",
+                            (table_name,))
+                row = cur.fetchone()
+            if not row:
+                return "json"
+            doc_type = row[0]
+            self._doc_types[table_name] = doc_type
+        return doc_type
+
+    def migrate_doc_storage(self, datastore_name=None, profile=None):
+        """
+        Converts the document columns of a datastore's tables from json to jsonb in place and creates
+        the jsonb specific indexes of the profile. Indexes on the document column are rebuilt by Postgres.
+        The tables are locked during conversion. Running processes must be restarted afterwards.
+        @retval  list of converted table names
+        """
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        profile = profile or self.profile or DEFAULT_PROFILE
+        if profile == DataStore.DS_PROFILE.DIRECTORY:
+            profile = DataStore.DS_PROFILE.RESOURCES
+        profile = profile.lower()
+        log.info("Migrating datastore '%s' to jsonb document storage", qual_ds_name)
+
+        converted = []
+        with psycopg2_connect(c_host=self.host, c_port=self.port, c_dbname=self.database,
+                              c_user=self.admin_username, c_password=self.admin_password,
+                              tracer=self._call_tracer, trace_stmt="MIGRATE jsonb") as conn:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(self._get_jsonb_init_sql().replace("%%", "%"))
+                cur.execute("SELECT table_name FROM information_schema.columns WHERE table_schema='public' "
+                            "AND column_name='doc' AND data_type='json' AND table_name IN (%s,%s,%s)",
+                            (qual_ds_name, qual_ds_name + "_assoc", qual_ds_name + "_dir"))
+                for row in cur.fetchall():
+                    table_name = row[0]
+                    log.info("Converting table %s to jsonb", table_name)
+                    cur.execute('ALTER TABLE "%s" ALTER COLUMN doc TYPE jsonb USING doc::jsonb' % table_name)
+                    converted.append(table_name)
+                profile_sql = self._get_jsonb_profile_sql(profile)
+                if profile_sql:
+                    cur.execute(profile_sql % dict(ds=qual_ds_name, doc_type="jsonb"))
+                cur.execute('ANALYZE "%s"' % qual_ds_name)
+
+        self._doc_types.clear()
+        log.info("Datastore '%s' migrated to jsonb (%s tables converted)", qual_ds_name, len(converted))
+        return converted
+
+    def _has_column(self, table_name, column_name, cur=None):
+        """
+        Returns True if a table has a column that may not exist in datastores created by earlier versions.
+        @param cur  Cursor of the caller, if any. Used so that no second pool connection is checked out
+        """
+        has_column = self._table_columns.get((table_name, column_name), None)
+        if has_column is None:
+            statement = "SELECT EXISTS(SELECT 1 FROM information_schema.columns WHERE table_name=%s AND column_name=%s)"
+            if cur is not None:
+                cur.execute(statement, (table_name, column_name))
+                has_column = cur.fetchone()[0]
+            else:
+                with self.pool.cursor(**self.cursor_args) as cur:
+                    cur.execute(statement, (table_name, column_name))
+                    has_column = cur.fetchone()[0]
+            self._table_columns[(table_name, column_name)] = has_column
+        return has_column
+
+    def migrate_fulltext(self, datastore_name=None):
+        """
+        Adds the full-text search column and index to a resources datastore created by an earlier version
+        and computes the search column for all existing resources.
+        @retval  number of resources indexed
+        """
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        log.info("Adding full-text search to datastore '%s'", qual_ds_name)
+        with psycopg2_connect(c_host=self.host, c_port=self.port, c_dbname=self.database,
+                              c_user=self.admin_username, c_password=self.admin_password,
+                              tracer=self._call_tracer, trace_stmt="MIGRATE fulltext") as conn:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(self._get_fulltext_init_sql().replace("%%", "%"))
+                cur.execute('ALTER TABLE "%s" ADD COLUMN IF NOT EXISTS %s tsvector' % (qual_ds_name, FULLTEXT_COL))
+                cur.execute('CREATE INDEX IF NOT EXISTS "%s_search_idx" ON "%s" USING GIN (%s)' % (
+                            qual_ds_name, qual_ds_name, FULLTEXT_COL))
+        self._table_columns.clear()
+
+        num_indexed = 0
+        while True:
+            with self.pool.cursor(**self.cursor_args) as cur:
+                cur.execute("SELECT id, doc FROM " + qual_ds_name + " WHERE " + FULLTEXT_COL + " IS NULL LIMIT %s",
+                            (self.iter_chunk_size,))
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                ids = [row[0] for row in rows]
+                values = [self._get_fulltext_value(self._prep_doc(row[1])) for row in rows]
+                cur.execute("UPDATE " + qual_ds_name + " AS r SET " + FULLTEXT_COL + "=json_fulltext(u.parts::json) "
+                            "FROM (SELECT unnest(%(ids)s::text[]) AS id, unnest(%(parts)s::text[]) AS parts) AS u "
+                            "WHERE r.id=u.id", dict(ids=ids, parts=values))
+            num_indexed += len(rows)
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            cur.execute('ANALYZE "%s"' % qual_ds_name)
+        log.info("Datastore '%s' full-text search added (%s resources indexed)", qual_ds_name, num_indexed)
+        return num_indexed
+
+    def _get_partitions(self, qual_ds_name):
+        """
+        Returns the set of names of the existing partitions of a range partitioned table, or None
+        if the table is not partitioned. Determined from the database once per table.
+        """
+        partitions = self._partitions.get(qual_ds_name, False)
+        if partitions is False:
+            with self.pool.cursor(**self.cursor_args) as cur:
+                cur.execute("SELECT EXISTS(SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid=pt.partrelid "
+                            "WHERE c.relname=%s)", (qual_ds_name,))
+                if cur.fetchone()[0]:
+                    cur.execute("SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid=i.inhrelid "
+                                "JOIN pg_class p ON p.oid=i.inhparent WHERE p.relname=%s", (qual_ds_name,))
+                    partitions = set(row[0] for row in cur.fetchall())
+                else:
+                    partitions = None
+            self._partitions[qual_ds_name] = partitions
+        return partitions
+
+    def _ensure_partitions(self, qual_ds_name, ts_list, retry_failed=False):
+        """
+        Creates the missing ts_created range partitions of an events table for the given timestamps.
+        Does nothing if partitioning is disabled or the table is not partitioned.
+        Rows without a valid timestamp or partition go to the default partition.
+        @param retry_failed  If False, partitions that failed to be created recently are not tried again
+                             (left to maintain_partitions)
+        """
+        if self.events_partitioning == "none":
+            return
+        partitions = self._get_partitions(qual_ds_name)
+        if partitions is None:
+            return
+        missing = {}
+        now = time.time()
+        for ts in ts_list:
+            if not ts or not isinstance(ts, basestring) or not ts.isdigit():
+                continue
+            suffix, start_ts, end_ts = get_partition_range(ts, self.events_partitioning)
+            part_name = "%s_%s" % (qual_ds_name, suffix)
+            if part_name in partitions:
+                continue
+            if not retry_failed and self._partition_failures.get(part_name, 0) > now:
+                continue
+            missing[part_name] = (start_ts, end_ts)
+        if not missing:
+            return
+
+        # Partitions must be created by the table owner
+        with psycopg2_connect(c_host=self.host, c_port=self.port, c_dbname=self.database,
+                              c_user=self.admin_username, c_password=self.admin_password,
+                              tracer=self._call_tracer, trace_stmt="CREATE PARTITION") as conn:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                for part_name, (start_ts, end_ts) in sorted(missing.iteritems()):
+                    try:
+                        cur.execute('CREATE TABLE IF NOT EXISTS "%s" PARTITION OF "%s" FOR VALUES FROM (%%s) TO (%%s)' % (
+                                    part_name, qual_ds_name), (start_ts, end_ts))
+                    except DatabaseError as de:
+                        # E.g. rows in the default partition - back off, maintain_partitions retries
+                        log.warn("Could not create partition %s: %s", part_name, de)
+                        self._partition_failures[part_name] = time.time() + PARTITION_RETRY_INTERVAL
+                        continue
+                    log.info("Created partition %s for ts_created [%s, %s)", part_name, start_ts, end_ts)
+                    partitions.add(part_name)
+                    self._partition_failures.pop(part_name, None)
+
+    def _ensure_doc_partitions(self, qual_ds_name, docs):
+        """Creates missing partitions before inserting the given documents into an events datastore"""
+        if self.events_partitioning != "none" and self.profile == DataStore.DS_PROFILE.EVENTS:
+            self._ensure_partitions(qual_ds_name, [doc.get("ts_created", None) for doc in docs])
+
+    def purge_partitions(self, datastore_name=None, retention_days=None):
+        """
+        Drops all ts_created range partitions of a partitioned events table that lie entirely before the
+        retention period. Dropping a partition is instant and leaves no dead rows, unlike DELETE.
+        @param retention_days  Number of days to keep. Defaults to configured events_retention_days (0 keeps all)
+        @retval  list of dropped partition names
+        """
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        retention_days = self.events_retention_days if retention_days is None else float(retention_days)
+        if retention_days <= 0 or self._get_partitions(qual_ds_name) is None:
+            return []
+        cutoff_ts = int(get_ion_ts()) - int(retention_days * 86400000)
+
+        dropped = []
+        with psycopg2_connect(c_host=self.host, c_port=self.port, c_dbname=self.database,
+                              c_user=self.admin_username, c_password=self.admin_password,
+                              tracer=self._call_tracer, trace_stmt="DROP PARTITION") as conn:
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute("SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+                            "JOIN pg_class c ON c.oid=i.inhrelid JOIN pg_class p ON p.oid=i.inhparent "
+                            "WHERE p.relname=%s", (qual_ds_name,))
+                for part_name, part_bound in cur.fetchall():
+                    end_match = _RE_PARTITION_END.search(part_bound or "")
+                    if not end_match or int(end_match.group(1)) > cutoff_ts:
+                        continue
+                    cur.execute('DROP TABLE IF EXISTS "%s"' % part_name)
+                    dropped.append(part_name)
+
+        self._partitions.pop(qual_ds_name, None)
+        if dropped:
+            log.info("Purged %s partitions of '%s' older than %s days: %s", len(dropped), qual_ds_name,
+                     retention_days, sorted(dropped))
+        return dropped
+
+    def maintain_partitions(self, datastore_name=None):
+        """
+        Creates the partitions for the current and the next time interval ahead of time and drops
+        partitions past the retention period. Call periodically, e.g. from the event persister.
+        @retval  list of dropped partition names
+        """
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        if self.events_partitioning == "none" or self._get_partitions(qual_ds_name) is None:
+            return []
+        now_ts = get_ion_ts()
+        _, _, next_ts = get_partition_range(now_ts, self.events_partitioning)
+        self._ensure_partitions(qual_ds_name, [now_ts, next_ts], retry_failed=True)
+        return self.purge_partitions(datastore_name)
+
     def delete_datastore(self, datastore_name=None):
         """
         Delete the datastore with the given name.  This is
@@ -268,7 +606,7 @@ class PostgresDataStore(DataStore):
                 table_del = 0
                 for table in table_list:
                     if table.startswith(qual_ds_name):
-                        statement = "DROP TABLE "+table+" CASCADE"
+                        statement = "DROP TABLE IF EXISTS "+table+" CASCADE"
                         cur.execute(statement)
                         # print self.database, statement, cur.rowcount
                         table_del += abs(cur.rowcount)
@@ -307,7 +645,8 @@ class PostgresDataStore(DataStore):
         Lists all logical datastores within current database without any scope or prefix.
         """
         with self.pool.cursor(**self.cursor_args) as cur:
-            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public'")
+            cur.execute("SELECT table_name FROM information_schema.tables WHERE table_schema='public' "
+                        "AND table_name NOT IN (SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid=i.inhrelid)")
             table_list = cur.fetchall()
             table_list = [e[0] for e in table_list]
 
@@ -377,6 +716,13 @@ class PostgresDataStore(DataStore):
         qual_ds_name = self._get_datastore_name(datastore_name)
         return []
 
+    def _execute(self, cur, statement, statement_args=None, prepare=False):
+        """Executes a statement on the cursor. If prepare is set and enabled in the config, uses a
+        server-side prepared statement cached per connection to avoid repeated parsing and planning.
+        Only use for statements with a stable shape and all values passed as arguments."""
+        if prepare and self.prepare_statements:
+            return self.pool.execute_prepared(cur, statement, statement_args)
+        return cur.execute(statement, statement_args)
 
     def _get_geom_value(self, col, doc):
         """For a given geospatial database column name, return the appropriate representation given a document"""
@@ -430,15 +776,39 @@ class PostgresDataStore(DataStore):
             log.warn("Could not compute value for numrange column %s: %s", col, ex)
         return res
 
+    def _get_fulltext_value(self, doc):
+        """
+        Returns the texts for the full-text search column of a resource as JSON array by weight:
+        name; description and keywords; attributes configured for the resource type.
+        """
+        def get_texts(value):
+            if isinstance(value, basestring):
+                return [value] if value else []
+            elif type(value) in (list, tuple):
+                return [val for val in value if val and isinstance(val, basestring)]
+            return []
+
+        name_texts = get_texts(doc.get("name", None))
+        desc_texts = get_texts(doc.get("description", None)) + get_texts(doc.get("keywords", None))
+        attr_texts = []
+        for attr in self.fulltext_attributes.get(doc.get("type_", None), None) or []:
+            attr_texts.extend(get_texts(get_safe(doc, attr)))
+        return json.dumps([" ".join(texts) for texts in (name_texts, desc_texts, attr_texts)])
+
+    def _get_column_value(self, col, doc):
+        """Returns the value for a special attribute database column given a document"""
+        if col in GEOSPATIAL_COLS:
+            return self._get_geom_value(col, doc)
+        elif col in NUMRANGE_COLS:
+            return self._get_range_value(col, doc)
+        elif col == FULLTEXT_COL:
+            return self._get_fulltext_value(doc)
+        return doc.get(col, None)
+
     def _create_value_expression(self, col, doc, valuename, value_dict, allow_null_values=False, assign=False):
         """Returns part of an SQL statement to insert or update a value for a column.
         Places the value into a dict for the DB client to convert properly"""
-        if col in GEOSPATIAL_COLS:
-            value = self._get_geom_value(col, doc)
-        elif col in NUMRANGE_COLS:
-            value = self._get_range_value(col, doc)
-        else:
-            value = doc.get(col, None)
+        value = self._get_column_value(col, doc)
 
         if allow_null_values or value or type(value) is bool:
             insert_expr = ", "
@@ -448,6 +818,8 @@ class PostgresDataStore(DataStore):
                 insert_expr += "ST_GeomFromText(%(" + valuename + ")s,4326)"
             elif col in NUMRANGE_COLS:
                 insert_expr += "%(" + valuename + ")s::numrange"
+            elif col == FULLTEXT_COL:
+                insert_expr += "json_fulltext(%(" + valuename + ")s::json)"
             else:
                 insert_expr += "%(" + valuename + ")s"
             value_dict[valuename] = value
@@ -463,6 +835,7 @@ class PostgresDataStore(DataStore):
         if '_rev' in doc:
             raise BadRequest("Doc must not have '_rev'")
         #log.debug('create_doc(): Create document id=%s', "id")
+        self._ensure_doc_partitions(qual_ds_name, [doc])
 
         with self.pool.cursor(**self.cursor_args) as cur:
             try:
@@ -474,19 +847,18 @@ class PostgresDataStore(DataStore):
                 doc["_rev"] = "1"
                 doc_json = json.dumps(doc)
 
-                extra_cols, table = self._get_extra_cols(doc, qual_ds_name, self.profile)
+                extra_cols, table = self._get_extra_cols(doc, qual_ds_name, self.profile, cur=cur)
 
+                # All columns of the object type are set (NULL if unset), so that there is one
+                # prepared statement per object type
                 statement_args = dict(id=doc["_id"], doc=doc_json)
                 xcol, xval = "", ""
-                if extra_cols:
-                    for col in extra_cols:
-                        insert_expr = self._create_value_expression(col, doc, col, statement_args)
-                        if insert_expr:
-                            xcol += ", %s" % col
-                            xval += insert_expr
+                for col in extra_cols:
+                    xcol += ", %s" % col
+                    xval += self._create_value_expression(col, doc, col, statement_args, allow_null_values=True)
 
                 statement = "INSERT INTO " + table + " (id, rev, doc" + xcol + ") VALUES (%(id)s, 1, %(doc)s" + xval + ")"
-                cur.execute(statement, statement_args)
+                self._execute(cur, statement, statement_args, prepare=True)
                 oid, version = doc["_id"], "1"
             except IntegrityError as ie:
                 if "_assoc_entry_unique" in ie.message:
@@ -504,8 +876,10 @@ class PostgresDataStore(DataStore):
 
         return oid, version
 
-    def create_doc_mult(self, docs, object_ids=None, datastore_name=None):
-        """Creates a list of objects and returns 3-tuples of (Success, id, rev)."""
+    def create_doc_mult(self, docs, object_ids=None, datastore_name=None, bulk_insert=False):
+        """Creates a list of objects and returns 3-tuples of (Success, id, rev).
+        If bulk_insert is True, inserts the objects with a constant size statement passing one array
+        value per column, which avoids building and binding a huge statement for large batches."""
         if type(docs) is not list:
             raise BadRequest("Invalid type for docs:%s" % type(docs))
         if object_ids and len(object_ids) != len(docs):
@@ -515,56 +889,114 @@ class PostgresDataStore(DataStore):
         log.debug('create_doc_mult(): create %s documents', len(docs))
 
         qual_ds_name = self._get_datastore_name(datastore_name)
+        self._ensure_doc_partitions(qual_ds_name, docs)
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            self._create_doc_mult(cur, docs, object_ids, qual_ds_name, bulk_insert=bulk_insert)
+
+        result_list = [(True, doc["_id"], doc["_rev"]) for doc in docs]
+
+        return result_list
 
+    def _create_doc_mult(self, cur, docs, object_ids, qual_ds_name, bulk_insert=False):
         doc_obj_type = [self._get_obj_type(doc, self.profile) for doc in docs]
         all_obj_types = set(doc_obj_type)
 
-        with self.pool.cursor(**self.cursor_args) as cur:
-            # Need to make sure to first insert resources then associations for referential integrity
-            for obj_type in sorted(all_obj_types, key=lambda x: OBJ_TYPE_PRECED.get(x, 10)):
-                sb = StatementBuilder()
-                docs_ot = [doc for (doc, doc_ot) in zip(docs, doc_obj_type) if doc_ot == obj_type]
-
-                # Take the first document to determine the type of objects (resource, association, dir entry)
-                extra_cols, table = self._get_extra_cols(docs_ot[0], qual_ds_name, self.profile)
-                xcol = ""
-                for col in extra_cols:
-                    xcol += ", %s" % col
-                sb.append("INSERT INTO "+table+" (id, rev, doc" + xcol + ") VALUES ")
+        # Need to make sure to first insert resources then associations for referential integrity
+        for obj_type in sorted(all_obj_types, key=lambda x: OBJ_TYPE_PRECED.get(x, 10)):
+            sb = StatementBuilder()
+            docs_ot = [doc for (doc, doc_ot) in zip(docs, doc_obj_type) if doc_ot == obj_type]
+            if bulk_insert:
+                ids_ot = [oid for (oid, doc_ot) in zip(object_ids, doc_obj_type) if doc_ot == obj_type] if object_ids else None
+                self._bulk_insert_docs(cur, docs_ot, ids_ot, qual_ds_name)
+                continue
 
-                # Build a large statement
-                for i, doc in enumerate(docs_ot):
-                    object_id = object_ids[i] if object_ids else None
-                    if "_id" not in doc:
-                        object_id = object_id or self.get_unique_id()
-                        doc["_id"] = object_id
+            # Take the first document to determine the type of objects (resource, association, dir entry)
+            extra_cols, table = self._get_extra_cols(docs_ot[0], qual_ds_name, self.profile, cur=cur)
+            xcol = ""
+            for col in extra_cols:
+                xcol += ", %s" % col
+            sb.append("INSERT INTO "+table+" (id, rev, doc" + xcol + ") VALUES ")
 
-                    doc["_rev"] = "1"
-                    doc_json = json.dumps(doc)
+            # Build a large statement
+            for i, doc in enumerate(docs_ot):
+                object_id = object_ids[i] if object_ids else None
+                if "_id" not in doc:
+                    object_id = object_id or self.get_unique_id()
+                    doc["_id"] = object_id
 
-                    if i>0:
-                        sb.append(",")
+                doc["_rev"] = "1"
+                doc_json = json.dumps(doc)
 
-                    sb.statement_args["id"+str(i)] = doc["_id"]
-                    sb.statement_args["doc"+str(i)] = doc_json
-                    xval = ""
-                    for col in extra_cols:
-                        valuename = col + str(i)
-                        insert_expr = self._create_value_expression(col, doc, valuename, sb.statement_args, allow_null_values=True)
-                        xval += insert_expr
+                if i>0:
+                    sb.append(",")
 
-                    sb.append("(%(id", str(i), ")s, 1, %(doc", str(i), ")s", xval, ")")
+                sb.statement_args["id"+str(i)] = doc["_id"]
+                sb.statement_args["doc"+str(i)] = doc_json
+                xval = ""
+                for col in extra_cols:
+                    valuename = col + str(i)
+                    insert_expr = self._create_value_expression(col, doc, valuename, sb.statement_args, allow_null_values=True)
+                    xval += insert_expr
 
-                try:
-                    cur.execute(*sb.build())
-                    if cur.rowcount != len(docs_ot):
-                        log.warn("Number of objects created (%s) != objects given (%s) in %s", cur.rowcount, len(docs_ot), table)
-                except IntegrityError as ie:
-                    raise BadRequest("Some object already exists: %s" % ie)
+                sb.append("(%(id", str(i), ")s, 1, %(doc", str(i), ")s", xval, ")")
 
-        result_list = [(True, doc["_id"], doc["_rev"]) for doc in docs]
+            try:
+                cur.execute(*sb.build())
+                if cur.rowcount != len(docs_ot):
+                    log.warn("Number of objects created (%s) != objects given (%s) in %s", cur.rowcount, len(docs_ot), table)
+            except IntegrityError as ie:
+                raise BadRequest("Some object already exists: %s" % ie)
+
+    def _bulk_insert_docs(self, cur, docs, object_ids, qual_ds_name):
+        """Inserts a list of documents of the same object type in one statement. Values are passed
+        as one text array per column, unnested and cast to the column types by the server."""
+        extra_cols, table = self._get_extra_cols(docs[0], qual_ds_name, self.profile, cur=cur)
+        col_values = dict(id=[], doc=[])
+        for col in extra_cols:
+            col_values[col] = []
+
+        for i, doc in enumerate(docs):
+            object_id = object_ids[i] if object_ids else None
+            if "_id" not in doc:
+                object_id = object_id or self.get_unique_id()
+                doc["_id"] = object_id
+            doc["_rev"] = "1"
+
+            col_values["id"].append(doc["_id"])
+            col_values["doc"].append(json.dumps(doc))
+            for col in extra_cols:
+                value = self._get_column_value(col, doc)
+                if value is None or isinstance(value, basestring):
+                    col_values[col].append(value)
+                else:
+                    col_values[col].append(str(value))
 
-        return result_list
+        select_exprs, unnest_exprs = ["u.id", "1", "u.doc::json"], []
+        for col in ("id", "doc") + tuple(extra_cols):
+            unnest_exprs.append("unnest(%(" + col + ")s::text[]) AS " + col)
+            if col in ("id", "doc"):
+                continue
+            elif col in GEOSPATIAL_COLS:
+                select_exprs.append("ST_GeomFromText(u." + col + ",4326)")
+            elif col in NUMRANGE_COLS:
+                select_exprs.append("u." + col + "::numrange")
+            elif col == FULLTEXT_COL:
+                select_exprs.append("json_fulltext(u." + col + "::json)")
+            elif col in COLUMN_TYPES:
+                select_exprs.append("u." + col + "::" + COLUMN_TYPES[col])
+            else:
+                select_exprs.append("u." + col)
+
+        xcol = "".join(", %s" % col for col in extra_cols)
+        statement = "INSERT INTO " + table + " (id, rev, doc" + xcol + ") SELECT " + ", ".join(select_exprs) + \
+                    " FROM (SELECT " + ", ".join(unnest_exprs) + ") AS u"
+        try:
+            self._execute(cur, statement, col_values, prepare=True)
+            if cur.rowcount != len(docs):
+                log.warn("Number of objects created (%s) != objects given (%s) in %s", cur.rowcount, len(docs), table)
+        except IntegrityError as ie:
+            raise BadRequest("Some object already exists: %s" % ie)
 
     def create_attachment(self, doc, attachment_name, data, content_type=None, datastore_name=""):
         if not isinstance(attachment_name, str):
@@ -637,18 +1069,17 @@ class PostgresDataStore(DataStore):
         doc["_rev"] = str(old_rev+1)
         doc_json = json.dumps(doc)
 
-        extra_cols, table = self._get_extra_cols(doc, table, self.profile)
+        extra_cols, table = self._get_extra_cols(doc, table, self.profile, cur=cur)
 
+        # All columns of the object type are set (NULL if unset), so that there is one
+        # prepared statement per object type
         statement_args = dict(doc=doc_json, id=doc["_id"], rev=old_rev, revn=old_rev+1)
         xval = ""
-        if extra_cols:
-            for col in extra_cols:
-                insert_expr = self._create_value_expression(col, doc, col, statement_args, assign=True)
-                if insert_expr:
-                    xval += insert_expr
+        for col in extra_cols:
+            xval += self._create_value_expression(col, doc, col, statement_args, allow_null_values=True, assign=True)
 
-        cur.execute("UPDATE "+table+" SET doc=%(doc)s, rev=%(revn)s" + xval + " WHERE id=%(id)s AND rev=%(rev)s",
-                    statement_args)
+        self._execute(cur, "UPDATE "+table+" SET doc=%(doc)s, rev=%(revn)s" + xval + " WHERE id=%(id)s AND rev=%(rev)s",
+                      statement_args, prepare=True)
         if not cur.rowcount:
             # Distinguish rev conflict from documents does not exist.
             #try:
@@ -659,10 +1090,13 @@ class PostgresDataStore(DataStore):
             raise Conflict("Object with id %s revision conflict" % doc["_id"])
         return doc["_id"], doc["_rev"]
 
-    def _get_extra_cols(self, doc, table, profile):
+    def _get_extra_cols(self, doc, table, profile, cur=None):
         obj_type = self._get_obj_type(doc, profile)
         table_ext, extra_cols = OBJ_SPECIAL.get(obj_type, ("", tuple()))
         table += table_ext
+        if FULLTEXT_COL in extra_cols and not self._has_column(table, FULLTEXT_COL, cur=cur):
+            # Datastore created before full-text search. See migrate_fulltext
+            extra_cols = tuple(col for col in extra_cols if col != FULLTEXT_COL)
         return extra_cols, table
 
     def _get_obj_type(self, doc, profile):
@@ -717,7 +1151,7 @@ class PostgresDataStore(DataStore):
             table = qual_ds_name + "_dir"
 
         with self.pool.cursor(**self.cursor_args) as cur:
-            cur.execute("SELECT doc FROM "+table+" WHERE id=%s", (doc_id,))
+            self._execute(cur, "SELECT doc FROM "+table+" WHERE id=%s", (doc_id,), prepare=True)
             doc_list = cur.fetchall()
             if not doc_list:
                 raise NotFound('Object with id %s does not exist.' % doc_id)
@@ -733,7 +1167,7 @@ class PostgresDataStore(DataStore):
         qual_ds_name = self._get_datastore_name(datastore_name)
 
         with self.pool.cursor(**self.cursor_args) as cur:
-            cur.execute("SELECT rev FROM "+qual_ds_name+" WHERE id=%s", (doc_id,))
+            self._execute(cur, "SELECT rev FROM "+qual_ds_name+" WHERE id=%s", (doc_id,), prepare=True)
             doc_list = cur.fetchall()
             if not doc_list:
                 raise NotFound('Object with id %s does not exist.' % doc_id)
@@ -750,6 +1184,7 @@ class PostgresDataStore(DataStore):
     def read_doc_mult(self, object_ids, datastore_name=None, object_type=None, strict=True):
         """"
         Fetch a number of raw doc instances, HEAD rev.
+        Large id lists are split into chunks that are read concurrently on separate pool connections.
         """
         if not object_ids:
             return []
@@ -761,19 +1196,21 @@ class PostgresDataStore(DataStore):
         elif object_type == "DirEntry":
             table = qual_ds_name + "_dir"
 
-        query = "SELECT id, doc FROM "+table+" WHERE id IN ("
-        query_args = dict()
-        for i, oid in enumerate(object_ids):
-            arg_name = "id" + str(i)
-            if i>0:
-                query += ","
-            query += "%(" + arg_name + ")s"
-            query_args[arg_name] = oid
-        query += ")"
+        query = "SELECT id, doc FROM "+table+" WHERE id=ANY(%s)"
 
-        with self.pool.cursor(**self.cursor_args) as cur:
-            cur.execute(query, query_args)
-            rows = cur.fetchall()
+        def read_chunk(chunk_ids):
+            with self.pool.cursor(**self.cursor_args) as cur:
+                self._execute(cur, query, (chunk_ids, ), prepare=True)
+                return cur.fetchall()
+
+        object_ids = list(object_ids)
+        chunk_size = self.read_chunk_size
+        if chunk_size and len(object_ids) > chunk_size and self.read_parallel > 1:
+            chunks = [object_ids[i:i+chunk_size] for i in xrange(0, len(object_ids), chunk_size)]
+            read_pool = gevent.pool.Pool(self.read_parallel)
+            rows = [row for chunk_rows in read_pool.map(read_chunk, chunks) for row in chunk_rows]
+        else:
+            rows = read_chunk(object_ids)
 
         doc_by_id = {row[0]: row[1] for row in rows}
         doc_list = [doc_by_id.get(oid, None) for oid in object_ids]
@@ -815,15 +1252,9 @@ class PostgresDataStore(DataStore):
 
     def delete_doc(self, doc, datastore_name=None, object_type=None, **kwargs):
         qual_ds_name = self._get_datastore_name(datastore_name)
-        table = qual_ds_name
         doc_id = doc if isinstance(doc, str) else doc["_id"]
         log.debug('delete_doc(): Delete document id=%s object_type=%s', doc_id, object_type)
-        if self.profile == DataStore.DS_PROFILE.DIRECTORY:
-            table = qual_ds_name + "_dir"
-        if object_type == "Association":
-            table = qual_ds_name + "_assoc"
-        elif object_type == "DirEntry":
-            table = qual_ds_name + "_dir"
+        table = self._get_delete_table(qual_ds_name, object_type)
 
         with self.pool.cursor(**self.cursor_args) as cur:
             self._delete_doc(cur, table, doc_id)
@@ -833,6 +1264,13 @@ class PostgresDataStore(DataStore):
             return []
         #log.debug('delete_doc_mult(): Delete %s documents', len(object_ids))
         qual_ds_name = self._get_datastore_name(datastore_name)
+        table = self._get_delete_table(qual_ds_name, object_type)
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            for doc_id in object_ids:
+                self._delete_doc(cur, table, doc_id)
+
+    def _get_delete_table(self, qual_ds_name, object_type=None):
         table = qual_ds_name
         if self.profile == DataStore.DS_PROFILE.DIRECTORY:
             table = qual_ds_name + "_dir"
@@ -840,14 +1278,45 @@ class PostgresDataStore(DataStore):
             table = qual_ds_name + "_assoc"
         elif object_type == "DirEntry":
             table = qual_ds_name + "_dir"
+        return table
 
+    def write_doc_batch(self, create_docs=None, update_docs=None, delete_ids=None, datastore_name=None, bulk_insert=False):
+        """
+        Creates, updates and deletes documents within a single transaction with one commit.
+        Documents are created in dependency order (resources before associations), then updated,
+        then deleted in reverse dependency order (associations before resources).
+        @param create_docs  list of documents to create, each with an '_id'
+        @param update_docs  list of documents to update, each with '_id' and '_rev'
+        @param delete_ids  list of tuples (doc_id, object_type) with object_type as for delete_doc
+        @retval tuple of lists of 3-tuples (Success, id, rev) for created and updated documents
+        """
+        create_docs, update_docs, delete_ids = create_docs or [], update_docs or [], delete_ids or []
+        if not all(["_id" in doc for doc in create_docs]):
+            raise BadRequest("Docs to create must have '_id'")
+        if not all(["_id" in doc and "_rev" in doc for doc in update_docs]):
+            raise BadRequest("Docs to update must have '_id' and '_rev'")
+        log.debug('write_doc_batch(): create %s, update %s, delete %s documents',
+                  len(create_docs), len(update_docs), len(delete_ids))
+
+        qual_ds_name = self._get_datastore_name(datastore_name)
+        delete_preced = {"Association": 1, "DirEntry": 1}
+        update_results = []
+        self._ensure_doc_partitions(qual_ds_name, create_docs)
         with self.pool.cursor(**self.cursor_args) as cur:
-            for doc_id in object_ids:
-                self._delete_doc(cur, table, doc_id)
+            if create_docs:
+                self._create_doc_mult(cur, create_docs, None, qual_ds_name, bulk_insert=bulk_insert)
+            for doc in update_docs:
+                oid, version = self._update_doc(cur, qual_ds_name, doc)
+                update_results.append((True, oid, version))
+            for doc_id, object_type in sorted(delete_ids, key=lambda x: delete_preced.get(x[1], 2)):
+                self._delete_doc(cur, self._get_delete_table(qual_ds_name, object_type), doc_id)
+
+        create_results = [(True, doc["_id"], doc["_rev"]) for doc in create_docs]
+        return create_results, update_results
 
     def _delete_doc(self, cur, table, doc_id):
         sql = "DELETE FROM "+table+" WHERE id=%s"
-        cur.execute(sql, (doc_id, ))
+        self._execute(cur, sql, (doc_id, ), prepare=True)
         if not cur.rowcount:
             raise NotFound('Object with id %s does not exist.' % doc_id)
 
@@ -1103,48 +1572,50 @@ class PostgresDataStore(DataStore):
         query_clause = " WHERE "
         query_args = dict(key=key, start=start_key, end=end_key)
         order_clause = " ORDER BY ts_created"
+        # Timestamp bounds are passed as strings like the ts_created column, so that the planner
+        # can prune the partitions of a partitioned events table
 
         if view_name == "by_origintype":
             query_args['origin'] = start_key[0]
             query_args['type_'] = start_key[1]
             query_clause += "origin=%(origin)s AND type_=%(type_)s"
             if len(start_key) == 3:
-                query_args['startts'] = start_key[2]
+                query_args['startts'] = str(start_key[2])
                 query_clause += " AND ts_created>=%(startts)s"
             if len(end_key) == 3:
-                query_args['endts'] = end_key[2]
+                query_args['endts'] = str(end_key[2])
                 query_clause += " AND ts_created<=%(endts)s"
             order_clause = " ORDER BY origin, type_, ts_created"
         elif view_name == "by_origin":
             query_args['origin'] = start_key[0]
             query_clause += "origin=%(origin)s"
             if len(start_key) == 2:
-                query_args['startts'] = start_key[1]
+                query_args['startts'] = str(start_key[1])
                 query_clause += " AND ts_created>=%(startts)s"
             if len(end_key) == 2:
-                query_args['endts'] = end_key[1]
+                query_args['endts'] = str(end_key[1])
                 query_clause += " AND ts_created<=%(endts)s"
             order_clause = " ORDER BY origin, ts_created"
         elif view_name == "by_type":
             query_args['type_'] = start_key[0]
             query_clause += "type_=%(type_)s"
             if len(start_key) == 2:
-                query_args['startts'] = start_key[1]
+                query_args['startts'] = str(start_key[1])
                 query_clause += " AND ts_created>=%(startts)s"
             if len(end_key) == 2:
-                query_args['endts'] = end_key[1]
+                query_args['endts'] = str(end_key[1])
                 query_clause += " AND ts_created<=%(endts)s"
             order_clause = " ORDER BY type_, ts_created"
         elif view_name == "by_time":
             if start_key and end_key:
-                query_args['startts'] = start_key[0]
-                query_args['endts'] = end_key[0]
+                query_args['startts'] = str(start_key[0])
+                query_args['endts'] = str(end_key[0])
                 query_clause += "ts_created BETWEEN %(startts)s AND %(endts)s"
             elif start_key:
-                query_args['startts'] = start_key[0]
+                query_args['startts'] = str(start_key[0])
                 query_clause += "ts_created>=%(startts)s"
             elif end_key:
-                query_args['endts'] = end_key[0]
+                query_args['endts'] = str(end_key[0])
                 query_clause += "ts_created<=%(endts)s"
             else:
                 # Make sure the result set is not too long
@@ -9,6 +9,7 @@ from pyon.core.exception import BadRequest, Conflict, NotFound, Inconsistent
 from pyon.core.object import IonObjectBase, IonObjectSerializer, IonObjectDeserializer
 from pyon.datastore.postgresql.base_store import PostgresDataStore
 from pyon.datastore.postgresql.pg_query import PostgresQueryBuilder
+from pyon.datastore.datastore_query import DatastoreQueryBuilder, DQ
 from pyon.datastore.datastore import DataStore
 from pyon.util.log import log
 from pyon.ion.resource import AvailabilityStates, OT, RT
@@ -51,11 +52,12 @@ class PostgresPyonDataStore(PostgresDataStore):
                                    object_id=object_id, datastore_name=datastore_name,
                                    attachments=attachments)
 
-    def create_mult(self, objects, object_ids=None, allow_ids=None):
+    def create_mult(self, objects, object_ids=None, allow_ids=None, bulk_insert=False):
         if any([not isinstance(obj, IonObjectBase) for obj in objects]):
             raise BadRequest("Obj param is not instance of IonObjectBase")
 
-        return self.create_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects], object_ids)
+        return self.create_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects], object_ids,
+                                    bulk_insert=bulk_insert)
 
 
     def update(self, obj, datastore_name=""):
@@ -70,9 +72,23 @@ class PostgresPyonDataStore(PostgresDataStore):
 
         return self.update_doc_mult([self._ion_object_to_persistence_dict(obj) for obj in objects])
 
+    def write_batch(self, create_objs=None, update_objs=None, delete_ids=None, bulk_insert=False):
+        """
+        Creates, updates and deletes objects in a single transaction. Objects to create must have an _id.
+        @param delete_ids  list of tuples (object id, object type), where object type is None for resources
+        @retval tuple of lists of 3-tuples (Success, id, rev) for created and updated objects
+        """
+        create_objs, update_objs = create_objs or [], update_objs or []
+        if any([not isinstance(obj, IonObjectBase) for obj in create_objs + update_objs]):
+            raise BadRequest("Obj param is not instance of IonObjectBase")
+
+        return self.write_doc_batch(create_docs=[self._ion_object_to_persistence_dict(obj) for obj in create_objs],
+                                    update_docs=[self._ion_object_to_persistence_dict(obj) for obj in update_objs],
+                                    delete_ids=delete_ids, bulk_insert=bulk_insert)
+
 
     def read(self, object_id, rev_id="", datastore_name="", object_type=None):
-        if not isinstance(object_id, str):
+        if not isinstance(object_id, basestring):
             raise BadRequest("Object id param is not string")
 
         doc = self.read_doc(object_id, rev_id, datastore_name=datastore_name, object_type=object_type)
@@ -81,7 +97,7 @@ class PostgresPyonDataStore(PostgresDataStore):
         return obj
 
     def read_mult(self, object_ids, datastore_name="", strict=True):
-        if any([not isinstance(object_id, str) for object_id in object_ids]):
+        if any([not isinstance(object_id, basestring) for object_id in object_ids]):
             raise BadRequest("Object ids are not string: %s" % str(object_ids))
 
         docs = self.read_doc_mult(object_ids, datastore_name, strict=strict)
@@ -175,7 +191,7 @@ class PostgresPyonDataStore(PostgresDataStore):
         query_clause = self._add_access_filter(access_args, qual_ds_name, query_clause, query_args)
         extra_clause = view_args.get("extra_clause", "")
         with self.pool.cursor(**self.cursor_args) as cur:
-            cur.execute(query + query_clause + extra_clause, query_args)
+            self._execute(cur, query + query_clause + extra_clause, query_args, prepare=not extra_clause)
             rows = cur.fetchall()
 
         obj_assocs = [self._persistence_dict_to_ion_object(row[-1]) for row in rows]
@@ -226,7 +242,7 @@ class PostgresPyonDataStore(PostgresDataStore):
         query_clause = self._add_access_filter(access_args, qual_ds_name, query_clause, query_args)
         extra_clause = view_args.get("extra_clause", "")
         with self.pool.cursor(**self.cursor_args) as cur:
-            cur.execute(query + query_clause + extra_clause, query_args)
+            self._execute(cur, query + query_clause + extra_clause, query_args, prepare=not extra_clause)
             rows = cur.fetchall()
 
         obj_assocs = [self._persistence_dict_to_ion_object(row[-1]) for row in rows]
@@ -345,7 +361,8 @@ class PostgresPyonDataStore(PostgresDataStore):
         sql = query + query_clause + extra_clause
         #print "find_associations(): SQL=", sql, query_args
         with self.pool.cursor(**self.cursor_args) as cur:
-            cur.execute(sql, query_args)
+            # Variable length anyside lists produce many statement shapes - do not prepare these
+            self._execute(cur, sql, query_args, prepare=not (anyside or extra_clause))
             rows = cur.fetchall()
 
         if id_only:
@@ -356,6 +373,61 @@ class PostgresPyonDataStore(PostgresDataStore):
 
         return assocs
 
+    def traverse_associations(self, start, hops, id_only=False):
+        """
+        Returns all associations along the given path from a set of start resources, resolved in
+        one recursive query. Each hop is a tuple (predicate, direction) applied to the resources reached
+        by the previous hop. Predicate is a predicate, a list of predicates or None for any predicate.
+        Direction is ">" (start side is subject), "<" (start side is object) or "" for either.
+        @retval list of Association objects (or ids) ordered by hop
+        """
+        if type(id_only) is not bool:
+            raise BadRequest('id_only must be type bool, not %s' % type(id_only))
+        if not start:
+            raise BadRequest("Must provide start resource id(s)")
+        if not hops:
+            raise BadRequest("Must provide at least one hop")
+        start_ids = [start] if isinstance(start, basestring) else list(start)
+
+        qual_ds_name = self._get_datastore_name()
+        table = qual_ds_name + "_assoc"
+        query_args = dict(start=start_ids, num_hops=len(hops))
+        hop_values = []
+        for i, hop in enumerate(hops, start=1):
+            predicate, direction = hop if type(hop) in (list, tuple) else (hop, "")
+            if direction not in (None, "", ">", "<"):
+                raise BadRequest("Illegal hop direction: %s" % direction)
+            if predicate and isinstance(predicate, basestring):
+                predicate = [predicate]
+            query_args["hp%s" % i] = list(predicate) if predicate else []
+            query_args["hd%s" % i] = direction or ""
+            hop_values.append("(%s, %%(hp%s)s::text[], %%(hd%s)s)" % (i, i, i))
+
+        # Each step joins the associations of the resources reached in the previous step for the current hop.
+        hop_filter = "a.retired<>true AND (h.preds='{}' OR a.p=ANY(h.preds))"
+        edge_clause = "((h.dir<>'<' AND a.s=%s) OR (h.dir<>'>' AND a.o=%s))"
+        sql = "WITH RECURSIVE hops(depth, preds, dir) AS (VALUES " + ",".join(hop_values) + "), " \
+              "trav(depth, aid, target) AS (" \
+              "SELECT 1, a.id, CASE WHEN a.s=ANY(%(start)s) AND h.dir<>'<' THEN a.o ELSE a.s END " \
+              "FROM hops h, " + table + " a WHERE h.depth=1 AND " + hop_filter + " AND " + \
+              edge_clause % ("ANY(%(start)s)", "ANY(%(start)s)") + \
+              " UNION " \
+              "SELECT t.depth+1, a.id, CASE WHEN a.s=t.target AND h.dir<>'<' THEN a.o ELSE a.s END " \
+              "FROM trav t JOIN hops h ON h.depth=t.depth+1, " + table + " a WHERE t.depth<%(num_hops)s AND " + \
+              hop_filter + " AND " + edge_clause % ("t.target", "t.target") + \
+              ") SELECT a.id, a.doc FROM " + table + " a, " \
+              "(SELECT aid, min(depth) AS depth FROM trav GROUP BY aid) AS t WHERE a.id=t.aid ORDER BY t.depth"
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            self._execute(cur, sql, query_args)
+            rows = cur.fetchall()
+
+        if id_only:
+            assocs = [self._prep_id(row[0]) for row in rows]
+        else:
+            assocs = [self._persistence_dict_to_ion_object(row[1]) for row in rows]
+        return assocs
+
     def _prepare_find_return(self, rows, res_assocs=None, id_only=True, **kwargs):
         if id_only:
             res_ids = [self._prep_id(row[0]) for row in rows]
@@ -724,13 +796,67 @@ class PostgresPyonDataStore(PostgresDataStore):
         """
         Find resources given a datastore query expression dict.
         @param query  a dict representation of a datastore query
-        @retval  list of resource ids or resource objects matching query (dependent on id_only value)
+        @retval  list of resource ids or resource objects matching query (dependent on id_only value),
+                 or for aggregate queries a list with the count or a list of value lists
         """
+        pqb = self._get_query_builder(query, access_args)
+
+        with self.pool.cursor(**self.cursor_args) as cur:
+            exec_query = pqb.get_query()
+            cur.execute(exec_query, pqb.get_values())
+            rows = cur.fetchall()
+            log.info("find_by_query() QUERY: %s (%s rows)", cur.query, cur.rowcount)
+            query_res = {}
+            query["_result"] = query_res
+            query_res["statement_gen"] = exec_query
+            query_res["statement_sql"] = cur.query
+            query_res["rowcount"] = cur.rowcount
+
+        if pqb.keyset_cols:
+            limit = query["query_args"].get("limit", 0)
+            if rows and limit > 0 and len(rows) >= limit:
+                query_res["next_page_token"] = DatastoreQueryBuilder.create_page_token(rows[-1][-len(pqb.keyset_cols):])
+            else:
+                query_res["next_page_token"] = None
+
+        return self._prepare_query_rows(rows, query, pqb)
+
+    def find_by_query_iter(self, query, access_args=None, chunk_size=None):
+        """
+        Generator variant of find_by_query. Uses a named (server-side) cursor and fetches and converts
+        results in chunks of chunk_size rows, so that memory use does not depend on result size.
+        Note: A pooled connection is held until the generator is exhausted or closed.
+        @param query  a dict representation of a datastore query
+        @param chunk_size  number of rows to fetch per round trip (defaults to config iter_chunk_size)
+        @retval  iterator over resource ids or resource objects matching query (dependent on id_only value)
+        """
+        pqb = self._get_query_builder(query, access_args)
+        chunk_size = chunk_size or self.iter_chunk_size
+
+        with self.pool.cursor("qiter_" + self.get_unique_id(), **self.cursor_args) as cur:
+            cur.itersize = chunk_size
+            exec_query = pqb.get_query()
+            cur.execute(exec_query, pqb.get_values())
+            log.info("find_by_query_iter() QUERY: %s", cur.query)
+            query_res = {}
+            query["_result"] = query_res
+            query_res["statement_gen"] = exec_query
+            query_res["statement_sql"] = cur.query
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for res_val in self._prepare_query_rows(rows, query, pqb):
+                    yield res_val
+
+    def _get_query_builder(self, query, access_args=None):
+        """Returns a query builder for given query with access and deleted filters applied"""
         qual_ds_name = self._get_datastore_name()
         query_ds_sub = query["query_args"].get("ds_sub", None)
         query_format = query["query_args"].get("format", "")
 
-        pqb = PostgresQueryBuilder(query, qual_ds_name)
+        pqb = PostgresQueryBuilder(query, qual_ds_name,
+                                   jsonb=self.doc_storage == "jsonb" and self.get_doc_type() == "jsonb")
         if self.profile == DataStore.DS_PROFILE.RESOURCES and not query_ds_sub:
             table_alias = qual_ds_name if query_format != "complex" else "base"
             pqb.where = self._add_access_filter(access_args, qual_ds_name, pqb.where, pqb.values,
@@ -740,25 +866,30 @@ class PostgresPyonDataStore(PostgresDataStore):
             pqb.where = self._add_deleted_filter(pqb.table_aliases[0], query_ds_sub,
                                                  pqb.where, pqb.values,
                                                  show_all=query["query_args"].get("show_all", False))
-
-        with self.pool.cursor(**self.cursor_args) as cur:
-            exec_query = pqb.get_query()
-            cur.execute(exec_query, pqb.get_values())
-            rows = cur.fetchall()
-            log.info("find_by_query() QUERY: %s (%s rows)", cur.query, cur.rowcount)
-            query_res = {}
-            query["_result"] = query_res
-            query_res["statement_gen"] = exec_query
-            query_res["statement_sql"] = cur.query
-            query_res["rowcount"] = cur.rowcount
-
+        return pqb
+
+    def _prepare_query_rows(self, rows, query, pqb):
+        """Converts query result rows into the return format of find_by_query"""
+        if pqb.aggregate == DQ.AGG_COUNT:
+            return [rows[0][0] if rows else 0]
+        elif pqb.aggregate:
+            # Return format is list of lists of distinct values (and count)
+            return [list(row) for row in rows]
+        if pqb.keyset_cols:
+            # Remove key columns appended for keyset paging
+            rows = [row[:-len(pqb.keyset_cols)] for row in rows]
+        query_format = query["query_args"].get("format", "")
         id_only = query["query_args"].get("id_only", True)
+        proj_len = len(pqb.projection)
         if query_format == "complex" and pqb.has_basic_cols:
             # Return format is list of lists
             if id_only:
                 res_vals = [[self._prep_id(row[0])] + list(row[1:]) for row in rows]
+            elif proj_len:
+                res_vals = [[self._projection_dict(row[0], row[1:1 + proj_len], pqb.projection)] + list(row[1 + proj_len:])
+                            for row in rows]
             else:
-                res_vals = [[self._persistence_dict_to_ion_object(row[1])] + list(rows[2:]) for row in rows]
+                res_vals = [[self._persistence_dict_to_ion_object(row[1])] + list(row[2:]) for row in rows]
 
         elif query_format == "complex":
             res_vals = [list(row) for row in rows]
@@ -766,11 +897,20 @@ class PostgresPyonDataStore(PostgresDataStore):
         else:
             if id_only:
                 res_vals = [self._prep_id(row[0]) for row in rows]
+            elif proj_len:
+                res_vals = [self._projection_dict(row[0], row[1:], pqb.projection) for row in rows]
             else:
                 res_vals = [self._persistence_dict_to_ion_object(row[-1]) for row in rows]
 
         return res_vals
 
+    def _projection_dict(self, row_id, values, projection):
+        """Returns a plain dict (not an IonObject) with the projected attribute values of a query result row"""
+        proj_dict = dict(zip(projection, values))
+        proj_dict["_id"] = self._prep_id(row_id)
+        proj_dict["__noion__"] = True
+        return proj_dict
+
     # -------------------------------------------------------------------------
     # Internal operations
 
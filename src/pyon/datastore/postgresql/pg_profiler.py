@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+
+"""Statement-level query profiler and slow-query log for the PostgreSQL datastore"""
+
+__author__ = 'Michael Meisinger'
+
+from collections import deque
+import datetime
+import math
+import re
+import time
+
+from putil.logging import log
+
+# Global query profiler instance (None if profiling is disabled)
+query_profiler = None
+
+DEFAULT_CONFIG = {"enabled": False,
+                  "slow_threshold": 1.0,
+                  "explain_slow": False,
+                  "max_shapes": 1000,
+                  "max_samples": 1000,
+                  "max_slow_log": 100,
+                  }
+
+OTHER_SHAPE = "(other)"
+
+_RE_STRING = re.compile(r"[Ee]?'(?:[^']|'')*'")
+_RE_PARAM = re.compile(r"%(?:\(\w+\))?s")
+_RE_NUMBER = re.compile(r"(?<![\w$.])-?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+_RE_PREPARED = re.compile(r"\bion_ps\d+\b")
+_RE_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_ARRAY = re.compile(r"ARRAY\[\s*\?(?:\s*,\s*\?)*\s*\]", re.IGNORECASE)
+_RE_VALUES = re.compile(r"\((\?(?:\s*,\s*\?)*)\)(?:\s*,\s*\(\?(?:\s*,\s*\?)*\))+")
+_RE_SPACE = re.compile(r"\s+")
+_RE_DECLARE = re.compile(r"\s*DECLARE\s+.+?\s+CURSOR\s+(?:WITH(?:OUT)?\s+HOLD\s+)?FOR\s+", re.IGNORECASE | re.DOTALL)
+
+
+def normalize_statement(statement):
+    """
+    Returns the shape of a SQL statement: literals and parameters are replaced by ?,
+    lists of values and multi-row VALUES are collapsed and whitespace is normalized.
+    """
+    if not statement:
+        return ""
+    shape = _RE_STRING.sub("?", statement)
+    shape = _RE_PARAM.sub("?", shape)
+    shape = _RE_PREPARED.sub("ion_ps?", shape)
+    shape = _RE_NUMBER.sub("?", shape)
+    shape = _RE_VALUES.sub(r"(\1),...", shape)
+    shape = _RE_LIST.sub("(?,...)", shape)
+    shape = _RE_ARRAY.sub("ARRAY[?,...]", shape)
+    shape = _RE_SPACE.sub(" ", shape).strip()
+    return shape
+
+
+def get_calling_op():
+    """Returns service.op of the RPC operation currently executing in the container, or empty string"""
+    try:
+        from pyon.core import bootstrap
+        container = bootstrap.container_instance
+        ctx = container.context.get_context() if container and getattr(container, "context", None) else None
+        if ctx and ctx.get("op", None):
+            service_name = (ctx.get("receiver", None) or "").split(",")[-1]
+            return "%s.%s" % (service_name, ctx["op"]) if service_name else ctx["op"]
+    except Exception:
+        pass
+    return ""
+
+
+def get_percentile(sorted_values, percent):
+    """Returns the nearest-rank percentile of a sorted list of values"""
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values))) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+def _get_statement_type(statement):
+    """Returns the leading SQL keyword of a statement in upper case, e.g. SELECT or INSERT"""
+    parts = statement.lstrip(" \t\n(").split(None, 1) if statement else None
+    return parts[0].upper() if parts else ""
+
+
+class QueryStats(object):
+    """Aggregated execution statistics for one statement shape and calling op"""
+
+    def __init__(self, shape, op, max_samples):
+        self.shape = shape
+        self.op = op
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.samples = deque(maxlen=max_samples)
+
+    def add(self, query_time, rows=0, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total_time += query_time
+        self.max_time = max(self.max_time, query_time)
+        self.rows += max(rows or 0, 0)
+        self.samples.append(query_time)
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.total_time += other.total_time
+        self.max_time = max(self.max_time, other.max_time)
+        self.rows += other.rows
+        self.samples.extend(other.samples)
+
+    def get_stats(self):
+        samples = sorted(self.samples)
+        return dict(shape=self.shape, op=self.op, count=self.count, errors=self.errors,
+                    total_time=round(self.total_time, 6),
+                    avg_time=round(self.total_time / self.count, 6) if self.count else 0.0,
+                    p50=round(get_percentile(samples, 50), 6),
+                    p95=round(get_percentile(samples, 95), 6),
+                    p99=round(get_percentile(samples, 99), 6),
+                    max_time=round(self.max_time, 6),
+                    rows=self.rows,
+                    avg_rows=round(float(self.rows) / self.count, 2) if self.count else 0.0)
+
+
+class QueryProfiler(object):
+    """
+    Aggregates statement execution times and row counts per normalized statement shape
+    and calling service operation. Statements slower than a threshold are logged and kept
+    in a slow-query log, optionally with the EXPLAIN (ANALYZE, BUFFERS) output of the query plan.
+    """
+    STAT_COLUMNS = ["shape", "op", "count", "errors", "total_time", "avg_time", "p50", "p95", "p99",
+                    "max_time", "rows", "avg_rows"]
+
+    def __init__(self, slow_threshold=1.0, explain_slow=False, max_shapes=1000, max_samples=1000, max_slow_log=100):
+        self.slow_threshold = float(slow_threshold or 0)
+        self.explain_slow = bool(explain_slow)
+        self.max_shapes = int(max_shapes)
+        self.max_samples = int(max_samples)
+        self.start_time = time.time()
+
+        self._stats = {}    # (shape, op) -> QueryStats
+        self._shape_cache = {}
+        self.slow_log = deque(maxlen=int(max_slow_log))
+
+    def get_shape(self, statement):
+        shape = self._shape_cache.get(statement, None)
+        if shape is None:
+            shape = normalize_statement(statement)
+            if len(self._shape_cache) >= self.max_shapes * 10:
+                self._shape_cache.clear()
+            self._shape_cache[statement] = shape
+        return shape
+
+    def record(self, statement, query_time, rows=0, error=False, cursor=None, op=None):
+        """
+        Records the execution of a statement.
+        @param statement  The statement as passed to execute (with parameter placeholders)
+        @param query_time  The execution time in seconds
+        @param rows  Number of rows returned or affected
+        @param cursor  If provided, the cursor that executed the statement, for EXPLAIN of slow queries
+        @param op  The calling service op. Determined from the container context if not provided
+        """
+        try:
+            shape = self.get_shape(statement)
+            op = get_calling_op() if op is None else op
+            key = (shape, op)
+            stats = self._stats.get(key, None)
+            if stats is None:
+                if len(self._stats) >= self.max_shapes:
+                    key = (OTHER_SHAPE, op)
+                    stats = self._stats.get(key, None)
+                if stats is None:
+                    stats = QueryStats(key[0], op, self.max_samples)
+                    self._stats[key] = stats
+            stats.add(query_time, rows, error=error)
+
+            if self.slow_threshold and query_time >= self.slow_threshold and not error:
+                self._log_slow(statement, shape, op, query_time, rows, cursor)
+        except Exception:
+            log.warn("Could not record query profile", exc_info=True)
+
+    def _log_slow(self, statement, shape, op, query_time, rows, cursor):
+        query = getattr(cursor, "query", None) or statement
+        plan = None
+        if self.explain_slow and cursor is not None:
+            plan = self.explain(cursor.connection, query, statement=statement)
+        self.slow_log.append(dict(ts=time.time(), time=query_time, rows=rows, op=op, shape=shape,
+                                  statement=query, plan=plan))
+        log.warn("Slow query (%.3f sec, %s rows, op=%s): %s%s", query_time, rows, op or "-", query[:2000],
+                 "\n" + plan if plan else "")
+
+    def explain(self, conn, query, statement=None):
+        """
+        Returns the query plan for an already executed query. Only SELECT statements are executed
+        again for EXPLAIN ANALYZE; other statements get the estimated plan without execution.
+        Runs within a savepoint so that errors do not abort the caller's transaction.
+        @param query  The executed query text, e.g. the EXECUTE of a prepared statement or the
+                      DECLARE of a named cursor, for which the cursor's query is explained
+        @param statement  The original statement, used to classify the query (defaults to query)
+        """
+        if not conn or conn.closed:
+            return None
+        declare_match = _RE_DECLARE.match(query)
+        if declare_match:
+            query = query[declare_match.end():]
+        from pyon.datastore.postgresql.pg_util import extensions
+        stmt_type = _get_statement_type(statement or query)
+        if stmt_type == "EXECUTE":
+            # Unknown prepared statement: cannot tell whether it writes, so never execute it again
+            stmt_type = ""
+        explain_opts = "(ANALYZE, BUFFERS) " if stmt_type == "SELECT" else ""
+        in_transaction = conn.get_transaction_status() == extensions.TRANSACTION_STATUS_INTRANS
+        try:
+            cur = conn.cursor(cursor_factory=extensions.cursor)
+            try:
+                if in_transaction:
+                    cur.execute("SAVEPOINT ion_explain")
+                try:
+                    cur.execute("EXPLAIN " + explain_opts + query)
+                    plan = "\n".join(row[0] for row in cur.fetchall())
+                finally:
+                    if in_transaction:
+                        cur.execute("ROLLBACK TO SAVEPOINT ion_explain")
+            finally:
+                cur.close()
+            return plan
+        except Exception as ex:
+            log.debug("Could not EXPLAIN query: %s", ex)
+            return None
+
+    def get_stats(self, by_op=True, limit=None):
+        """
+        Returns a list of statistics dicts ordered by descending total time, either per
+        statement shape and calling op or aggregated per statement shape only.
+        """
+        if by_op:
+            stats_list = self._stats.values()
+        else:
+            shape_stats = {}
+            for stats in self._stats.values():
+                if stats.shape not in shape_stats:
+                    shape_stats[stats.shape] = QueryStats(stats.shape, "", self.max_samples)
+                shape_stats[stats.shape].merge(stats)
+            stats_list = shape_stats.values()
+        result = [stats.get_stats() for stats in stats_list]
+        result.sort(key=lambda s: s["total_time"], reverse=True)
+        return result[:limit] if limit else result
+
+    def get_summary(self):
+        return dict(since=self.start_time, shapes=len(set(shape for shape, op in self._stats)),
+                    count=sum(s.count for s in self._stats.itervalues()),
+                    total_time=round(sum(s.total_time for s in self._stats.itervalues()), 6),
+                    slow=len(self.slow_log))
+
+    def reset(self):
+        self._stats.clear()
+        self.slow_log.clear()
+        self.start_time = time.time()
+
+    def print_stats(self, by_op=True, limit=20):
+        summary = self.get_summary()
+        print "Query profile since %s: %s statements, %s shapes, %.3f sec total, %s slow" % (
+            datetime.datetime.fromtimestamp(summary["since"]).strftime('%Y-%m-%d %H:%M:%S'),
+            summary["count"], summary["shapes"], summary["total_time"], summary["slow"])
+        print "%8s %10s %8s %8s %8s %8s %8s  %s" % ("count", "total", "p50", "p95", "p99", "max", "rows", "op / statement")
+        for stats in self.get_stats(by_op=by_op, limit=limit):
+            print "%8s %10.3f %8.4f %8.4f %8.4f %8.4f %8s  %s%s" % (
+                stats["count"], stats["total_time"], stats["p50"], stats["p95"], stats["p99"], stats["max_time"],
+                stats["rows"], "%s: " % stats["op"] if stats["op"] else "", stats["shape"][:200])
+
+    def save_csv(self, filename=None, by_op=True):
+        """Writes the current statistics to a CSV file and returns the filename"""
+        if not filename:
+            dtstr = datetime.datetime.today().strftime('%Y%m%d_%H%M%S')
+            filename = "interface/db_stats_%s.csv" % dtstr
+        with open(filename, "w") as f:
+            f.write(",".join(self.STAT_COLUMNS))
+            f.write("\n")
+            for stats in self.get_stats(by_op=by_op):
+                values = [stats[col] for col in self.STAT_COLUMNS]
+                f.write(",".join('"%s"' % str(v).replace('"', '""') if isinstance(v, basestring) else str(v)
+                                 for v in values))
+                f.write("\n")
+        return filename
+
+
+def start_query_profiler(config=None):
+    """Enables the global query profiler with given config dict, if not already enabled"""
+    global query_profiler
+    if query_profiler is None:
+        prof_cfg = DEFAULT_CONFIG.copy()
+        prof_cfg.update(config or {})
+        prof_cfg.pop("enabled", None)
+        query_profiler = QueryProfiler(**prof_cfg)
+        log.info("Started database query profiler, slow_threshold=%s", query_profiler.slow_threshold)
+    return query_profiler
+
+
+def stop_query_profiler():
+    """Disables the global query profiler and returns the last instance"""
+    global query_profiler
+    profiler, query_profiler = query_profiler, None
+    return profiler
@@ -4,6 +4,8 @@
 
 __author__ = 'Michael Meisinger'
 
+import json
+
 from pyon.core.exception import BadRequest
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.datastore_query import DQ, DatastoreQueryBuilder
@@ -36,10 +38,17 @@ class PostgresQueryBuilder(object):
               DQ.XOP_ATTILIKE: "ILIKE",
               }
 
-    def __init__(self, query, basetable):
+    def __init__(self, query, basetable, jsonb=False):
+        """
+        @param query  The datastore query dict
+        @param basetable  Name of the datastore base table
+        @param jsonb  If True, documents are stored as jsonb and equality filters on attributes
+                      use containment (@>), supported by GIN jsonb_path_ops indexes
+        """
         DatastoreQueryBuilder.check_query(query)
         self.query = query
         self.basetable = basetable
+        self.jsonb = jsonb
         self.from_tables = basetable
         self._valcnt = 0
         self.values = {}
@@ -48,8 +57,14 @@ class PostgresQueryBuilder(object):
         self.query_format = self.query["query_args"].get("format", "")
         self.table_aliases = [self.basetable]
         self.has_basic_cols = True
+        self.keyset_cols = []
+        self.projection = []
+        self.rank_exprs = []
+        self.aggregate = self.query["query_args"].get("aggregate", None)
 
         if self.query_format == "sql":
+            if self.aggregate:
+                raise BadRequest("Aggregate not supported for query format sql")
             self.basic_cols = False
             self.cols = self.query["returns"]
             self.from_tables = self.query["from"]
@@ -63,7 +78,7 @@ class PostgresQueryBuilder(object):
             # Build list of return values
             self.cols = ["base.id"]
             if not self.query["query_args"].get("id_only", True):
-                self.cols.append("base.doc")
+                self.cols.extend(self._build_projection("base.doc"))
             if self.query.get("returns", None):
                 if self.query["returns"][0] is True:
                     self.cols.extend(self.query["returns"][1:])
@@ -93,14 +108,17 @@ class PostgresQueryBuilder(object):
                 self.where = self._build_where(self.query["where"])
 
             self.order_by = self._build_order_by(self.query["order_by"])
+            self._add_rank_order()
+            self._add_keyset_paging()
 
             self.group_by = self.query.get("group_by", None)
             self.having = self.query.get("having", None)
+            self._add_aggregate()
 
         else:
             self.cols = ["id"]
             if not self.query["query_args"].get("id_only", True):
-                self.cols.append("doc")
+                self.cols.extend(self._build_projection("doc"))
 
             if self.ds_sub:
                 self.basetable += "_" + self.query["query_args"]["ds_sub"]
@@ -109,8 +127,11 @@ class PostgresQueryBuilder(object):
 
             self.where = self._build_where(self.query["where"])
             self.order_by = self._build_order_by(self.query["order_by"])
+            self._add_rank_order()
+            self._add_keyset_paging()
             self.group_by = None
             self.having = None
+            self._add_aggregate()
 
     def _value(self, value, flatten_list=True):
         """Saves a value for later type conformant insertion into the query"""
@@ -132,6 +153,23 @@ class PostgresQueryBuilder(object):
             return self.query_params.get(paramname, None)
         return value
 
+    def _build_projection(self, doc_col):
+        """
+        Returns the document column, or if a projection is set, one json column per projected
+        attribute (always including type_), so that full documents are not transferred.
+        """
+        projection = self.query["query_args"].get("projection", None)
+        if not projection:
+            return [doc_col]
+        self.projection = ["type_"] + [attr for attr in projection if attr != "type_"]
+        proj_cols = []
+        for attr in self.projection:
+            if "." in attr:
+                proj_cols.append("%s#>%s::text[]" % (doc_col, self._value(attr.split("."), flatten_list=False)))
+            else:
+                proj_cols.append("%s->%s" % (doc_col, self._value(attr)))
+        return proj_cols
+
     def _build_where(self, expr, table_prefix=None):
         """
         Builds a SQL filter expression string from given query expression
@@ -147,9 +185,12 @@ class PostgresQueryBuilder(object):
             attname, value = args
             if self._is_standard_col(attname):
                 return "%s%s%s%s" % (table_prefix, attname, self.OP_STR[op], self._value(self._sub_param(value)))
-            else:
-                return "json_string(%sdoc,%s)%s%s" % (table_prefix, self._value(attname), self.OP_STR[op],
-                                                      self._value(str(self._sub_param(value))))
+            value = str(self._sub_param(value))
+            if self.jsonb and op == DQ.OP_EQ and self._jsonb_containable(attname, [value]):
+                return "(%s AND json_string(%sdoc,%s)=%s)" % (self._jsonb_contains(table_prefix, attname, [value]),
+                                                              table_prefix, self._value(attname), self._value(value))
+            return "json_string(%sdoc,%s)%s%s" % (table_prefix, self._value(attname), self.OP_STR[op],
+                                                  self._value(value))
         elif op == DQ.XOP_IN:
             attname = args[0]
             values = args[1:]
@@ -157,7 +198,11 @@ class PostgresQueryBuilder(object):
                 in_exp = ",".join(["%s" % self._value(self._sub_param(val)) for val in values])
                 return table_prefix + attname + " IN (" + in_exp + ")"
             else:
-                in_exp = ",".join(["%s" % self._value(str(self._sub_param(val))) for val in values])
+                values = [str(self._sub_param(val)) for val in values]
+                in_exp = ",".join(["%s" % self._value(val) for val in values])
+                if self.jsonb and values and self._jsonb_containable(attname, values):
+                    return "(%s AND json_string(%sdoc,%s) IN (%s))" % (self._jsonb_contains(table_prefix, attname, values),
+                                                                       table_prefix, self._value(attname), in_exp)
                 return "json_string(%sdoc,%s) IN (%s)" % (table_prefix, self._value(attname), in_exp)
         elif op == DQ.XOP_BETWEEN:
             attname, value1, value2 = args
@@ -179,6 +224,14 @@ class PostgresQueryBuilder(object):
                 return "json_allattr(%sdoc) LIKE %s" % (table_prefix, self._value("%" + str(self._sub_param(value)) + "%"))
             else:   # default/others: ICONTAINS
                 return "json_allattr(%sdoc) ILIKE %s" % (table_prefix, self._value("%" + str(self._sub_param(value)) + "%"))
+        elif op == DQ.XOP_FULLTEXT:
+            value = args[0]
+            profile = self.query["query_args"].get("profile", "")
+            if profile != DataStore.DS_PROFILE.RESOURCES or self.ds_sub:
+                raise BadRequest("Full-text search only supported for resources")
+            ts_query = "fulltext_query(%s)" % self._value(unicode(self._sub_param(value)))
+            self.rank_exprs.append("ts_rank(%ssearch_tsv,%s)" % (table_prefix, ts_query))
+            return "%ssearch_tsv @@ %s" % (table_prefix, ts_query)
         elif op == DQ.XOP_KEYWORD:
             value = args[0]
             kw_values = value if type(value) in (list, tuple) else [value]
@@ -341,6 +394,51 @@ class PostgresQueryBuilder(object):
         else:
             raise BadRequest("Unknown op: %s" % op)
 
+    def _jsonb_containable(self, attname, values):
+        """
+        Returns True if documents with the attribute matching one of the given string values can be
+        prefiltered by jsonb containment. This is not the case for paths with array indexes, and for
+        values that may be the text of objects or arrays with other than one element (see json_string).
+        Note: Values of nested arrays (e.g. [["a"]]) are not matched by the prefilter.
+        """
+        if any(key.isdigit() for key in attname.split(".")):
+            return False
+        return all(value and "[" not in value and "," not in value for value in values)
+
+    def _jsonb_contains(self, table_prefix, attname, values):
+        """
+        Returns a filter expression matching jsonb documents containing the attribute with one of the
+        given string values. Because attribute values are compared as text, numeric and boolean values
+        are matched as string and in their JSON type, and also as single element array.
+        Used as index supported prefilter for json_string; see _jsonb_containable.
+        """
+        match_docs = []
+        for value in values:
+            match_values = [value, [value]]
+            if value in ("True", "False"):
+                match_values.append(value == "True")
+            elif value in ("true", "false"):
+                # Booleans in arrays are converted to lower case text
+                match_values.append([value == "true"])
+            else:
+                try:
+                    num_value = int(value)
+                except ValueError:
+                    try:
+                        num_value = float(value)
+                        if num_value - num_value != 0:     # inf or nan
+                            num_value = None
+                    except ValueError:
+                        num_value = None
+                if num_value is not None:
+                    match_values.extend([num_value, [num_value]])
+            for match_value in match_values:
+                match_doc = match_value
+                for key in reversed(attname.split(".")):
+                    match_doc = {key: match_doc}
+                match_docs.append("%sdoc @> %s::jsonb" % (table_prefix, self._value(json.dumps(match_doc))))
+        return "(%s)" % " OR ".join(match_docs)
+
     def _build_order_by(self, expr):
         if not expr:
             return ""
@@ -350,6 +448,117 @@ class PostgresQueryBuilder(object):
         order_by = ",".join(order_by_list)
         return order_by
 
+    def _add_rank_order(self):
+        """Orders by descending full-text search rank if the query has a full-text filter and no order"""
+        if self.rank_exprs and not self.order_by:
+            self.order_by = "+".join(self.rank_exprs) + " DESC"
+
+    def _add_keyset_paging(self):
+        """
+        For keyset (seek) paging, orders by the order_by columns and id and adds a filter to continue
+        after the row position given by the page token, so that deep pages do not need to scan and
+        discard skipped rows. The key columns are appended to the returned columns to create the
+        next page token. Order columns must be standard columns; NULL values sort as in Postgres
+        (last for ASC, first for DESC) and are continued after consistently.
+        """
+        qargs = self.query["query_args"]
+        if not qargs.get("keyset", False):
+            return
+        order_by = self.query["order_by"] or []
+        sort_orders = {colsort.lower() for col, colsort in order_by}
+        if len(sort_orders) > 1:
+            raise BadRequest("Keyset paging requires the same sort order for all order_by columns")
+        for col, colsort in order_by:
+            if not self._is_standard_col(col):
+                raise BadRequest("Keyset paging requires order_by on standard columns, not %s" % col)
+        descending = "desc" in sort_orders
+        table_prefix = self.table_aliases[0] + "."
+        self.keyset_cols = [table_prefix + col for col, colsort in order_by if col != "id"] + [table_prefix + "id"]
+        self.order_by = ",".join("%s %s" % (col, "DESC" if descending else "ASC") for col in self.keyset_cols)
+
+        page_token = qargs.get("page_token", None)
+        if page_token:
+            key_values = DatastoreQueryBuilder.parse_page_token(page_token)
+            if len(key_values) != len(self.keyset_cols):
+                raise BadRequest("Page token does not match query order")
+            seek_expr = self._get_seek_expr(self.keyset_cols, key_values, descending)
+            self.where = "(%s) AND %s" % (self.where, seek_expr) if self.where else seek_expr
+
+        self.cols = self.cols + self.keyset_cols
+
+    def _get_seek_expr(self, key_cols, key_values, descending):
+        """
+        Returns a filter for rows after the given key values in (key_cols) order. The main branch is
+        a row value comparison, which an index on the key columns can use as a range scan. Rows with
+        NULL keys sort last for ASC and first for DESC; a row comparison never matches them, so they
+        are continued after in separate branches. The last key column (id) is never NULL.
+        """
+        op = "<" if descending else ">"
+        num_set = key_values.index(None) if None in key_values else len(key_values)
+        cols = key_cols[:num_set]
+        values = [self._value(value) for value in key_values[:num_set]]
+        eq_exprs = ["%s=%s" % (col, value) for col, value in zip(cols, values)]
+
+        branches = []
+        if len(cols) == 1:
+            branches.append("%s%s%s" % (cols[0], op, values[0]))
+        elif cols:
+            branches.append("(%s)%s(%s)" % (",".join(cols), op, ",".join(values)))
+        if not descending:
+            # NULL keys after equal leading keys sort after the token
+            for i in xrange(min(num_set, len(key_cols) - 1)):
+                null_expr = " AND ".join(eq_exprs[:i] + ["%s IS NULL" % cols[i]])
+                branches.append("(%s)" % null_expr if i else null_expr)
+        if num_set < len(key_cols):
+            col = key_cols[num_set]
+            rest_expr = self._get_seek_expr(key_cols[num_set + 1:], key_values[num_set + 1:], descending)
+            if not descending:
+                branches.append("(%s)" % " AND ".join(eq_exprs + ["%s IS NULL" % col, rest_expr]))
+            elif eq_exprs:
+                branches.append("(%s AND (%s IS NOT NULL OR (%s IS NULL AND %s)))" % (
+                    " AND ".join(eq_exprs), col, col, rest_expr))
+            else:
+                branches.append("%s IS NOT NULL" % col)
+                branches.append("(%s IS NULL AND %s)" % (col, rest_expr))
+        return branches[0] if len(branches) == 1 else "(%s)" % " OR ".join(branches)
+
+    def _add_aggregate(self):
+        """
+        Replaces the returned columns with an aggregate function over the matching rows:
+        COUNT(*), SELECT DISTINCT over the aggregate columns or COUNT(*) with GROUP BY the
+        aggregate columns. Aggregate columns are standard columns or json attribute paths.
+        """
+        if not self.aggregate:
+            return
+        if self.keyset_cols:
+            raise BadRequest("Keyset paging not supported for aggregate queries")
+        if self.group_by:
+            raise BadRequest("Aggregate not supported with group_by")
+        self.has_basic_cols = False
+        table_prefix = "base." if self.query_format == "complex" else ""
+        agg_cols = []
+        for col in self.query["query_args"].get("aggregate_cols", None) or []:
+            if self._is_standard_col(col):
+                agg_cols.append(table_prefix + col)
+            else:
+                agg_cols.append("json_string(%sdoc,%s)" % (table_prefix, self._value(col)))
+        col_nums = ",".join(str(i + 1) for i in xrange(len(agg_cols)))
+
+        if self.aggregate == DQ.AGG_COUNT:
+            self.cols = ["COUNT(*)"]
+            self.order_by = ""
+        elif not agg_cols:
+            raise BadRequest("Aggregate %s requires columns" % self.aggregate)
+        elif self.aggregate == DQ.AGG_DISTINCT:
+            self.cols = ["DISTINCT " + ",".join(agg_cols)]
+            self.order_by = col_nums
+        elif self.aggregate == DQ.AGG_GROUP_COUNT:
+            self.cols = agg_cols + ["COUNT(*)"]
+            self.group_by = col_nums
+            self.order_by = col_nums
+        else:
+            raise BadRequest("Unknown aggregate: %s" % self.aggregate)
+
     def get_query(self):
         qargs = self.query["query_args"]
         frags = []
@@ -369,12 +578,13 @@ class PostgresQueryBuilder(object):
         if self.order_by:
             frags.append(" ORDER BY ")
             frags.append(self.order_by)
-        if qargs.get("limit", 0) > 0:
-            frags.append(" LIMIT ")
-            frags.append(str(qargs["limit"]))
-        if qargs.get("skip", 0) > 0:
-            frags.append(" OFFSET ")
-            frags.append(str(qargs["skip"]))
+        if self.aggregate != DQ.AGG_COUNT:   # Count is over all matching rows
+            if qargs.get("limit", 0) > 0:
+                frags.append(" LIMIT ")
+                frags.append(str(qargs["limit"]))
+            if qargs.get("skip", 0) > 0 and not self.keyset_cols:
+                frags.append(" OFFSET ")
+                frags.append(str(qargs["skip"]))
 
         query_str = "".join(frags)
         #print "###SQL:", query_str
@@ -5,13 +5,18 @@
 __author__ = 'Michael Meisinger'
 
 import contextlib
+import re
 import gevent
-from gevent.queue import Queue
+from gevent.queue import Queue, Empty
 from gevent.socket import wait_read, wait_write
 import time
 import sys
 import simplejson as json
 
+from putil.logging import log
+from pyon.core.exception import Timeout
+from pyon.datastore.postgresql import pg_profiler
+
 try:
     import psycopg2
     from psycopg2 import OperationalError, ProgrammingError, DatabaseError, IntegrityError, extensions
@@ -43,43 +48,274 @@ extensions.set_wait_callback(gevent_wait_callback)
 
 # Set JSON to Pyon default simplejson to get str instead of unicode in deserialization
 register_default_json(None, globally=True, loads=json.loads)
+try:
+    from psycopg2.extras import register_default_jsonb
+    register_default_jsonb(None, globally=True, loads=json.loads)
+except ImportError:
+    pass    # psycopg2 before 2.5.4 has no jsonb support
+
+
+# Matches psycopg2 pyformat placeholders (named, positional) and escaped percent signs
+PARAM_PATTERN = re.compile(r"%\((\w+)\)s|%s|%%")
+
+# Upper bounds (in seconds) of the pool checkout wait time histogram buckets
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def convert_prepared_statement(statement):
+    """
+    Converts a psycopg2 (pyformat) parameterized statement into a Postgres server-side
+    prepared statement body with positional $n parameters.
+    Returns a tuple of the converted statement and a list with the name (for dict args)
+    or index (for sequence args) of the argument to bind to each $n parameter.
+    """
+    arg_refs = []
+    name_pos = {}
+
+    def repl(match):
+        frag = match.group(0)
+        if frag == "%%":
+            return "%"
+        if frag == "%s":
+            arg_refs.append(len(arg_refs))
+            return "$%s" % len(arg_refs)
+        argname = match.group(1)
+        if argname not in name_pos:
+            arg_refs.append(argname)
+            name_pos[argname] = len(arg_refs)
+        return "$%s" % name_pos[argname]
+
+    prep_statement = PARAM_PATTERN.sub(repl, statement)
+    return prep_statement, arg_refs
 
 
 class DatabaseConnectionPool(object):
     """Gevent compliant database connection pool"""
 
-    def __init__(self, maxsize=100):
+    def __init__(self, maxsize=100, max_prepared=200, checkout_timeout=None, max_lifetime=None, idle_timeout=None):
         if not isinstance(maxsize, (int, long)):
             raise TypeError('Expected integer, got %r' % (maxsize, ))
         self.maxsize = maxsize  # Maximum connections (pool + checkout out)
         self.pool = Queue()     # Open connection pool
         self.size = 0           # Number of open connections
 
+        # Connection health and recycling
+        self.checkout_timeout = checkout_timeout or None   # Max seconds to wait for a connection (None=forever)
+        self.max_lifetime = max_lifetime or None           # Max seconds since connect before a connection is closed
+        self.idle_timeout = idle_timeout or None           # Max seconds a connection may sit idle in the pool
+        self._conn_times = {}   # conn -> [connect time, last checkin time]
+        self._validator = None  # Greenlet periodically pinging idle connections
+
+        # Statistics
+        self.waiting = 0        # Number of greenlets currently waiting for a connection
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.wait_hist = [0] * (len(WAIT_BUCKETS) + 1)
+        self.created = 0
+        self.recycled = 0
+        self.validation_failures = 0
+
+        # Server-side prepared statements, per connection: conn -> {statement: (stmt_name, arg_refs)}
+        self.max_prepared = max_prepared   # Maximum prepared statements per connection
+        self._prepared = {}
+        self._prepared_count = 0           # Used to generate unique statement names
+        self.prepared_hits = 0
+        self.prepared_misses = 0
+
     def get(self):
         pool = self.pool
-        if self.size >= self.maxsize or pool.qsize():
-            return pool.get()
-        else:
-            self.size += 1
-            try:
-                new_item = self.create_connection()
-            except:
-                self.size -= 1
-                raise
-            return new_item
+        t_begin = time.time()
+        try:
+            while True:
+                if self.size >= self.maxsize or pool.qsize():
+                    self.waiting += 1
+                    try:
+                        conn = pool.get(timeout=self.checkout_timeout)
+                    except Empty:
+                        self.checkout_timeouts += 1
+                        raise Timeout("Timeout after %s sec waiting for a database connection (pool size=%s, in use=%s, waiting=%s)" % (
+                            self.checkout_timeout, self.size, self.size - pool.qsize(), self.waiting - 1))
+                    finally:
+                        self.waiting -= 1
+                    if self._is_expired(conn):
+                        self._close_connection(conn)
+                        continue
+                    return conn
+                else:
+                    self.size += 1
+                    try:
+                        new_item = self.create_connection()
+                    except:
+                        self.size -= 1
+                        raise
+                    self.created += 1
+                    self._conn_times[new_item] = [time.time(), None]
+                    return new_item
+        finally:
+            self._record_wait(time.time() - t_begin)
 
     def put(self, item):
-        self.pool.put(item)
+        conn_times = self._conn_times.get(item, None)
+        if conn_times is not None:
+            conn_times[1] = time.time()
+        if self._is_expired(item):
+            self._close_connection(item)
+        else:
+            self.pool.put(item)
 
     def closeall(self):
+        self.stop_validation()
         while not self.pool.empty():
             conn = self.pool.get_nowait()
+            self._prepared.pop(conn, None)
+            self._conn_times.pop(conn, None)
             try:
                 conn.close()
                 self.size -= 1
             except Exception:
                 pass
 
+    def _record_wait(self, wait_time):
+        self.checkouts += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+        for i, bucket in enumerate(WAIT_BUCKETS):
+            if wait_time <= bucket:
+                self.wait_hist[i] += 1
+                break
+        else:
+            self.wait_hist[-1] += 1
+
+    def _is_expired(self, conn):
+        """Returns True if the connection is closed or exceeded its max lifetime or idle time"""
+        if conn.closed:
+            return True
+        conn_times = self._conn_times.get(conn, None)
+        if conn_times is None:
+            return False
+        now = time.time()
+        if self.max_lifetime and now - conn_times[0] > self.max_lifetime:
+            return True
+        if self.idle_timeout and conn_times[1] and now - conn_times[1] > self.idle_timeout:
+            return True
+        return False
+
+    def _close_connection(self, conn):
+        """Closes a connection that is not in the pool and frees its slot"""
+        self._prepared.pop(conn, None)
+        self._conn_times.pop(conn, None)
+        self.size -= 1
+        self.recycled += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def start_validation(self, interval):
+        """Starts a background greenlet that validates idle connections every interval seconds"""
+        if interval and not self._validator:
+            self._validator = gevent.spawn(self._validation_loop, interval)
+            self._validator._glname = "DatabaseConnectionPool validation"
+
+    def stop_validation(self):
+        if self._validator:
+            self._validator.kill()
+            self._validator = None
+
+    def _validation_loop(self, interval):
+        while True:
+            gevent.sleep(interval)
+            try:
+                self.validate_idle()
+            except Exception:
+                log.exception("Error validating database connections")
+
+    def validate_idle(self):
+        """Closes expired idle connections and pings the remaining ones, closing those that fail"""
+        for i in xrange(self.pool.qsize()):
+            try:
+                conn = self.pool.get_nowait()
+            except Empty:
+                break
+            if self._is_expired(conn):
+                self._close_connection(conn)
+                continue
+            try:
+                cur = conn.cursor()
+                cur.execute("SELECT 1")
+                cur.close()
+                conn.rollback()
+            except Exception as ex:
+                log.warn("Closing database connection that failed validation: %s", ex)
+                self.validation_failures += 1
+                self._close_connection(conn)
+                continue
+            # Put back directly without updating the last checkin time
+            self.pool.put(conn)
+
+    def get_stats(self):
+        """Returns connection pool usage, checkout wait time and recycling statistics"""
+        idle = self.pool.qsize()
+        wait_hist = {"le_%s" % bucket: count for bucket, count in zip(WAIT_BUCKETS, self.wait_hist)}
+        wait_hist["le_inf"] = self.wait_hist[-1]
+        return dict(maxsize=self.maxsize,
+                    size=self.size,
+                    idle=idle,
+                    in_use=self.size - idle,
+                    waiting=self.waiting,
+                    checkouts=self.checkouts,
+                    checkout_timeouts=self.checkout_timeouts,
+                    wait_time_avg=self.wait_time_total / self.checkouts if self.checkouts else 0.0,
+                    wait_time_max=self.wait_time_max,
+                    wait_hist=wait_hist,
+                    created=self.created,
+                    recycled=self.recycled,
+                    validation_failures=self.validation_failures,
+                    prepared=self.get_prepared_stats())
+
+    def execute_prepared(self, cursor, statement, args=None):
+        """
+        Executes a parameterized statement as server-side prepared statement on the cursor's
+        connection. The statement is PREPAREd (parsed and planned) by the server the first time
+        its shape (the statement text) is seen on a connection and EXECUTEd on subsequent calls.
+        Statements must reference all values via placeholders (no literals that vary per call).
+        """
+        conn = cursor.connection
+        conn_stmts = self._prepared.setdefault(conn, {})
+        prep_info = conn_stmts.get(statement, None)
+        if prep_info is None:
+            if len(conn_stmts) >= self.max_prepared:
+                # Cache full for this connection - fall back to a one-off statement
+                self.prepared_misses += 1
+                return cursor.execute(statement, args)
+            self._prepared_count += 1
+            stmt_name = "ion_ps%s" % self._prepared_count
+            prep_statement, arg_refs = convert_prepared_statement(statement)
+            cursor.execute("PREPARE " + stmt_name + " AS " + prep_statement)
+            prep_info = stmt_name, arg_refs
+            conn_stmts[statement] = prep_info
+            self.prepared_misses += 1
+        else:
+            self.prepared_hits += 1
+
+        stmt_name, arg_refs = prep_info
+        if isinstance(cursor, TracingCursor):
+            # Profile the statement shape rather than the EXECUTE of the prepared statement
+            cursor._profile_stmt = statement
+        if not arg_refs:
+            return cursor.execute("EXECUTE " + stmt_name)
+        exec_args = [args[ref] for ref in arg_refs]
+        return cursor.execute("EXECUTE " + stmt_name + " (" + ",".join(["%s"] * len(exec_args)) + ")", exec_args)
+
+    def get_prepared_stats(self):
+        """Returns prepared statement cache statistics"""
+        return dict(hits=self.prepared_hits,
+                    misses=self.prepared_misses,
+                    connections=len(self._prepared),
+                    statements=sum(len(stmts) for stmts in self._prepared.itervalues()))
+
     @contextlib.contextmanager
     def connection(self, isolation_level=None):
         conn = self.get()
@@ -92,6 +328,7 @@ class DatabaseConnectionPool(object):
             yield conn
         except:
             if conn.closed:
+                self._close_connection(conn)
                 conn = None
                 self.closeall()
             else:
@@ -124,6 +361,7 @@ class DatabaseConnectionPool(object):
             yield cur
         except:
             if conn.closed:
+                self._close_connection(conn)
                 conn = None
                 self.closeall()
             else:
@@ -179,11 +417,15 @@ class PostgresConnectionPool(DatabaseConnectionPool):
         self.connect = kwargs.pop('connect', psycopg2.connect)
         self.tracer = kwargs.pop('tracer', None)
         maxsize = kwargs.pop('maxsize', None)
+        pool_args = dict(max_prepared=kwargs.pop('max_prepared', 200),
+                         checkout_timeout=kwargs.pop('checkout_timeout', None),
+                         max_lifetime=kwargs.pop('max_lifetime', None),
+                         idle_timeout=kwargs.pop('idle_timeout', None))
         self.args = args
         self.kwargs = kwargs
         if self.tracer:
             self.kwargs.setdefault("connection_factory", TracingConnection)
-        DatabaseConnectionPool.__init__(self, maxsize)
+        DatabaseConnectionPool.__init__(self, maxsize, **pool_args)
 
     def create_connection(self):
         conn = self.connect(*self.args, **self.kwargs)
@@ -233,14 +475,22 @@ class TracingCursor(_cursor):
 
     def execute(self, query, vars=None):
         query_time = 0
+        profile_stmt, self._profile_stmt = getattr(self, "_profile_stmt", None), None
+        success = False
         try:
             t_begin = time.time()
             res = super(TracingCursor, self).execute(query, vars)
             query_time = time.time() - t_begin
+            success = True
             return res
         finally:
             if self._tracer:
                 self._log_call(self._tracer, trace_stmt=self._trace_stmt, query_time=query_time)
+            if pg_profiler.query_profiler:
+                if not success:
+                    query_time = time.time() - t_begin
+                pg_profiler.query_profiler.record(profile_stmt or query, query_time, rows=self.rowcount,
+                                                  error=not success, cursor=self if success else None)
 
     def callproc(self, procname, vars=None):
         query_time = 0
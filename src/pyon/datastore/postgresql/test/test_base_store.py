@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import IonUnitTestCase
+
+from pyon.core.exception import BadRequest
+from pyon.datastore.postgresql.base_store import get_partition_range
+
+
+@attr('UNIT', group='datastore')
+class PostgresBaseStoreUnitTest(IonUnitTestCase):
+
+    def test_partition_range(self):
+        # 2026-10-18 13:05 UTC
+        self.assertEquals(get_partition_range("1792328700000", "daily"),
+                          ("p20261018", "1792281600000", "1792368000000"))
+        self.assertEquals(get_partition_range("1792328700000", "monthly"),
+                          ("p202610", "1790812800000", "1793491200000"))
+
+        # Boundaries are inclusive start, exclusive end
+        self.assertEquals(get_partition_range("1792281600000", "daily")[0], "p20261018")
+        self.assertEquals(get_partition_range("1792367999999", "daily")[0], "p20261018")
+        self.assertEquals(get_partition_range("1792368000000", "daily")[0], "p20261019")
+
+        # Year rollover
+        self.assertEquals(get_partition_range("1798761540000", "monthly"),
+                          ("p202612", "1796083200000", "1798761600000"))
+        self.assertEquals(get_partition_range("1798761600000", "monthly")[0], "p202701")
+
+        with self.assertRaises(BadRequest):
+            get_partition_range("1792328700000", "weekly")
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+from nose.plugins.attrib import attr
+import os
+import tempfile
+
+from pyon.util.unit_test import IonUnitTestCase
+
+from pyon.datastore.postgresql.pg_profiler import QueryProfiler, normalize_statement
+
+
+@attr('UNIT', group='datastore')
+class PostgresProfilerUnitTest(IonUnitTestCase):
+
+    def test_normalize_statement(self):
+        self.assertEquals(normalize_statement("SELECT doc FROM ion_resources WHERE id='abc' AND lcstate<>'DELETED'"),
+                          "SELECT doc FROM ion_resources WHERE id=? AND lcstate<>?")
+        self.assertEquals(normalize_statement("SELECT id FROM t1 WHERE  rev=%(rev)s\n LIMIT 10 OFFSET 20"),
+                          "SELECT id FROM t1 WHERE rev=? LIMIT ? OFFSET ?")
+        self.assertEquals(normalize_statement("SELECT id FROM t WHERE id IN ('a', 'b','c') AND x=-1.5"),
+                          "SELECT id FROM t WHERE id IN (?,...) AND x=?")
+        self.assertEquals(normalize_statement("INSERT INTO t (id, doc) VALUES (%s, %s), (%s, %s), (%s, %s)"),
+                          "INSERT INTO t (id, doc) VALUES (?,...),...")
+        self.assertEquals(normalize_statement("SELECT * FROM t WHERE s=ANY(ARRAY['a','b'])"),
+                          "SELECT * FROM t WHERE s=ANY(ARRAY[?,...])")
+        self.assertEquals(normalize_statement("PREPARE ion_ps12 AS SELECT 1"), "PREPARE ion_ps? AS SELECT ?")
+
+    def test_profiler_stats(self):
+        prof = QueryProfiler(slow_threshold=0.5, max_shapes=3)
+        for i in xrange(100):
+            prof.record("SELECT doc FROM t WHERE id='id%s'" % i, (i + 1) / 1000.0, rows=1, op="svc.read")
+        prof.record("SELECT doc FROM t WHERE id=%s", 0.1, rows=0, op="svc.find")
+        prof.record("UPDATE t SET doc=%s WHERE id=%s", 0.8, rows=1, op="svc.update")
+
+        stats = prof.get_stats()
+        self.assertEquals(len(stats), 3)
+        self.assertEquals(stats[0]["op"], "svc.read")
+        self.assertEquals(stats[0]["shape"], "SELECT doc FROM t WHERE id=?")
+        self.assertEquals(stats[0]["count"], 100)
+        self.assertEquals(stats[0]["rows"], 100)
+        self.assertAlmostEquals(stats[0]["p50"], 0.05)
+        self.assertAlmostEquals(stats[0]["p95"], 0.095)
+        self.assertAlmostEquals(stats[0]["p99"], 0.099)
+        self.assertAlmostEquals(stats[0]["max_time"], 0.1)
+
+        shape_stats = prof.get_stats(by_op=False)
+        self.assertEquals(len(shape_stats), 2)
+        self.assertEquals(shape_stats[0]["count"], 101)
+
+        self.assertEquals(len(prof.slow_log), 1)
+        self.assertEquals(prof.slow_log[0]["op"], "svc.update")
+
+        # Shapes beyond the limit are aggregated
+        prof.record("DELETE FROM t WHERE id=%s", 0.01, op="svc.delete")
+        self.assertEquals(prof.get_stats()[-1]["shape"], "(other)")
+
+        fd, filename = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        try:
+            prof.save_csv(filename)
+            with open(filename, "r") as f:
+                lines = f.read().splitlines()
+            self.assertEquals(len(lines), 5)
+            self.assertTrue(lines[0].startswith("shape,op,count"))
+            self.assertTrue(lines[1].startswith('"SELECT doc FROM t WHERE id=?","svc.read",100,'))
+        finally:
+            os.remove(filename)
+
+        prof.reset()
+        self.assertEquals(prof.get_stats(), [])
+
+    def test_explain(self):
+        from pyon.datastore.postgresql.pg_util import extensions
+        executed = []
+
+        class FakeCursor(object):
+            def execute(self, query):
+                executed.append(query)
+            def fetchall(self):
+                return [("Plan",)]
+            def close(self):
+                pass
+
+        class FakeConnection(object):
+            closed = False
+            def get_transaction_status(self):
+                return extensions.TRANSACTION_STATUS_IDLE
+            def cursor(self, cursor_factory=None):
+                return FakeCursor()
+
+        prof = QueryProfiler()
+        self.assertEquals(prof.explain(FakeConnection(), "SELECT doc FROM t WHERE id='a'"), "Plan")
+        self.assertEquals(executed[-1], "EXPLAIN (ANALYZE, BUFFERS) SELECT doc FROM t WHERE id='a'")
+
+        # Prepared writes are classified by their original statement and never executed again
+        prof.explain(FakeConnection(), "EXECUTE ion_ps1 ('a')", statement="UPDATE t SET doc=%s WHERE id=%s")
+        self.assertEquals(executed[-1], "EXPLAIN EXECUTE ion_ps1 ('a')")
+        prof.explain(FakeConnection(), "EXECUTE ion_ps2 ('a')")
+        self.assertEquals(executed[-1], "EXPLAIN EXECUTE ion_ps2 ('a')")
+        prof.explain(FakeConnection(), "EXECUTE ion_ps3 ('a')", statement="SELECT doc FROM t WHERE id=%s")
+        self.assertEquals(executed[-1], "EXPLAIN (ANALYZE, BUFFERS) EXECUTE ion_ps3 ('a')")
+
+        # Named cursors explain the query of the cursor
+        prof.explain(FakeConnection(), 'DECLARE "qiter_1" CURSOR WITHOUT HOLD FOR SELECT doc FROM t',
+                     statement="SELECT doc FROM t")
+        self.assertEquals(executed[-1], "EXPLAIN (ANALYZE, BUFFERS) SELECT doc FROM t")
@@ -7,9 +7,11 @@ from nose.plugins.attrib import attr
 from unittest import SkipTest
 from mock import Mock, patch, ANY
 
+from pyon.core.exception import BadRequest
 from pyon.util.int_test import IonIntegrationTestCase
 from pyon.util.unit_test import IonUnitTestCase
 
+from pyon.datastore.datastore import DataStore
 from pyon.datastore.datastore_query import DatastoreQueryBuilder
 from pyon.datastore.postgresql.pg_query import PostgresQueryBuilder
 
@@ -54,4 +56,125 @@ class PostgresDataStoreUnitTest(IonUnitTestCase):
         qb = DatastoreQueryBuilder()
         qb.build_query(where=qb.within_geom(qb.RA_GEOM_LOC,wkt,buf))
         pqb = PostgresQueryBuilder(qb.get_query(), 'test')
-        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Within(geom_loc,ST_Buffer(ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'), 0.100000))")
\ No newline at end of file
+        self.assertEquals(pqb.get_query(),"SELECT id,doc FROM test WHERE ST_Within(geom_loc,ST_Buffer(ST_GeomFromEWKT('SRID=4326;POINT(-72.0 40.0)'), 0.100000))")
+
+    def test_keyset_paging(self):
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.eq(qb.ATT_TYPE, "Org"), order_by=qb.order_by("ts_created"))
+        qb.set_keyset_paging(10)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc,test.ts_created,test.id FROM test WHERE type_=%(v1)s ORDER BY test.ts_created ASC,test.id ASC LIMIT 10")
+        self.assertEquals(pqb.keyset_cols, ["test.ts_created", "test.id"])
+
+        page_token = DatastoreQueryBuilder.create_page_token(["1400000000000", "ID1"])
+        self.assertEquals(DatastoreQueryBuilder.parse_page_token(page_token), ["1400000000000", "ID1"])
+
+        qb.build_query(order_by=qb.order_by("ts_created", "desc"))
+        qb.set_keyset_paging(10, page_token)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc,test.ts_created,test.id FROM test WHERE (type_=%(v1)s) AND (test.ts_created,test.id)<(%(v2)s,%(v3)s) ORDER BY test.ts_created DESC,test.id DESC LIMIT 10")
+        self.assertEquals(pqb.get_values(), dict(v1="Org", v2="1400000000000", v3="ID1"))
+
+        # Rows with NULL keys sort last for ASC and are not skipped
+        qb.build_query(order_by=qb.order_by("name"))
+        qb.set_keyset_paging(10, DatastoreQueryBuilder.create_page_token(["Name1", "ID1"]))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc,test.name,test.id FROM test WHERE (type_=%(v1)s) AND ((test.name,test.id)>(%(v2)s,%(v3)s) OR test.name IS NULL) ORDER BY test.name ASC,test.id ASC LIMIT 10")
+
+        qb.set_keyset_paging(10, DatastoreQueryBuilder.create_page_token([None, "ID1"]))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc,test.name,test.id FROM test WHERE (type_=%(v1)s) AND (test.name IS NULL AND test.id>%(v2)s) ORDER BY test.name ASC,test.id ASC LIMIT 10")
+
+        qb.build_query(order_by=qb.order_by("name", "desc"))
+        qb.set_keyset_paging(10, DatastoreQueryBuilder.create_page_token([None, "ID1"]))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc,test.name,test.id FROM test WHERE (type_=%(v1)s) AND (test.name IS NOT NULL OR (test.name IS NULL AND test.id<%(v2)s)) ORDER BY test.name DESC,test.id DESC LIMIT 10")
+
+        qb.build_query(order_by=qb.order_by(["name", "ts_created"]))
+        qb.set_keyset_paging(10, DatastoreQueryBuilder.create_page_token(["Name1", None, "ID1"]))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc,test.name,test.ts_created,test.id FROM test WHERE (type_=%(v1)s) AND (test.name>%(v2)s OR test.name IS NULL OR (test.name=%(v2)s AND test.ts_created IS NULL AND test.id>%(v3)s)) ORDER BY test.name ASC,test.ts_created ASC,test.id ASC LIMIT 10")
+
+        # Order by json attributes is not supported
+        qb.build_query(order_by=qb.order_by("description"))
+        qb.set_keyset_paging(10)
+        self.assertRaises(BadRequest, PostgresQueryBuilder, qb.get_query(), 'test')
+
+    def test_aggregate(self):
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.eq(qb.ATT_TYPE, "Org"), order_by=qb.order_by("name"), limit=10, skip=20)
+        qb.set_aggregate(qb.AGG_COUNT)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT COUNT(*) FROM test WHERE type_=%(v1)s")
+
+        qb.set_aggregate(qb.AGG_DISTINCT, qb.RA_LCSTATE, "details.name")
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT DISTINCT lcstate,json_string(doc,%(v2)s) FROM test WHERE type_=%(v1)s ORDER BY 1,2 LIMIT 10 OFFSET 20")
+        self.assertEquals(pqb.get_values(), dict(v1="Org", v2="details.name"))
+
+        qb.set_aggregate(qb.AGG_GROUP_COUNT, qb.ATT_TYPE)
+        qb.build_query(limit=0, skip=0)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT type_,COUNT(*) FROM test WHERE type_=%(v1)s GROUP BY 1 ORDER BY 1")
+
+        self.assertRaises(BadRequest, qb.set_aggregate, qb.AGG_DISTINCT)
+        qb.set_aggregate(None)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE type_=%(v1)s ORDER BY name ASC")
+
+    def test_projection(self):
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.eq(qb.ATT_TYPE, "Org"))
+        qb.set_projection("name", "details.url")
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc->%(v1)s,doc->%(v2)s,doc#>%(v3)s::text[] FROM test WHERE type_=%(v4)s")
+        self.assertEquals(pqb.get_values(), dict(v1="type_", v2="name", v3=["details", "url"], v4="Org"))
+        self.assertEquals(pqb.projection, ["type_", "name", "details.url"])
+
+        qb.set_id_only(True)
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id FROM test WHERE type_=%(v1)s")
+        self.assertEquals(pqb.projection, [])
+
+    def test_jsonb_filter(self):
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.and_(qb.eq(qb.ATT_TYPE, "Org"), qb.eq("details.count", "5")))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE (type_=%(v1)s AND json_string(doc,%(v2)s)=%(v3)s)")
+
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test', jsonb=True)
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE (type_=%(v1)s AND ((doc @> %(v2)s::jsonb OR doc @> %(v3)s::jsonb OR doc @> %(v4)s::jsonb OR doc @> %(v5)s::jsonb) AND json_string(doc,%(v6)s)=%(v7)s))")
+        self.assertEquals(pqb.get_values(), dict(v1="Org", v2='{"details": {"count": "5"}}', v3='{"details": {"count": ["5"]}}',
+                                                 v4='{"details": {"count": 5}}', v5='{"details": {"count": [5]}}',
+                                                 v6="details.count", v7="5"))
+
+        qb.build_query(where=qb.in_("name_alias", "A", "True"))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test', jsonb=True)
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE ((doc @> %(v3)s::jsonb OR doc @> %(v4)s::jsonb OR doc @> %(v5)s::jsonb OR doc @> %(v6)s::jsonb OR doc @> %(v7)s::jsonb) AND json_string(doc,%(v8)s) IN (%(v1)s,%(v2)s))")
+        self.assertEquals(pqb.get_values()["v7"], '{"name_alias": true}')
+
+        # Array indexes and values of arrays or objects are not prefiltered
+        qb.build_query(where=qb.eq("details.list.0", "A"))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test', jsonb=True)
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE json_string(doc,%(v1)s)=%(v2)s")
+
+        qb.build_query(where=qb.in_("name_alias", "A", "A,B"))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test', jsonb=True)
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE json_string(doc,%(v3)s) IN (%(v1)s,%(v2)s)")
+
+    def test_fulltext(self):
+        qb = DatastoreQueryBuilder()
+        qb.build_query(where=qb.and_(qb.eq(qb.ATT_TYPE, "Org"), qb.fulltext("ocean data")))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertEquals(pqb.get_query(), "SELECT id,doc FROM test WHERE (type_=%(v1)s AND search_tsv @@ fulltext_query(%(v2)s)) ORDER BY ts_rank(search_tsv,fulltext_query(%(v2)s)) DESC")
+        self.assertEquals(pqb.get_values(), dict(v1="Org", v2="ocean data"))
+
+        # Explicit order takes precedence over rank
+        qb.build_query(order_by=qb.order_by("name"))
+        pqb = PostgresQueryBuilder(qb.get_query(), 'test')
+        self.assertTrue(pqb.get_query().endswith(" ORDER BY name ASC"))
+
+        qb = DatastoreQueryBuilder(profile=DataStore.DS_PROFILE.EVENTS)
+        qb.build_query(where=qb.fulltext("ocean"))
+        with self.assertRaises(BadRequest):
+            PostgresQueryBuilder(qb.get_query(), 'test')
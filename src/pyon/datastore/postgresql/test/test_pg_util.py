@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+from nose.plugins.attrib import attr
+from mock import Mock
+
+from pyon.util.unit_test import IonUnitTestCase
+
+from pyon.core.exception import Timeout
+from pyon.datastore.postgresql.pg_util import DatabaseConnectionPool, convert_prepared_statement
+
+
+@attr('UNIT', group='datastore')
+class PostgresUtilUnitTest(IonUnitTestCase):
+
+    def test_convert_prepared_statement(self):
+        stmt, arg_refs = convert_prepared_statement("SELECT doc FROM ion_resources WHERE id=%s")
+        self.assertEquals(stmt, "SELECT doc FROM ion_resources WHERE id=$1")
+        self.assertEquals(arg_refs, [0])
+
+        stmt, arg_refs = convert_prepared_statement("UPDATE t SET doc=%(doc)s, rev=%(revn)s WHERE id=%(id)s AND rev=%(rev)s")
+        self.assertEquals(stmt, "UPDATE t SET doc=$1, rev=$2 WHERE id=$3 AND rev=$4")
+        self.assertEquals(arg_refs, ["doc", "revn", "id", "rev"])
+
+        stmt, arg_refs = convert_prepared_statement("SELECT id FROM t WHERE (s=%(any)s OR o=%(any)s) AND name LIKE 'a%%'")
+        self.assertEquals(stmt, "SELECT id FROM t WHERE (s=$1 OR o=$1) AND name LIKE 'a%'")
+        self.assertEquals(arg_refs, ["any"])
+
+    def test_execute_prepared(self):
+        pool = DatabaseConnectionPool(maxsize=2, max_prepared=2)
+        cur = Mock()
+        cur.connection = Mock()
+
+        pool.execute_prepared(cur, "SELECT doc FROM t WHERE id=%(id)s", dict(id="ID1"))
+        self.assertEquals(cur.execute.call_count, 2)
+        self.assertEquals(cur.execute.call_args_list[0][0], ("PREPARE ion_ps1 AS SELECT doc FROM t WHERE id=$1",))
+        self.assertEquals(cur.execute.call_args_list[1][0], ("EXECUTE ion_ps1 (%s)", ["ID1"]))
+
+        pool.execute_prepared(cur, "SELECT doc FROM t WHERE id=%(id)s", dict(id="ID2"))
+        self.assertEquals(cur.execute.call_count, 3)
+        self.assertEquals(cur.execute.call_args_list[2][0], ("EXECUTE ion_ps1 (%s)", ["ID2"]))
+
+        stats = pool.get_prepared_stats()
+        self.assertEquals(stats["hits"], 1)
+        self.assertEquals(stats["misses"], 1)
+        self.assertEquals(stats["statements"], 1)
+
+        # Per connection limit reached: statements are executed unprepared
+        pool.execute_prepared(cur, "SELECT rev FROM t WHERE id=%s", ("ID1",))
+        pool.execute_prepared(cur, "DELETE FROM t WHERE id=%s", ("ID1",))
+        self.assertEquals(cur.execute.call_args_list[-1][0], ("DELETE FROM t WHERE id=%s", ("ID1",)))
+        self.assertEquals(pool.get_prepared_stats()["statements"], 2)
+
+    def test_pool_checkout(self):
+        pool = DatabaseConnectionPool(maxsize=2, checkout_timeout=0.05, max_lifetime=100)
+        pool.create_connection = Mock(side_effect=lambda: Mock(closed=False))
+
+        conn1, conn2 = pool.get(), pool.get()
+        self.assertEquals(pool.create_connection.call_count, 2)
+        stats = pool.get_stats()
+        self.assertEquals((stats["size"], stats["in_use"], stats["idle"]), (2, 2, 0))
+
+        with self.assertRaises(Timeout):
+            pool.get()
+        stats = pool.get_stats()
+        self.assertEquals(stats["checkout_timeouts"], 1)
+        self.assertEquals(stats["checkouts"], 3)
+        self.assertGreaterEqual(stats["wait_time_max"], 0.05)
+        self.assertEquals(sum(stats["wait_hist"].values()), 3)
+
+        pool.put(conn1)
+        self.assertEquals(pool.get_stats()["idle"], 1)
+        self.assertIs(pool.get(), conn1)
+
+        # Connections beyond max lifetime are closed on checkin and replaced on checkout
+        pool._conn_times[conn1][0] -= 200
+        pool.put(conn1)
+        self.assertTrue(conn1.close.called)
+        stats = pool.get_stats()
+        self.assertEquals((stats["size"], stats["idle"], stats["recycled"]), (1, 0, 1))
+        conn3 = pool.get()
+        self.assertIsNot(conn3, conn1)
+        self.assertEquals(pool.create_connection.call_count, 3)
+
+    def test_pool_validate(self):
+        pool = DatabaseConnectionPool(maxsize=3, idle_timeout=100)
+        pool.create_connection = Mock(side_effect=lambda: Mock(closed=False))
+        conn1, conn2, conn3 = pool.get(), pool.get(), pool.get()
+        conn2.cursor.return_value.execute.side_effect = Exception("connection lost")
+        for conn in (conn1, conn2, conn3):
+            pool.put(conn)
+        pool._conn_times[conn3][1] -= 200
+
+        pool.validate_idle()
+        self.assertTrue(conn1.cursor.return_value.execute.called)
+        self.assertTrue(conn2.close.called)
+        self.assertTrue(conn3.close.called)
+        self.assertFalse(conn3.cursor.called)
+        stats = pool.get_stats()
+        self.assertEquals((stats["size"], stats["idle"]), (1, 1))
+        self.assertEquals((stats["recycled"], stats["validation_failures"]), (2, 1))
@@ -206,6 +206,16 @@ class TestDataStores(IonIntegrationTestCase):
         self.assertTrue(role_objs1[1] is None)
         self.assertTrue(role_objs1[2]._id == data_provider_role_ooi_id)
 
+        # Chunked reads on parallel connections return results in input order
+        data_store.read_chunk_size, data_store.read_parallel = 2, 2
+        read_ids = [marine_operator_role_ooi_id, "NONEXISTENT", admin_role_ooi_id, data_provider_role_ooi_id, admin_role_ooi_id]
+        role_objs2 = data_store.read_mult(read_ids, strict=False)
+        self.assertEquals([o._id if o else None for o in role_objs2],
+                          [marine_operator_role_ooi_id, None, admin_role_ooi_id, data_provider_role_ooi_id, admin_role_ooi_id])
+        with self.assertRaises(NotFound):
+            data_store.read_mult(read_ids)
+        data_store.read_chunk_size, data_store.read_parallel = 2000, 3
+
         # Construct three user info objects and assign them roles
         hvl_contact_info = {
             "individual_names_given": "Heitor Villa-Lobos",
@@ -382,6 +392,24 @@ class TestDataStores(IonIntegrationTestCase):
         res = data_store.list_objects()
         self.assertTrue(len(res) == 11 + numcoredocs)
 
+        # Bulk insert mode
+        o1 = dict(type_="Resource", name="name2xxx", visibility=1, lcstate=LCS.DRAFT, availability=AS.AVAILABLE)
+        o2 = dict(type_="DirEntry", key="key2", parent="/Parent", org="ION")
+        o3 = dict(type_="Association", s=oids[0], o=oids[1], st="Dataset", ot="Dataset", p="other", retired=False)
+
+        res = data_store.create_doc_mult([o1, o2, o3], bulk_insert=True)
+        self.assertTrue(all([success for success, oid, rev in res]))
+        self.assertEquals([oid for success, oid, rev in res], [o1["_id"], o2["_id"], o3["_id"]])
+
+        res1 = data_store.find_associations(predicate="other", id_only=True)
+        self.assertEquals(len(res1), 1)
+
+        res1,_ = data_store.find_resources(name="name2xxx", id_only=True)
+        self.assertEquals(len(res1), 1)
+
+        res = data_store.list_objects()
+        self.assertTrue(len(res) == 14 + numcoredocs)
+
         # Delete data store to clean up
         data_store.delete_datastore()
 
@@ -932,3 +960,41 @@ class TestDataStores(IonIntegrationTestCase):
 
         # Clean up
         self.data_store.delete_mult([plat1_obj_id, plat2_obj_id, plat3_obj_id, aid1_obj_id, dp1_obj_id])
+
+    def test_datastore_jsonb(self):
+        if self.server_type != "postgresql":
+            raise SkipTest("Requires postgresql")
+        config = dict(CFG.get_safe("server.postgresql"), doc_storage="jsonb")
+        data_store = self.ds_class(datastore_name='ion_test_jsonb', config=config, scope=get_sys_name())
+        try:
+            data_store.delete_datastore()
+        except NotFound:
+            pass
+        data_store.create_datastore()
+        self.assertEquals(data_store.get_doc_type(), "jsonb")
+
+        docs = [dict(type_="T", str="a", num=10000000000000000, flt=0.30000000000000004, one=1.0, flag=True, none=None,
+                     list=["a"], list2=["a", 1, True], empty=[], obj={"x": 1}, nested={"list": [0.5]}, zero=0),
+                dict(type_="T", str="b", num=5, flag=False, list=["b"], obj={})]
+        doc_ids = [data_store.create_doc(doc)[0] for doc in docs]
+        keys = ["str", "num", "flt", "one", "flag", "none", "list", "list2", "empty", "obj", "obj.x",
+                "nested", "nested.list", "nested.list.0", "str.0", "zero.x", "missing", "missing.x"]
+
+        # The jsonb overload of json_string converts values to text like the json function
+        qual_ds_name = data_store._get_datastore_name()
+        with data_store.pool.cursor(**data_store.cursor_args) as cur:
+            for key in keys:
+                cur.execute('SELECT id, json_string(doc::json,%s), json_string(doc,%s) FROM "' + qual_ds_name + '"', (key, key))
+                for doc_id, json_str, jsonb_str in cur.fetchall():
+                    self.assertEquals(json_str, jsonb_str, "%s of %s: %s != %s" % (key, doc_id, json_str, jsonb_str))
+
+                # Filters with jsonb prefilter find the same documents as the json function
+                cur.execute('SELECT json_string(doc::json,%s) FROM "' + qual_ds_name + '"', (key,))
+                for value in set(row[0] for row in cur.fetchall() if row[0] is not None):
+                    cur.execute('SELECT id FROM "' + qual_ds_name + '" WHERE json_string(doc::json,%s)=%s', (key, value))
+                    expected_ids = sorted(row[0] for row in cur.fetchall())
+                    qb = DatastoreQueryBuilder()
+                    qb.build_query(where=qb.eq(key, value), id_only=True)
+                    self.assertEquals(sorted(data_store.find_by_query(qb.get_query())), expected_ids)
+
+        data_store.delete_datastore()
@@ -66,6 +66,9 @@ class Directory(object):
         """
         if self.event_sub:
             self.event_sub.deactivate()
+        if self.event_pub:
+            self.event_pub.close()
+            self.event_pub = None
         self.dir_store.close()
 
     # -------------------------------------------------------------------------
@@ -367,6 +367,7 @@ class EventRepository(object):
         # May be persistent or mock, forced clean, with indexes
         datastore_manager = datastore_manager or self.container.datastore_manager
         self.event_store = datastore_manager.get_datastore("events", DataStore.DS_PROFILE.EVENTS)
+        self.bulk_insert_threshold = CFG.get_safe("container.datastore.bulk_insert_threshold", 500)
 
     def start(self):
         pass
@@ -405,7 +406,8 @@ class EventRepository(object):
             raise BadRequest("events must all be type Event")
 
         if events:
-            event_res = self.event_store.create_mult(events, allow_ids=True)
+            event_res = self.event_store.create_mult(events, allow_ids=True,
+                                                     bulk_insert=len(events) >= self.bulk_insert_threshold)
             return [eid for success, eid, eobj in event_res]
         else:
             return None
@@ -462,6 +464,16 @@ class EventRepository(object):
                                                id_only=id_only, **kwargs)
         return events
 
+    def maintain_partitions(self):
+        """
+        Creates upcoming partitions of a time partitioned events datastore and drops partitions
+        past the configured retention period. Does nothing if the events datastore is not partitioned.
+        Returns list of dropped partition names.
+        """
+        if not hasattr(self.event_store, "maintain_partitions"):
+            return []
+        return self.event_store.maintain_partitions()
+
     def find_events_query(self, query, id_only=False):
         """
         Find events or event ids by using a standard datastore query. This function fills in datastore and
@@ -477,6 +489,19 @@ class EventRepository(object):
         log.debug("find_events_query() found %s events", len(events))
         return events
 
+    def find_events_query_iter(self, query, id_only=False, chunk_size=None):
+        """
+        Same as find_events_query, but returns an iterator over events or event ids that are fetched
+        from the datastore in chunks. Use for large result sets.
+        """
+        if not query or not isinstance(query, dict) or not QUERY_EXP_KEY in query:
+            raise BadRequest("Illegal events query")
+        qargs = query["query_args"]
+        qargs["datastore"] = DataStore.DS_EVENTS
+        qargs["profile"] = DataStore.DS_PROFILE.EVENTS
+        qargs["id_only"] = id_only
+        return self.event_store.find_by_query_iter(query, chunk_size=chunk_size)
+
 
 class EventGate(EventSubscriber):
     def __init__(self, *args, **kwargs):
@@ -507,7 +532,10 @@ def handle_stream_exception(iorigin="stream_exception"):
             except StreamException as e:
                 info = "".join(traceback.format_tb(sys.exc_info()[2]))
                 pub = EventPublisher(event_type="ExceptionEvent")
-                pub.publish_event(origin=iorigin, description="stream exception event", exception_type=str(type(e)), exception_message=info)
+                try:
+                    pub.publish_event(origin=iorigin, description="stream exception event", exception_type=str(type(e)), exception_message=info)
+                finally:
+                    pub.close()
         return wrapped
     return real_decorator
 
@@ -6,6 +6,7 @@ __author__ = 'Michael Meisinger'
 
 
 from pyon.core import bootstrap
+from pyon.core.bootstrap import CFG
 from pyon.datastore.datastore import DataStore
 from pyon.util.containers import recursive_encode
 
@@ -23,6 +24,7 @@ class ObjectStore(object):
         self.obj_store = datastore_manager.get_datastore("objects", DataStore.DS_PROFILE.OBJECTS)
         self.name = 'container_object_store'
         self.id = 'container_object_store'
+        self.bulk_insert_threshold = CFG.get_safe("container.datastore.bulk_insert_threshold", 500)
 
     def start(self):
         pass
@@ -44,10 +46,12 @@ class ObjectStore(object):
         return self.obj_store.create_doc(doc, object_id=object_id)
 
     def create_mult(self, objects, object_ids=None):
-        return self.obj_store.create_mult(objects, object_ids=object_ids)
+        return self.obj_store.create_mult(objects, object_ids=object_ids,
+                                          bulk_insert=len(objects) >= self.bulk_insert_threshold)
 
     def create_doc_mult(self, docs, object_ids=None):
-        return self.obj_store.create_doc_mult(docs, object_ids=object_ids)
+        return self.obj_store.create_doc_mult(docs, object_ids=object_ids,
+                                              bulk_insert=len(docs) >= self.bulk_insert_threshold)
 
 
     def update(self, obj):
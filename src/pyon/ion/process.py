@@ -2,11 +2,13 @@
 
 __author__ = 'Adam R. Smith, Michael Meisinger, Dave Foster <dfoster@asascience.com>'
 
+import json
 import threading
 import traceback
 import gevent
 from gevent import greenlet, Timeout
 from gevent.event import Event, AsyncResult
+from gevent.lock import Semaphore
 from gevent.queue import Queue
 
 from pyon.core import MSG_HEADER_ACTOR
@@ -17,7 +19,7 @@ from pyon.core.thread import PyonThreadManager, PyonThread, ThreadManager, PyonT
 from pyon.util.log import log
 from pyon.ion.service import BaseService
 from pyon.util.async import spawn
-from pyon.util.containers import get_ion_ts, get_ion_ts_millis
+from pyon.util.containers import get_ion_ts, get_ion_ts_millis, get_safe
 
 STAT_INTERVAL_LENGTH = 60000  # Interval time for process saturation stats collection
 
@@ -58,6 +60,11 @@ class IonProcessThread(PyonThread):
         @param  cleanup_method  An optional callable to run when the process is stopping. Runs after all other
                                 notify_stop calls have run. Should take one param, this instance.
         @param  heartbeat_secs  Number of seconds to wait in between heartbeats.
+
+        The number of control flow greenlets processing calls concurrently is set by the process config
+        (process.concurrency) or the container default (container.process.concurrency). With a concurrency
+        greater than 1, operations marked exclusive in the service interface or listed in the process config
+        (process.exclusive_ops) run only when no other call is processed.
         """
         self._startup_listeners = listeners or []
         self.listeners          = []
@@ -68,11 +75,18 @@ class IonProcessThread(PyonThread):
 
         self.thread_manager     = ThreadManager(failure_notify_callback=self._child_failed) # bubbles up to main thread manager
         self._dead_children     = []        # save any dead children for forensics
-        self._ctrl_thread       = None
+        self._ctrl_thread       = None      # first control flow greenlet
+        self._ctrl_threads      = []        # all control flow greenlets
         self._ctrl_queue        = Queue()
         self._ready_control     = Event()
         self._errors            = []
-        self._ctrl_current      = None      # set to the AR generated by _routing_call when in the context of a call
+        self._ctrl_currents     = []        # per control flow greenlet, the AR generated by _routing_call when in the context of a call
+
+        # concurrent call processing
+        self._concurrency       = 1
+        self._exclusive_ops     = set()
+        self._gate              = None      # Semaphore with one permit per control flow greenlet
+        self._exclusive_lock    = Semaphore()   # held while an exclusive call collects all permits
 
         # processing vs idle time (ms)
         self._start_time        = None
@@ -80,6 +94,8 @@ class IonProcessThread(PyonThread):
         self._proc_time_prior   = 0   # busy time at the beginning of the prior interval
         self._proc_time_prior2  = 0   # busy time at the beginning of 2 interval's ago
         self._proc_interval_num = 0   # interval num of last record
+        self._busy_workers      = 0   # number of control flow greenlets currently processing a call
+        self._busy_start        = 0   # time the process became busy
 
         # for heartbeats, used to detect stuck processes
         self._heartbeat_secs    = heartbeat_secs    # amount of time to wait between heartbeats
@@ -87,6 +103,7 @@ class IonProcessThread(PyonThread):
         self._heartbeat_time    = None              # timestamp of heart beat last matching the current op
         self._heartbeat_op      = None              # last operation (by AR)
         self._heartbeat_count   = 0                 # number of times this operation has been seen consecutively
+        self._heartbeat_states  = []                # per control flow greenlet [op, count, time, stack]
 
         self._log_call_exception = CFG.get_safe("container.process.log_exceptions", False)
         PyonThread.__init__(self, target=target, **kwargs)
@@ -108,38 +125,66 @@ class IonProcessThread(PyonThread):
             if not (l in self._listener_map and not self._listener_map[l].proc.dead and l.get_ready_event().is_set()):
                 listeners_ok = False
 
-        ctrl_thread_ok = self._ctrl_thread.running
+        ctrl_thread_ok = all(ct.running for ct in self._ctrl_threads) if self._ctrl_threads else self._ctrl_thread.running
 
-        # are we currently processing something?
+        # are we currently processing something? check each control flow greenlet and report
+        # the one that has been in its current operation the longest
         heartbeat_ok = True
-        if self._ctrl_current is not None:
-            st = traceback.extract_stack(self._ctrl_thread.proc.gr_frame)
+        longest_state = None
+        for ctrl_thread, current, hb_state in zip(self._ctrl_threads, self._ctrl_currents, self._heartbeat_states):
+            if not self._check_heartbeat(ctrl_thread, current, hb_state):
+                heartbeat_ok = False
+            if longest_state is None or hb_state[1] > longest_state[1]:
+                longest_state = hb_state
 
-            if self._ctrl_current == self._heartbeat_op:
+        if longest_state is not None:
+            self._heartbeat_op, self._heartbeat_count, self._heartbeat_time, self._heartbeat_stack = longest_state
 
-                if st == self._heartbeat_stack:
-                    self._heartbeat_count += 1  # we've seen this before! increment count
+        return (listeners_ok, ctrl_thread_ok, heartbeat_ok)
 
-                    # we've been in this for the last X ticks, or it's been X seconds, fail this part of the heartbeat
-                    if self._heartbeat_count > CFG.get_safe('container.timeout.heartbeat_proc_count_threshold', 30) or \
-                       get_ion_ts_millis() - int(self._heartbeat_time) >= CFG.get_safe('container.timeout.heartbeat_proc_time_threshold', 30) * 1000:
-                        heartbeat_ok = False
-                else:
-                    # it's made some progress
-                    self._heartbeat_count = 1
-                    self._heartbeat_stack = st
-                    self._heartbeat_time  = get_ion_ts()
-            else:
-                self._heartbeat_op      = self._ctrl_current
-                self._heartbeat_count   = 1
-                self._heartbeat_time    = get_ion_ts()
-                self._heartbeat_stack   = st
+    def _check_heartbeat(self, ctrl_thread, current, hb_state):
+        """
+        Updates the heartbeat state [op, count, time, stack] of one control flow greenlet.
+        Returns False if the greenlet has been stuck in its current operation for too long.
+        """
+        if current is None:
+            hb_state[0] = None
+            hb_state[1] = 0
+            return True
+
+        st = traceback.extract_stack(ctrl_thread.proc.gr_frame)
 
+        if current == hb_state[0]:
+            if st == hb_state[3]:
+                hb_state[1] += 1  # we've seen this before! increment count
+
+                # we've been in this for the last X ticks, or it's been X seconds, fail this part of the heartbeat
+                if hb_state[1] > CFG.get_safe('container.timeout.heartbeat_proc_count_threshold', 30) or \
+                   get_ion_ts_millis() - int(hb_state[2]) >= CFG.get_safe('container.timeout.heartbeat_proc_time_threshold', 30) * 1000:
+                    return False
+            else:
+                # it's made some progress
+                hb_state[1] = 1
+                hb_state[3] = st
+                hb_state[2] = get_ion_ts()
         else:
-            self._heartbeat_op      = None
-            self._heartbeat_count   = 0
+            hb_state[:] = [current, 1, get_ion_ts(), st]
 
-        return (listeners_ok, ctrl_thread_ok, heartbeat_ok)
+        return True
+
+    @property
+    def _ctrl_current(self):
+        """
+        The AR of a call currently processed by any control flow greenlet, or None if idle.
+        """
+        for ar in self._ctrl_currents:
+            if ar is not None:
+                return ar
+        return None
+
+    @property
+    def concurrency(self):
+        return self._concurrency
 
     @property
     def time_stats(self):
@@ -236,9 +281,15 @@ class IonProcessThread(PyonThread):
         self._start_time = get_ion_ts_millis()
         self._proc_interval_num = self._start_time / STAT_INTERVAL_LENGTH
 
-        # spawn control flow loop
-        self._ctrl_thread = self.thread_manager.spawn(self._control_flow)
-        self._ctrl_thread.proc._glname = "ION Proc CL %s" % self.name
+        self._init_concurrency()
+
+        # spawn control flow loops
+        for worker_idx in xrange(self._concurrency):
+            ctrl_thread = self.thread_manager.spawn(self._control_flow, worker_idx=worker_idx)
+            ctrl_thread.proc._glname = "ION Proc CL %s" % self.name if worker_idx == 0 else \
+                "ION Proc CL %s-%s" % (self.name, worker_idx)
+            self._ctrl_threads.append(ctrl_thread)
+        self._ctrl_thread = self._ctrl_threads[0]
 
         # wait on control flow loop, heartbeating as appropriate
         while not self._ctrl_thread.ev_exit.wait(timeout=self._heartbeat_secs):
@@ -257,7 +308,72 @@ class IonProcessThread(PyonThread):
         # this is almost a no-op as we don't fall out of the above loop without
         # exiting the ctrl_thread, but having this line here makes testing much
         # easier.
-        self._ctrl_thread.join()
+        for ctrl_thread in self._ctrl_threads:
+            ctrl_thread.join()
+
+    def _init_concurrency(self):
+        """
+        Determines the number of control flow greenlets and the exclusive operations from
+        the process config, the container config and the service interface definition.
+        """
+        proc_cfg = getattr(self.service, "CFG", None)
+        if not isinstance(proc_cfg, dict):
+            proc_cfg = {}
+
+        concurrency = get_safe(proc_cfg, "process.concurrency") or CFG.get_safe("container.process.concurrency", 1)
+        try:
+            self._concurrency = max(int(concurrency), 1)
+        except (TypeError, ValueError):
+            log.warn("Invalid process concurrency %r for process %s, using 1", concurrency, self.name)
+            self._concurrency = 1
+
+        self._ctrl_currents = [None] * self._concurrency
+        self._heartbeat_states = [[None, 0, None, None] for _ in xrange(self._concurrency)]
+        if self._concurrency == 1:
+            return
+
+        self._gate = Semaphore(self._concurrency)
+        self._exclusive_ops = set(get_safe(proc_cfg, "process.exclusive_ops") or [])
+        schema_json = getattr(type(self.service), "SCHEMA_JSON", None)
+        if isinstance(schema_json, basestring):
+            try:
+                operations = json.loads(schema_json).get("operations", None) or {}
+                self._exclusive_ops.update(str(op_name) for op_name, op_def in operations.iteritems()
+                                           if op_def and op_def.get("exclusive", False))
+            except Exception:
+                log.debug("Cannot parse service schema for process %s", self.name)
+        log.debug("Process %s processing calls with concurrency %s, exclusive ops: %s",
+                  self.name, self._concurrency, sorted(self._exclusive_ops))
+
+    def _acquire_gate(self, exclusive):
+        """
+        Acquires permits to process a call: one for shared calls and all for exclusive calls.
+        Exclusive calls take precedence over shared calls waiting for a permit.
+        Returns the number of permits acquired.
+        """
+        if self._gate is None:
+            return 0
+
+        if not exclusive:
+            self._exclusive_lock.wait()
+            self._gate.acquire()
+            return 1
+
+        acquired = 0
+        with self._exclusive_lock:
+            try:
+                while acquired < self._concurrency:
+                    self._gate.acquire()
+                    acquired += 1
+            except BaseException:
+                for _ in xrange(acquired):
+                    self._gate.release()
+                raise
+        return acquired
+
+    def _release_gate(self, permits):
+        for _ in xrange(permits):
+            self._gate.release()
 
     def _routing_call(self, call, context, *callargs, **callkwargs):
         """
@@ -303,11 +419,25 @@ class IonProcessThread(PyonThread):
 
         return False
 
-    def _interrupt_control_thread(self):
+    def _interrupt_control_thread(self, ar=None):
         """
         Signal the control flow thread that it needs to abort processing, likely due to a timeout.
+
+        @param  ar  The AR of the call to abort. If given, interrupts the control flow greenlet processing
+                    this call; if no greenlet processes it yet, the call is cancelled. If None, interrupts
+                    the first control flow greenlet.
         """
-        self._ctrl_thread.proc.kill(exception=OperationInterruptedException, block=False)
+        if ar is None:
+            self._ctrl_thread.proc.kill(exception=OperationInterruptedException, block=False)
+            return
+
+        for ctrl_thread, current in zip(self._ctrl_threads, self._ctrl_currents):
+            if current is ar:
+                ctrl_thread.proc.kill(exception=OperationInterruptedException, block=False)
+                return
+
+        # Taken from the queue but not started, e.g. waiting for an exclusive call to finish
+        ar.set(False)
 
     def cancel_or_abort_call(self, ar):
         """
@@ -316,13 +446,13 @@ class IonProcessThread(PyonThread):
         The pending call is keyed by the AsyncResult returned by _routing_call.
         """
         if not self._cancel_pending_call(ar) and not ar.ready():
-            self._interrupt_control_thread()
+            self._interrupt_control_thread(ar)
 
-    def _control_flow(self):
+    def _control_flow(self, worker_idx=0):
         """
         Main process thread of execution method.
 
-        This method is run inside a greenlet and exists for each ION process. Listeners
+        This method is run inside one or more greenlets (see concurrency) for each ION process. Listeners
         attached to the process, either RPC Servers or Subscribers, synchronize their calls
         by placing future calls into the queue by calling _routing_call.  This is all done
         automatically for you by the Container's Process Manager.
@@ -331,12 +461,15 @@ class IonProcessThread(PyonThread):
         then calls from within this greenlet.  Any exception raised is caught and re-raised
         in the greenlet that originally scheduled the call.  If successful, the AsyncResult
         created at scheduling time is set with the result of the call.
+
+        @param  worker_idx  Index of this control flow greenlet
         """
         if self.name:
             svc_name = "unnamed-service"
             if self.service is not None and hasattr(self.service, 'name'):
                 svc_name = self.service.name
-            threading.current_thread().name = "%s-%s-ctrl" % (svc_name, self.name)
+            threading.current_thread().name = "%s-%s-ctrl" % (svc_name, self.name) if worker_idx == 0 else \
+                "%s-%s-ctrl-%s" % (svc_name, self.name, worker_idx)
 
         self._ready_control.set()
 
@@ -345,6 +478,8 @@ class IonProcessThread(PyonThread):
             #log.debug("control_flow making call: %s %s %s (has context: %s)", call, callargs, callkwargs, context is not None)
 
             res = None
+            permits = 0
+            busy = False
             start_proc_time = get_ion_ts_millis()
             self._record_proc_time(start_proc_time)
 
@@ -365,13 +500,25 @@ class IonProcessThread(PyonThread):
                 continue
 
             try:
+                if self._gate is not None:
+                    exclusive = bool(self._exclusive_ops) and context is not None and \
+                        context.get('op', None) in self._exclusive_ops
+                    permits = self._acquire_gate(exclusive)
+
+                    # may have been cancelled while waiting
+                    if ar.ready():
+                        log.info("control_flow: attempting to process message that has been cancelled, ignore")
+                        continue
+                self._begin_proc_stats(start_proc_time)
+                busy = True
+
                 # ******                                                      ******
                 # ****** THIS IS WHERE THE RPC OPERATION/SERVICE CALL IS MADE ******
                 # ******                                                      ******
 
                 with self.service.push_context(context):
                     with self.service.container.context.push_context(context):
-                        self._ctrl_current = ar
+                        self._ctrl_currents[worker_idx] = ar
                         res = call(*callargs, **callkwargs)
 
                 # ******                                                      ******
@@ -409,9 +556,11 @@ class IonProcessThread(PyonThread):
                     # have to raise something friendlier on the client side
                     calling_gl.kill(exception=ContainerError(str(exc)), block=False)
             finally:
-                self._compute_proc_stats(start_proc_time)
-
-                self._ctrl_current = None
+                if busy:
+                    self._compute_proc_stats(start_proc_time)
+                self._ctrl_currents[worker_idx] = None
+                if permits:
+                    self._release_gate(permits)
 
             ar.set(res)
 
@@ -432,11 +581,19 @@ class IonProcessThread(PyonThread):
             self._proc_time_prior2 = self._proc_time
             self._proc_time_prior = self._proc_time
 
+    def _begin_proc_stats(self, start_proc_time):
+        """Marks a control flow greenlet busy. The process is busy while any of them is"""
+        if self._busy_workers == 0:
+            self._busy_start = start_proc_time
+        self._busy_workers += 1
+
     def _compute_proc_stats(self, start_proc_time):
         cur_time = get_ion_ts_millis()
         self._record_proc_time(cur_time)
-        proc_time = cur_time - start_proc_time
-        self._proc_time += proc_time
+        self._busy_workers -= 1
+        if self._busy_workers == 0:
+            proc_time = cur_time - self._busy_start
+            self._proc_time += proc_time
 
     def start_listeners(self):
         """
@@ -479,8 +636,8 @@ class IonProcessThread(PyonThread):
         """
         Called when the process is about to be shut down.
 
-        Instructs all listeners to close, puts a StopIteration into the synchronized queue,
-        and waits for the listeners to close and for the control queue to exit.
+        Instructs all listeners to close, puts a StopIteration for each control flow greenlet into the
+        synchronized queue, and waits for the listeners to close and for the control queue to exit.
         """
         for listener in self.listeners:
             try:
@@ -489,7 +646,8 @@ class IonProcessThread(PyonThread):
                 tb = traceback.format_exc()
                 log.warn("Could not close listener, attempting to ignore: %s\nTraceback:\n%s", ex, tb)
 
-        self._ctrl_queue.put(StopIteration)
+        for _ in xrange(max(len(self._ctrl_threads), 1)):
+            self._ctrl_queue.put(StopIteration)
 
         # wait_children will join them and then get() them, which may raise an exception if any of them
         # died with an exception.
@@ -385,6 +385,8 @@ class ExtendedResourceContainer(object):
 
         # Keeps a context used during evaluation of the resource container fields
         self.ctx = None
+        # Resource objects read in advance for a list of extended resource containers
+        self._res_objs = None
 
     def create_extended_resource_container_list(self, extended_resource_type, resource_id_list,
                                                 computed_resource_type=None,
@@ -395,11 +397,18 @@ class ExtendedResourceContainer(object):
         if not isinstance(resource_id_list, types.ListType):
             raise Inconsistent("The parameter resource_id_list is not a list of resource_ids")
 
+        # Read all resource objects at once instead of one by one
+        res_list = self._rr.read_mult(resource_id_list) if resource_id_list else []
+        self._res_objs = dict(zip(resource_id_list, res_list))
+
         ret = list()
-        for res_id in resource_id_list:
-            ext_res = self.create_extended_resource_container(extended_resource_type, res_id, computed_resource_type,
-                ext_associations, ext_exclude )
-            ret.append(ext_res)
+        try:
+            for res_id in resource_id_list:
+                ext_res = self.create_extended_resource_container(extended_resource_type, res_id, computed_resource_type,
+                    ext_associations, ext_exclude )
+                ret.append(ext_res)
+        finally:
+            self._res_objs = None
 
         return ret
 
@@ -423,7 +432,10 @@ class ExtendedResourceContainer(object):
         if computed_resource_type and computed_resource_type not in getextends(OT.BaseComputedAttributes):
             raise BadRequest('The requested resource %s is not extended from %s' % (computed_resource_type, OT.BaseComputedAttributes))
 
-        resource_object = self._rr.read(resource_id)
+        if self._res_objs and resource_id in self._res_objs:
+            resource_object = self._res_objs[resource_id]
+        else:
+            resource_object = self._rr.read(resource_id)
 
         if not resource_object:
             raise NotFound("The Resource %s does not exist" % resource_id)
@@ -442,8 +454,11 @@ class ExtendedResourceContainer(object):
         res_container._id = resource_object._id
         res_container.resource = resource_object
 
-        # Initialize context object field and load resource associations
-        self._prepare_context(resource_object._id)
+        # Initialize context object field and load resource associations (incl. 2nd level of compound associations)
+        compound_predicates = self._get_compound_predicates(res_container, ext_exclude)
+        if computed_resource_type:
+            compound_predicates |= self._get_compound_predicates(IonObject(computed_resource_type), ext_exclude)
+        self._prepare_context(resource_object._id, compound_predicates)
 
         # Fill lcstate related resource container fields
         self.set_container_lcstate_info(res_container)
@@ -557,8 +572,9 @@ class ExtendedResourceContainer(object):
                     predicates = self.get_compound_association_predicates(decorator)
                     assoc_list = self._find_associated_resources(resource, predicates[0], target_type)
                     field_needs.append((field, "A", (assoc_list, predicates)))
-                    for target_id, assoc in assoc_list:
-                        assoc_needs.add((target_id, predicates[1]))
+                    if tuple(predicates[:2]) not in self.ctx['loaded_predicates']:
+                        for target_id, assoc in assoc_list:
+                            assoc_needs.add((target_id, predicates[1]))
 
                 # Fill field based on association with list of resource objects
                 elif self.is_association_predicate(decorator):
@@ -593,21 +609,21 @@ class ExtendedResourceContainer(object):
         if not field_needs:
             return
 
-        # Step 2: Read second level of compound associations as needed
+        # Step 2: Read second level of compound associations as needed (unless already loaded into context)
         # @TODO Can only do 2 level compounds for now. Make recursive someday
         if assoc_needs:
             assocs = self._rr.find_associations(anyside=list(assoc_needs), id_only=False)
             self._add_associations(assocs)
 
-            # Determine resource ids to read for compound associations
-            for field, need_type, needs in field_needs:
-                if need_type == 'A':
-                    assoc_list, predicates = needs
-                    for target_id, assoc in assoc_list:
-                        res_type = assoc.ot if target_id == assoc.o else assoc.st
-                        assoc_list1 = self._find_associated_resources(target_id, predicates[1], None, res_type)
-                        for target_id1, assoc1 in assoc_list1:
-                            resource_needs.add(target_id1)
+        # Determine resource ids to read for compound associations
+        for field, need_type, needs in field_needs:
+            if need_type == 'A':
+                assoc_list, predicates = needs
+                for target_id, assoc in assoc_list:
+                    res_type = assoc.ot if target_id == assoc.o else assoc.st
+                    assoc_list1 = self._find_associated_resources(target_id, predicates[1], None, res_type)
+                    for target_id1, assoc1 in assoc_list1:
+                        resource_needs.add(target_id1)
 
         # Step 3: Read resource objects based on needs
         res_list = self._rr.read_mult(list(resource_needs))
@@ -669,15 +685,51 @@ class ExtendedResourceContainer(object):
                 else:
                     res_container.ext_associations[ext_field] = list()
 
-    def _prepare_context(self, resource_id):
+    def _prepare_context(self, resource_id, compound_predicates=None):
         """
         Initializes the context object and loads associations for resource id.
+        If the resource registry supports traversal, also loads the second level of the given compound
+        associations in one query, following each second predicate only from the resources associated
+        by a first predicate it is paired with.
+        @param compound_predicates  set of (first predicate, second predicate) tuples
         """
-        self.ctx = dict(by_subject={}, by_object={})
+        self.ctx = dict(by_subject={}, by_object={}, loaded_predicates=set())
         assocs = self._rr.find_associations(anyside=resource_id, id_only=False)
         self._add_associations(assocs)
         log.debug("Found %s associations for resource %s", len(assocs), resource_id)
 
+        if compound_predicates and hasattr(self._rr, "traverse_associations"):
+            second_predicates = {}
+            for first_pred, second_pred in compound_predicates:
+                second_predicates.setdefault(first_pred, set()).add(second_pred)
+            target_ids, predicates = set(), set()
+            for assoc in assocs:
+                if assoc.p in second_predicates:
+                    target_ids.add(assoc.o if assoc.s == resource_id else assoc.s)
+                    predicates.update(second_predicates[assoc.p])
+            if target_ids:
+                assoc_ids = {assoc._id for assoc in assocs}
+                assocs1 = self._rr.traverse_associations(list(target_ids), [(sorted(predicates), "")], id_only=False)
+                self._add_associations([assoc for assoc in assocs1 if assoc._id not in assoc_ids])
+                log.debug("Found %s compound associations for resource %s", len(assocs1), resource_id)
+            self.ctx['loaded_predicates'].update(compound_predicates)
+
+    def _get_compound_predicates(self, obj, ext_exclude=None):
+        """
+        Returns the set of (first predicate, second predicate) tuples of compound associations used by
+        fields of given object.
+        """
+        compound_predicates = set()
+        for field, field_schema in obj._schema.iteritems():
+            if ext_exclude is not None and field in ext_exclude:
+                continue
+            for decorator in field_schema['decorators']:
+                if self.is_compound_association(decorator):
+                    predicates = self.get_compound_association_predicates(decorator)
+                    if len(predicates) > 1:
+                        compound_predicates.add(tuple(predicates[:2]))
+        return compound_predicates
+
     def _add_associations(self, assocs):
         """
         Adds a list of Association objects to the context memory structure, indexed by
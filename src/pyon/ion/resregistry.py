@@ -4,6 +4,8 @@
 
 __author__ = 'Michael Meisinger'
 
+from contextlib import contextmanager
+
 from pyon.core import bootstrap
 from pyon.core.bootstrap import IonObject, CFG
 from pyon.core.governance import get_system_actor
@@ -12,11 +14,12 @@ from pyon.core.object import IonObjectBase
 from pyon.core.registry import getextends
 from pyon.datastore.datastore import DataStore
 from pyon.datastore.datastore_query import DatastoreQueryBuilder, DQ
-from pyon.ion.event import EventPublisher
+from pyon.ion.event import EventPublisher, EventSubscriber
 from pyon.ion.identifier import create_unique_resource_id, create_unique_association_id
 from pyon.ion.resource import LCS, LCE, PRED, RT, AS, OT, get_restype_lcsm, is_resource, ExtendedResourceContainer, \
     lcstate, lcsplit, Predicates, create_access_args
 from pyon.ion.process import get_ion_actor_id
+from pyon.ion.resregistry_cache import ResourceObjectCache
 from pyon.util.containers import get_ion_ts
 from pyon.util.log import log
 
@@ -45,18 +48,67 @@ class ResourceRegistry(object):
 
         self.superuser_actors = None
 
+        # Optional read-through cache of resource objects. Only active once invalidation events are received
+        self.res_cache = None
+        self.res_cache_sub = None
+        self.res_cache_cfg = CFG.get_safe("container.resource_registry.cache", None) or {}
+
     def start(self):
         pass
 
     def stop(self):
+        self.stop_cache_listener()
         self.close()
 
     def close(self):
         """
-        Pass-through method to close the underlying datastore.
+        Pass-through method to close the underlying datastore and the event publisher.
         """
+        self.event_pub.close()
         self.rr_store.close()
 
+    # -------------------------------------------------------------------------
+    # Resource object cache
+
+    def start_cache_listener(self):
+        """
+        Enables the resource object cache (if configured) and subscribes to resource events that
+        invalidate cache entries. Requires the container exchange to be available.
+        """
+        if not self.res_cache_cfg.get("enabled", False) or self.res_cache_sub:
+            return
+        self.res_cache = ResourceObjectCache(max_entries=self.res_cache_cfg.get("max_entries", 5000),
+                                             max_bytes=self.res_cache_cfg.get("max_bytes", 50000000),
+                                             ttl=self.res_cache_cfg.get("ttl", 300.0))
+        self.res_cache_sub = EventSubscriber(event_type="ResourceEvent", callback=self._on_resource_event)
+        self.res_cache_sub.start()
+        log.debug("Resource registry object cache enabled: %s", self.res_cache_cfg)
+
+    def stop_cache_listener(self):
+        if self.res_cache_sub:
+            try:
+                self.res_cache_sub.stop()
+            except Exception:
+                log.warn("Could not stop resource cache event subscriber", exc_info=True)
+            self.res_cache_sub = None
+        self.res_cache = None
+
+    def _on_resource_event(self, event, headers):
+        if event.type_ in ("ResourceModifiedEvent", "ResourceLifecycleEvent"):
+            self._invalidate_cache(event.origin)
+
+    def _invalidate_cache(self, object_id):
+        if self.res_cache is not None:
+            self.res_cache.invalidate(object_id)
+
+    def get_cache_stats(self):
+        """
+        Returns a dict with resource object cache usage and hit rate stats, or None if the cache is disabled.
+        """
+        if self.res_cache is None:
+            return None
+        return self.res_cache.get_stats()
+
     # -------------------------------------------------------------------------
     # Resource object manipulation
 
@@ -142,7 +194,15 @@ class ResourceRegistry(object):
         if not object_id:
             raise BadRequest("The object_id parameter is an empty string")
 
-        return self.rr_store.read(object_id, rev_id)
+        if self.res_cache is None:
+            return self.rr_store.read(object_id, rev_id)
+
+        res_obj = self.res_cache.get(object_id, rev_id)
+        if res_obj is None:
+            cache_gen = self.res_cache.generation
+            res_obj = self.rr_store.read(object_id, rev_id)
+            self.res_cache.put(res_obj, since_generation=cache_gen)
+        return res_obj
 
     def read_mult(self, object_ids=None, strict=True):
         """
@@ -153,7 +213,19 @@ class ResourceRegistry(object):
         """
         if object_ids is None:
             raise BadRequest("The object_ids parameter is empty")
-        return self.rr_store.read_mult(object_ids, strict=strict)
+        if self.res_cache is None:
+            return self.rr_store.read_mult(object_ids, strict=strict)
+
+        res_list = [self.res_cache.get(obj_id) for obj_id in object_ids]
+        miss_ids = [obj_id for obj_id, res_obj in zip(object_ids, res_list) if res_obj is None]
+        if miss_ids:
+            cache_gen = self.res_cache.generation
+            miss_objs = iter(self.rr_store.read_mult(miss_ids, strict=strict))
+            res_list = [res_obj if res_obj is not None else next(miss_objs) for res_obj in res_list]
+            for res_obj in res_list:
+                if res_obj is not None:
+                    self.res_cache.put(res_obj, since_generation=cache_gen)
+        return res_list
 
     def update(self, object):
         if object is None:
@@ -171,12 +243,18 @@ class ResourceRegistry(object):
             object.lcstate = res_obj.lcstate
             object.availability = res_obj.availability
 
+        try:
+            res = self.rr_store.update(object)
+        finally:
+            self._invalidate_cache(object._id)
+
+        # Publish after the write, so that other containers' caches cannot reload the old revision
         self.event_pub.publish_event(event_type="ResourceModifiedEvent",
                                      origin=object._id, origin_type=object.type_,
                                      sub_type="UPDATE",
                                      mod_type=ResourceModificationType.UPDATE)
 
-        return self.rr_store.update(object)
+        return res
 
     def delete(self, object_id='', del_associations=False):
         res_obj = self.read(object_id)
@@ -195,6 +273,7 @@ class ResourceRegistry(object):
             log.warn("Deleting object %s that still has associations" % object_id)
 
         res = self.rr_store.delete(object_id)
+        self._invalidate_cache(object_id)
 
         if self.container.has_capability(self.container.CCAP.EVENT_PUBLISHER):
             self.event_pub.publish_event(event_type="ResourceModifiedEvent",
@@ -204,6 +283,25 @@ class ResourceRegistry(object):
 
         return res
 
+    @contextmanager
+    def batch(self):
+        """
+        Context manager providing a unit of work that queues resource creates, updates, associations
+        and deletes and writes them in a single transaction when the block exits without error.
+        Usage:
+            with rr.batch() as batch:
+                res_id = batch.create(res_obj, actor_id=actor_id)
+                batch.create_association(org_id, PRED.hasResource, res_id)
+            res_ids = batch.created_ids
+        """
+        rr_batch = ResourceRegistryBatch(self)
+        try:
+            yield rr_batch
+        except Exception:
+            rr_batch.discard()
+            raise
+        rr_batch.flush()
+
     def _delete_owners(self, resource_id):
         # Delete all owner users.
         owners, assocs = self.rr_store.find_objects(resource_id, PRED.hasOwner, RT.ActorIdentity, id_only=True)
@@ -228,6 +326,7 @@ class ResourceRegistry(object):
         res_obj.ts_updated = get_ion_ts()
 
         updres = self.rr_store.update(res_obj)
+        self._invalidate_cache(resource_id)
         log.debug("retire(res_id=%s). Change %s_%s to %s_%s", resource_id,
                   old_state, res_obj.availability, res_obj.lcstate, res_obj.availability)
 
@@ -278,6 +377,7 @@ class ResourceRegistry(object):
 
         res_obj.ts_updated = get_ion_ts()
         self.rr_store.update(res_obj)
+        self._invalidate_cache(resource_id)
         log.debug("execute_lifecycle_transition(res_id=%s, event=%s). Change %s_%s to %s_%s", resource_id, transition_event,
                   old_lcstate, old_availability, res_obj.lcstate, res_obj.availability)
 
@@ -335,6 +435,7 @@ class ResourceRegistry(object):
         res_obj.ts_updated = get_ion_ts()
 
         updres = self.rr_store.update(res_obj)
+        self._invalidate_cache(resource_id)
         log.debug("set_lifecycle_state(res_id=%s, target=%s). Change %s_%s to %s_%s", resource_id, target_lcstate,
                   old_lcstate, old_availability, res_obj.lcstate, res_obj.availability)
 
@@ -535,40 +636,47 @@ class ResourceRegistry(object):
                 if not new_o:
                     raise NotFound("Object %s not found" % o)
             else:
-                if "_id" not in object:
+                if "_id" not in o:
                     raise BadRequest("Object id not available")
 
-            # Check that subject and object type are permitted by association definition
-            if p not in Predicates:
-                raise BadRequest("Predicate unknown %s" % p)
-            pt = Predicates.get(p)
-            if not new_s.type_ in pt['domain']:
-                found_st = False
-                for domt in pt['domain']:
-                    if new_s.type_ in getextends(domt):
-                        found_st = True
-                        break
-                if not found_st:
-                    raise BadRequest("Illegal subject type %s for predicate %s" % (new_s.type_, p))
-            if not new_o.type_ in pt['range']:
-                found_ot = False
-                for rant in pt['range']:
-                    if new_o.type_ in getextends(rant):
-                        found_ot = True
-                        break
-                if not found_ot:
-                    raise BadRequest("Illegal object type %s for predicate %s" % (new_o.type_, p))
-
-            assoc = IonObject("Association",
-                              s=new_s._id, st=new_s.type_,
-                              p=p,
-                              o=new_o._id, ot=new_o.type_,
-                              ts=create_ts)
+            assoc = self._create_association_obj(new_s, p, new_o, create_ts)
             new_assoc_list.append(assoc)
 
         new_assoc_ids = [create_unique_association_id() for i in xrange(len(new_assoc_list))]
         return self.rr_store.create_mult(new_assoc_list, new_assoc_ids)
 
+    def _create_association_obj(self, subject, predicate, object, create_ts):
+        """
+        Returns a new Association object between given subject and object resource objects after checking
+        that subject and object types are permitted by the association definition.
+        """
+        if predicate not in Predicates:
+            raise BadRequest("Predicate unknown %s" % predicate)
+        pt = Predicates.get(predicate)
+        if not subject.type_ in pt['domain']:
+            found_st = False
+            for domt in pt['domain']:
+                if subject.type_ in getextends(domt):
+                    found_st = True
+                    break
+            if not found_st:
+                raise BadRequest("Illegal subject type %s for predicate %s" % (subject.type_, predicate))
+        if not object.type_ in pt['range']:
+            found_ot = False
+            for rant in pt['range']:
+                if object.type_ in getextends(rant):
+                    found_ot = True
+                    break
+            if not found_ot:
+                raise BadRequest("Illegal object type %s for predicate %s" % (object.type_, predicate))
+
+        assoc = IonObject("Association",
+                          s=subject._id, st=subject.type_,
+                          p=predicate,
+                          o=object._id, ot=object.type_,
+                          ts=create_ts)
+        return assoc
+
     def delete_association(self, association=''):
         """
         Delete an association between two IonObjects
@@ -680,6 +788,16 @@ class ResourceRegistry(object):
         return self.rr_store.find_associations(subject, predicate, object, assoc_type, id_only=id_only, anyside=anyside,
                                                query=query, limit=limit, skip=skip, descending=descending, access_args=access_args)
 
+    def traverse_associations(self, start, hops, id_only=False):
+        """
+        Returns associations reachable from given start resource id(s) along a path of hops in one query.
+        @param start  a resource id or list of resource ids
+        @param hops  list of tuples (predicate, direction), where predicate can be a predicate, list of
+                predicates or None for any, and direction is ">" (follow to object), "<" (follow to subject) or ""
+        @retval list of Association objects (or ids) ordered by hop distance from start
+        """
+        return self.rr_store.traverse_associations(start, hops, id_only=id_only)
+
     def find_objects_mult(self, subjects=[], id_only=False, predicate="", access_args=None):
         return self.rr_store.find_objects_mult(subjects=subjects, id_only=id_only, predicate=predicate, access_args=access_args)
 
@@ -737,6 +855,21 @@ class ResourceRegistry(object):
             limit=limit, skip=skip, descending=descending,
             id_only=id_only, query=query, access_args=access_args)
 
+    def find_resources_ext_iter(self, query, limit=None, skip=None, id_only=False, access_args=None, chunk_size=None):
+        """Same as find_resources_ext with a query (ResourceQuery), but returns an iterator over resource
+        objects or resource ids that are fetched from the datastore in chunks. Use for large result sets.
+        """
+        if not query:
+            raise BadRequest("Must provide query")
+        qargs = query["query_args"]
+        if id_only is not None:
+            qargs["id_only"] = id_only
+        if limit is not None and limit != 0:
+            qargs["limit"] = limit
+        if skip is not None and skip != 0:
+            qargs["skip"] = skip
+        return self.rr_store.find_by_query_iter(query, access_args=access_args, chunk_size=chunk_size)
+
 
     def get_superuser_actors(self, reset=False):
         """Returns a memoized list of system superusers, including the system actor and all actors with
@@ -811,6 +944,209 @@ class ResourceRegistry(object):
         return user_id
 
 
+class ResourceRegistryBatch(object):
+    """
+    Unit of work for the resource registry, see ResourceRegistry.batch().
+    Ids are assigned when operations are queued, so that new resources can be referenced by
+    associations within the same batch. flush() writes all queued changes in one transaction in
+    dependency order (resources before associations; association deletes before resource deletes).
+    """
+    def __init__(self, rr):
+        self.rr = rr
+        self.bulk_insert_threshold = CFG.get_safe("container.datastore.bulk_insert_threshold", 500)
+        self.created_ids = []   # List of (id, rev) of created resources and associations after flush
+        self._clear()
+
+    def _clear(self):
+        self._create_objs = []
+        self._update_objs = []
+        self._assoc_list = []       # Tuples (subject, predicate, object, assoc_id)
+        self._delete_list = []      # Tuples (resource_id, del_associations)
+        self._delete_assoc_ids = []
+
+    def create(self, object=None, actor_id=None, object_id=None):
+        """
+        Queues creation of a resource object, with an owner association if actor_id is given.
+        Returns the id of the new resource.
+        """
+        if object is None:
+            raise BadRequest("Object not present")
+        if not isinstance(object, IonObjectBase):
+            raise BadRequest("Object is not an IonObject")
+        if not is_resource(object):
+            raise BadRequest("Object is not a Resource")
+        if "_id" in object:
+            raise BadRequest("Object must not contain _id")
+        if "_rev" in object:
+            raise BadRequest("Object must not contain _rev")
+
+        lcsm = get_restype_lcsm(object.type_)
+        object.lcstate = lcsm.initial_state if lcsm else LCS.DEPLOYED
+        object.availability = lcsm.initial_availability if lcsm else AS.AVAILABLE
+        cur_time = get_ion_ts()
+        object.ts_created = cur_time
+        object.ts_updated = cur_time
+        object._id = object_id or create_unique_resource_id()
+        self._create_objs.append(object)
+
+        if actor_id and actor_id != 'anonymous':
+            self.create_association(object, PRED.hasOwner, actor_id)
+
+        return object._id
+
+    def update(self, object):
+        """
+        Queues an update of a resource object. Life cycle state and availability cannot be changed.
+        """
+        if object is None:
+            raise BadRequest("Object not present")
+        if not hasattr(object, "_id") or not hasattr(object, "_rev"):
+            raise BadRequest("Object does not have required '_id' or '_rev' attribute")
+        self._update_objs.append(object)
+
+    def create_association(self, subject=None, predicate=None, object=None):
+        """
+        Queues creation of an association. Subject and object can be resource objects or ids,
+        including resources queued for creation in this batch. Returns the id of the new association.
+        """
+        if not (subject and predicate and object):
+            raise BadRequest("Association must have all elements set")
+        if not isinstance(subject, basestring) and "_id" not in subject:
+            raise BadRequest("Subject id not available")
+        if not isinstance(object, basestring) and "_id" not in object:
+            raise BadRequest("Object id not available")
+        assoc_id = create_unique_association_id()
+        self._assoc_list.append((subject, predicate, object, assoc_id))
+        return assoc_id
+
+    def delete(self, object_id='', del_associations=False):
+        """
+        Queues deletion of a resource. Owner associations are always deleted, all other associations
+        of the resource only if del_associations is True.
+        """
+        if not object_id:
+            raise BadRequest("The object_id parameter is an empty string")
+        self._delete_list.append((object_id, del_associations))
+
+    def delete_association(self, association_id=''):
+        if not association_id:
+            raise BadRequest("Missing association_id parameter")
+        self._delete_assoc_ids.append(association_id)
+
+    def discard(self):
+        """
+        Discards all queued changes. Removes the ids assigned to queued resource objects,
+        so that they can be created again.
+        """
+        for object in self._create_objs:
+            object.__dict__.pop("_id", None)
+        self._clear()
+
+    def flush(self):
+        """
+        Writes all queued changes in one transaction and publishes resource events.
+        Returns a list of (id, rev) for all created resources and associations.
+        If the write fails, all queued changes are discarded.
+        """
+        rr = self.rr
+        try:
+            update_res, read_objs = self._write()
+        except Exception:
+            self.discard()
+            raise
+
+        for res_id, del_assoc in self._delete_list:
+            rr._invalidate_cache(res_id)
+        for object, (success, oid, rev) in zip(self._update_objs, update_res):
+            object._rev = rev
+            rr._invalidate_cache(oid)
+
+        if rr.container.has_capability(rr.container.CCAP.EVENT_PUBLISHER):
+            for object in self._create_objs:
+                rr.event_pub.publish_event(event_type="ResourceModifiedEvent",
+                                           origin=object._id, origin_type=object.type_,
+                                           sub_type="CREATE",
+                                           mod_type=ResourceModificationType.CREATE)
+            for object in self._update_objs:
+                rr.event_pub.publish_event(event_type="ResourceModifiedEvent",
+                                           origin=object._id, origin_type=object.type_,
+                                           sub_type="UPDATE",
+                                           mod_type=ResourceModificationType.UPDATE)
+            for res_id, del_assoc in self._delete_list:
+                rr.event_pub.publish_event(event_type="ResourceModifiedEvent",
+                                           origin=res_id, origin_type=read_objs[res_id].type_,
+                                           sub_type="DELETE",
+                                           mod_type=ResourceModificationType.DELETE)
+
+        self._clear()
+        return self.created_ids
+
+    def _write(self):
+        """
+        Writes all queued changes in one transaction. Returns the update results and
+        the existing resource objects read by id.
+        """
+        rr = self.rr
+        new_objs = {obj._id: obj for obj in self._create_objs}
+
+        # Read all existing resources referenced by the batch with one query
+        read_ids = {obj._id for obj in self._update_objs}
+        read_ids.update(res_id for res_id, del_assoc in self._delete_list)
+        for subject, predicate, object, assoc_id in self._assoc_list:
+            read_ids.update(res_id for res_id in (subject, object) if isinstance(res_id, basestring) and res_id not in new_objs)
+        read_ids = list(read_ids)
+        read_objs = dict(zip(read_ids, rr.read_mult(read_ids, strict=False))) if read_ids else {}
+
+        def get_res_obj(res):
+            if not isinstance(res, basestring):
+                return res
+            res_obj = new_objs.get(res, None) or read_objs.get(res, None)
+            if res_obj is None:
+                raise NotFound("Resource %s does not exist" % res)
+            return res_obj
+
+        create_ts = get_ion_ts()
+        assoc_objs = []
+        for subject, predicate, object, assoc_id in self._assoc_list:
+            assoc = rr._create_association_obj(get_res_obj(subject), predicate, get_res_obj(object), create_ts)
+            assoc._id = assoc_id
+            assoc_objs.append(assoc)
+
+        for object in self._update_objs:
+            res_obj = get_res_obj(object._id)
+            object.ts_updated = create_ts
+            if res_obj.lcstate != object.lcstate or res_obj.availability != object.availability:
+                log.warn("Cannot modify %s life cycle state or availability in update current=%s/%s given=%s/%s",
+                         type(res_obj).__name__, res_obj.lcstate, res_obj.availability, object.lcstate, object.availability)
+                object.lcstate = res_obj.lcstate
+                object.availability = res_obj.availability
+
+        delete_ids = [(assoc_id, "Association") for assoc_id in self._delete_assoc_ids]
+        if self._delete_list:
+            del_res_ids = [res_id for res_id, del_assoc in self._delete_list]
+            del_assoc_flags = dict(self._delete_list)
+            assoc_ids = set(self._delete_assoc_ids)
+            for assoc in rr.find_associations(anyside=del_res_ids, id_only=False):
+                for res_id in (assoc.s, assoc.o):
+                    if res_id not in del_assoc_flags or assoc._id in assoc_ids:
+                        continue
+                    if del_assoc_flags[res_id] or (assoc.p == PRED.hasOwner and res_id == assoc.s):
+                        assoc_ids.add(assoc._id)
+                        delete_ids.append((assoc._id, "Association"))
+                    else:
+                        log.warn("Deleting object %s that still has associations" % res_id)
+            for res_id in del_res_ids:
+                get_res_obj(res_id)
+                delete_ids.append((res_id, None))
+
+        create_objs = self._create_objs + assoc_objs
+        create_res, update_res = rr.rr_store.write_batch(create_objs=create_objs, update_objs=self._update_objs,
+                                                         delete_ids=delete_ids,
+                                                         bulk_insert=len(create_objs) >= self.bulk_insert_threshold)
+        self.created_ids = [(oid, rev) for success, oid, rev in create_res]
+        return update_res, read_objs
+
+
 class ResourceRegistryServiceWrapper(object):
     """
     Class that maps the service interface of the resource_registry service (YML)
@@ -914,6 +1250,10 @@ class ResourceQuery(DatastoreQueryBuilder):
         Comparison op can be TXT_ICONTAINS or TXT_CONTAINS"""
         return self.op_expr(DQ.XOP_ALLMATCH, value, cmpop)
 
+    def filter_fulltext(self, value):
+        """Full-text search in name, description, keywords and configured attributes, ordered by rank"""
+        return self.op_expr(DQ.XOP_FULLTEXT, value)
+
     def filter_keyword(self, kw_expr):
         """Include resources with one or multiple keywords"""
         return self.op_expr(DQ.XOP_KEYWORD, kw_expr)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+"""Read-through cache for resource objects used by the container resource registry"""
+
+__author__ = 'Michael Meisinger'
+
+from collections import OrderedDict
+import copy
+import sys
+import time
+
+from pyon.core.object import IonObjectBase
+
+
+class ResourceObjectCache(object):
+    """
+    LRU/TTL cache of deserialized resource objects, keyed by (id, _rev).
+    Memory is bounded by number of entries and by an estimate of object size in bytes.
+    Cached objects are copied on put and on get, so callers cannot modify cache contents.
+    Consistency is maintained by invalidating entries on resource modification; the TTL
+    bounds the staleness of objects modified in other containers.
+    """
+
+    def __init__(self, max_entries=5000, max_bytes=50000000, ttl=300.0):
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+        self.ttl = float(ttl)
+
+        self._entries = OrderedDict()    # (id, rev) -> (obj, size, expiry), in LRU order
+        self._cur_rev = {}               # id -> rev of most recently cached version
+        self._cur_bytes = 0
+        self.generation = 0              # Incremented on every invalidation
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, object_id, rev_id=None):
+        """
+        Returns a copy of the cached object for given id (and revision, if provided) or None
+        """
+        if not rev_id:
+            rev_id = self._cur_rev.get(object_id, None)
+        key = (object_id, rev_id)
+        entry = self._entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        obj, size, expiry = entry
+        if self.ttl and expiry < time.time():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        # Move to most recently used position
+        del self._entries[key]
+        self._entries[key] = entry
+        self.hits += 1
+        return copy.deepcopy(obj)
+
+    def put(self, obj, since_generation=None):
+        """
+        Adds a copy of given resource object to the cache, replacing older revisions.
+        An object older than the currently cached revision is not cached.
+        If since_generation is provided (the generation before the object was read), the object is not
+        cached if any invalidation happened meanwhile, because it might already be outdated.
+        """
+        object_id, rev_id = getattr(obj, "_id", None), getattr(obj, "_rev", None)
+        if not object_id or not rev_id:
+            return
+        if since_generation is not None and since_generation != self.generation:
+            return
+        cur_rev = self._cur_rev.get(object_id, None)
+        if cur_rev is not None and is_older_rev(rev_id, cur_rev):
+            return
+        size = estimate_size(obj)
+        if size > self.max_bytes:
+            return
+        self.invalidate(object_id, count=False)
+
+        key = (object_id, rev_id)
+        self._entries[key] = (copy.deepcopy(obj), size, time.time() + self.ttl)
+        self._cur_rev[object_id] = rev_id
+        self._cur_bytes += size
+        self._prune()
+
+    def invalidate(self, object_id, count=True):
+        """
+        Removes all cached revisions of given object id.
+        """
+        if count:
+            self.generation += 1
+        rev_id = self._cur_rev.pop(object_id, None)
+        if rev_id is not None:
+            self._remove((object_id, rev_id))
+            if count:
+                self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._cur_rev.clear()
+        self._cur_bytes = 0
+
+    def get_stats(self):
+        num_reads = self.hits + self.misses
+        return dict(entries=len(self._entries), bytes=self._cur_bytes,
+                    max_entries=self.max_entries, max_bytes=self.max_bytes, ttl=self.ttl,
+                    hits=self.hits, misses=self.misses,
+                    hit_rate=round(float(self.hits) / num_reads, 4) if num_reads else 0.0,
+                    evictions=self.evictions, invalidations=self.invalidations)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._cur_bytes -= entry[1]
+            if self._cur_rev.get(key[0], None) == key[1]:
+                del self._cur_rev[key[0]]
+
+    def _prune(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._cur_bytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+def is_older_rev(rev_id, other_rev_id):
+    """Returns True if rev_id is an older revision than other_rev_id (for numeric revisions)"""
+    try:
+        return int(rev_id) < int(other_rev_id)
+    except (TypeError, ValueError):
+        return False
+
+
+def estimate_size(value):
+    """
+    Returns a rough estimate of the memory footprint in bytes of a resource object
+    or other nested structure of dicts, lists and primitive values.
+    """
+    if isinstance(value, IonObjectBase):
+        value = value.__dict__
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.iteritems())
+    elif isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
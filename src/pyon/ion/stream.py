@@ -8,6 +8,7 @@
 
 import gevent
 
+from pyon.core.bootstrap import CFG
 from pyon.core.exception import BadRequest
 from pyon.net.endpoint import Publisher, Subscriber
 from pyon.util.log import log
@@ -21,7 +22,7 @@ class StreamPublisher(Publisher):
     packet. Stream Publisher is intended to be used in an Ion Process.
     '''
 
-    def __init__(self, process=None, stream_id='', stream_route=None, exchange_point='', routing_key=''):
+    def __init__(self, process=None, stream_id='', stream_route=None, exchange_point='', routing_key='', confirm=None):
         '''
         Creates a StreamPublisher which publishes to the specified stream by default and is attached to the
         specified process.
@@ -30,8 +31,9 @@ class StreamPublisher(Publisher):
         @param stream_route   A StreamRoute corresponding to the stream_id
         @param exchange_point The name of the exchange point, to be used in lieu of stream_route or stream_id
         @param routing_key    The routing key to be used in lieu of stream_route or stream_id
+        @param confirm        Use publisher confirms; call flush() to wait for confirmation (defaults to config)
         '''
-        super(StreamPublisher, self).__init__()
+        super(StreamPublisher, self).__init__(confirm=confirm)
         if not isinstance(process, BaseService):
             raise BadRequest('No valid process provided.')
         #--------------------------------------------------------------------------------
@@ -95,12 +97,13 @@ class StreamSubscriber(Subscriber):
       def receive(msg, route, stream_id):
           pass
     '''
-    def __init__(self, process, exchange_name, callback=None):
+    def __init__(self, process, exchange_name, callback=None, batch_size=None):
         '''
         Creates a new StreamSubscriber which will listen on the specified queue (exchange_name).
         @param process       The Ion Process to attach to.
         @param exchange_name The subscribing queue name.
         @param callback      The callback to execute upon receipt of a packet.
+        @param batch_size    Number of packets received and acked at once (defaults to config)
         '''
         if not isinstance(process, BaseService):
             raise BadRequest('No valid process was provided.')
@@ -108,7 +111,8 @@ class StreamSubscriber(Subscriber):
         self.xn = self.container.ex_manager.create_xn_queue(exchange_name)
         self.started = False
         self.callback = callback or process.call_process
-        super(StreamSubscriber, self).__init__(from_name=self.xn, callback=self.preprocess)
+        batch_size = batch_size or CFG.get_safe('container.messaging.endpoint.stream_batch_size', 1)
+        super(StreamSubscriber, self).__init__(from_name=self.xn, callback=self.preprocess, batch_size=batch_size)
 
     def preprocess(self, msg, headers):
         '''
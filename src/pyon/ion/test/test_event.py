@@ -502,6 +502,12 @@ class TestEventRepoInt(IonIntegrationTestCase):
         self.assertEquals(len(ev_obj), 3)
         self.assertTrue(all([True for eo in ev_obj if isinstance(eo, basestring)]))
 
+        eq = EventQuery()
+        eq.set_filter(eq.filter_type(OT.ResourceCommandEvent))
+        ev_obj = list(self.er.find_events_query_iter(query=eq.get_query(), id_only=False, chunk_size=2))
+        self.assertEquals(len(ev_obj), 3)
+        self.assertTrue(all([eo.type_ == OT.ResourceCommandEvent for eo in ev_obj]))
+
         eq = EventQuery()
         eq.set_filter(eq.filter_sub_type("ST", cmpop=DQ.TXT_CONTAINS))
         ev_obj = self.er.find_events_query(query=eq.get_query(), id_only=False)
@@ -532,6 +532,49 @@ class ProcessTest(PyonTestCase):
 
         self.assertEquals((True, True, False), hb)
 
+    def test_concurrent_calls(self):
+        svc = self._make_service()
+        svc.CFG = {'process': {'concurrency': 2, 'exclusive_ops': ['excl_op']}}
+        p = IonProcessThread(name=sentinel.name, listeners=[], service=svc)
+        p.start()
+        p.get_ready_event().wait(timeout=5)
+        self.addCleanup(p.stop)
+
+        self.assertEquals(p.concurrency, 2)
+        self.assertEquals(len(p._ctrl_threads), 2)
+
+        def fake_op(evout, evin):
+            evout.set(True)
+            evin.wait()
+
+        # a blocked call does not hold up the next one
+        listenoutev = AsyncResult()
+        listeninev = Event()
+        self.addCleanup(listeninev.set)
+        ar = p._routing_call(fake_op, {'op': 'slow_op'}, listenoutev, listeninev)
+        listenoutev.get(timeout=5)
+
+        ar2 = p._routing_call(lambda: sentinel.val, {'op': 'fast_op'})
+        self.assertEquals(ar2.get(timeout=5), sentinel.val)
+
+        # an exclusive call waits for the blocked call, later calls wait for the exclusive call
+        exclar = AsyncResult()
+        ar3 = p._routing_call(exclar.set, {'op': 'excl_op'}, sentinel.excl)
+        ar4 = p._routing_call(lambda: sentinel.val2, {'op': 'fast_op'})
+        self.assertRaises(Timeout, ar4.get, timeout=0.5)
+        self.assertFalse(exclar.ready())
+
+        hb = p.heartbeat()
+        self.assertEquals((True, True, True), hb)
+        self.assertEquals(ar, p._heartbeat_op)
+
+        # abort the blocked call, which unblocks the others
+        p.cancel_or_abort_call(ar)
+        self.assertEquals(ar3.get(timeout=5), None)
+        self.assertEquals(exclar.get(), sentinel.excl)
+        self.assertEquals(ar4.get(timeout=5), sentinel.val2)
+        self.assertFalse(ar.ready())
+
 class FakeService(BaseService):
     """
     Class to use for testing below.
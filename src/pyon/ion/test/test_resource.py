@@ -86,6 +86,22 @@ class TestResources(IonUnitTestCase):
 
 
 
+    def test_prepare_context(self):
+        def assoc(aid, s, p, o):
+            return Mock(_id=aid, s=s, p=p, o=o)
+        rr = Mock()
+        rr.find_associations.return_value = [assoc("a1", "123", PRED.hasOwner, "111"),
+                                             assoc("a2", "456", PRED.hasResource, "123"),
+                                             assoc("a3", "123", PRED.hasModel, "789")]
+        rr.traverse_associations.return_value = [assoc("a4", "111", PRED.hasInfo, "222")]
+        extended_resource_handler = ExtendedResourceContainer(Mock(), rr)
+
+        # Second level predicates are followed only from resources associated by their first predicate
+        extended_resource_handler._prepare_context("123", {(PRED.hasOwner, PRED.hasInfo)})
+        rr.traverse_associations.assert_called_once_with(["111"], [([PRED.hasInfo], "")], id_only=False)
+        self.assertEquals(extended_resource_handler.ctx['by_subject'][("111", PRED.hasInfo)][0]._id, "a4")
+        self.assertEquals(extended_resource_handler.ctx['loaded_predicates'], {(PRED.hasOwner, PRED.hasInfo)})
+
     def xtest_create_extended_resource_container(self):
 
         mock_clients = self._create_service_mock('resource_registry')
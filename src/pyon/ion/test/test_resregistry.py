@@ -105,6 +105,72 @@ class TestResourceRegistry(IonIntegrationTestCase):
         for a in assocs:
              self.rr.delete_association(a)
 
+        # Test multi-hop association traversal
+        assoc_ids = self.rr.traverse_associations(rid1, [(PRED.hasResource, ">")], id_only=True)
+        self.assertEquals(set(assoc_ids), {aid1, aid4})
+
+        aid5,_ = self.rr.create_association(rid4, PRED.hasResource, rid2)
+        assocs = self.rr.traverse_associations(rid1, [(PRED.hasResource, ">"), (PRED.hasResource, "<")])
+        self.assertEquals(len(assocs), 3)
+        self.assertEquals(set(a._id for a in assocs[:2]), {aid1, aid4})
+        self.assertEquals(assocs[2]._id, aid5)
+
+        assoc_ids = self.rr.traverse_associations([rid2, rid5], [(None, "")], id_only=True)
+        self.assertEquals(set(assoc_ids), {aid1, aid4, aid5})
+
+        assoc_ids = self.rr.traverse_associations(rid4, [(None, "<")], id_only=True)
+        self.assertEquals(assoc_ids, [])
+
+
+    def test_rr_batch(self):
+        actor_id, _ = self.rr.create(IonObject(RT.ActorIdentity, name="batch_actor"))
+        org_obj = IonObject(RT.Org, name="batch_org")
+        org_id, _ = self.rr.create(org_obj)
+
+        with self.rr.batch() as batch:
+            rid1 = batch.create(IonObject(RT.TestInstrument, name="B1"), actor_id=actor_id)
+            rid2 = batch.create(IonObject(RT.TestPlatform, name="B2"))
+            aid1 = batch.create_association(org_id, PRED.hasResource, rid1)
+            aid2 = batch.create_association(org_id, PRED.hasResource, rid2)
+            org_obj = self.rr.read(org_id)
+            org_obj.description = "updated in batch"
+            batch.update(org_obj)
+
+            # Nothing written before the batch completes
+            with self.assertRaises(NotFound):
+                self.rr.read(rid1)
+
+        self.assertEquals(len(batch.created_ids), 5)
+        self.assertEquals(set(oid for oid, rev in batch.created_ids) & {rid1, rid2, aid1, aid2}, {rid1, rid2, aid1, aid2})
+        res_objs = self.rr.read_mult([rid1, rid2])
+        self.assertEquals([o.name for o in res_objs], ["B1", "B2"])
+        self.assertEquals(self.rr.read(org_id).description, "updated in batch")
+        obj_ids, _ = self.rr.find_objects(org_id, PRED.hasResource, id_only=True)
+        self.assertEquals(set(obj_ids), {rid1, rid2})
+        owner_ids, _ = self.rr.find_objects(rid1, PRED.hasOwner, id_only=True)
+        self.assertEquals(owner_ids, [actor_id])
+
+        # An invalid batch writes none of its changes
+        res_obj3 = IonObject(RT.TestInstrument, name="B3")
+        with self.assertRaises(BadRequest):
+            with self.rr.batch() as batch:
+                rid3 = batch.create(res_obj3)
+                batch.create_association(rid3, PRED.hasResource, org_id)
+        with self.assertRaises(NotFound):
+            self.rr.read(rid3)
+
+        # Objects of a failed batch can be created again
+        self.assertNotIn("_id", res_obj3)
+        rid3, _ = self.rr.create(res_obj3)
+        self.rr.delete(rid3)
+
+        with self.rr.batch() as batch:
+            batch.delete(rid1)
+            batch.delete(rid2, del_associations=True)
+        with self.assertRaises(NotFound):
+            self.rr.read(rid1)
+        obj_ids, _ = self.rr.find_objects(org_id, PRED.hasResource, id_only=True)
+        self.assertEquals(obj_ids, [])
 
     def test_rr_create_with_id(self):
         res_obj1 = IonObject(RT.ActorIdentity)
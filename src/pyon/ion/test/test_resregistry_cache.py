@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+__author__ = 'Michael Meisinger'
+
+from nose.plugins.attrib import attr
+
+from pyon.util.unit_test import IonUnitTestCase
+from pyon.core.bootstrap import IonObject
+from pyon.ion.resource import RT
+from pyon.ion.resregistry_cache import ResourceObjectCache, estimate_size
+
+
+@attr('UNIT', group='resource')
+class TestResourceObjectCache(IonUnitTestCase):
+
+    def _create_res(self, res_id, rev="1", name="res"):
+        res_obj = IonObject(RT.Org, name=name)
+        res_obj._id = res_id
+        res_obj._rev = rev
+        return res_obj
+
+    def test_cache_read_invalidate(self):
+        cache = ResourceObjectCache(max_entries=10, max_bytes=1000000, ttl=60)
+        self.assertIsNone(cache.get("id1"))
+
+        res1 = self._create_res("id1")
+        cache.put(res1)
+        res1.name = "changed"
+
+        # Returned objects are copies
+        read1 = cache.get("id1")
+        self.assertEquals(read1.name, "res")
+        read1.name = "changed"
+        self.assertEquals(cache.get("id1").name, "res")
+        self.assertEquals(cache.get("id1", "1").name, "res")
+        self.assertIsNone(cache.get("id1", "2"))
+
+        # Newer revision replaces older
+        cache.put(self._create_res("id1", rev="2", name="res2"))
+        self.assertIsNone(cache.get("id1", "1"))
+        self.assertEquals(cache.get("id1").name, "res2")
+
+        cache.invalidate("id1")
+        self.assertIsNone(cache.get("id1"))
+
+        # Objects read before an invalidation are not cached
+        gen = cache.generation
+        cache.invalidate("id2")
+        cache.put(self._create_res("id2"), since_generation=gen)
+        self.assertIsNone(cache.get("id2"))
+
+        stats = cache.get_stats()
+        self.assertEquals(stats["entries"], 0)
+        self.assertEquals(stats["bytes"], 0)
+        self.assertEquals(stats["hits"], 4)
+        self.assertEquals(stats["misses"], 5)
+        self.assertEquals(stats["invalidations"], 1)
+
+        # Older revisions do not replace a newer cached revision
+        cache.put(self._create_res("id3", rev="3", name="res3"))
+        cache.put(self._create_res("id3", rev="2", name="res2"))
+        self.assertEquals(cache.get("id3").name, "res3")
+
+    def test_cache_limits(self):
+        cache = ResourceObjectCache(max_entries=3, max_bytes=1000000, ttl=60)
+        for i in xrange(5):
+            cache.put(self._create_res("id%s" % i))
+        self.assertEquals(cache.get_stats()["entries"], 3)
+        self.assertEquals(cache.get_stats()["evictions"], 2)
+        self.assertIsNone(cache.get("id0"))
+        self.assertIsNotNone(cache.get("id2"))
+
+        # id2 is now most recently used
+        cache.put(self._create_res("id5"))
+        self.assertIsNone(cache.get("id3"))
+        self.assertIsNotNone(cache.get("id2"))
+
+        res_size = estimate_size(self._create_res("id0"))
+        cache = ResourceObjectCache(max_entries=100, max_bytes=res_size * 2, ttl=60)
+        for i in xrange(5):
+            cache.put(self._create_res("id%s" % i))
+        self.assertEquals(cache.get_stats()["entries"], 2)
+        self.assertLessEqual(cache.get_stats()["bytes"], res_size * 2)
+
+        cache = ResourceObjectCache(max_entries=10, max_bytes=1000000, ttl=-1)
+        cache.put(self._create_res("id1"))
+        self.assertIsNone(cache.get("id1"))
+        self.assertEquals(cache.get_stats()["entries"], 0)
@@ -43,7 +43,7 @@ from gevent import queue as gqueue
 from gevent.lock import RLock
 from contextlib import contextmanager
 from gevent.event import AsyncResult, Event
-from pyon.net.transport import AMQPTransport, NameTrio
+from pyon.net.transport import AMQPTransport, NameTrio, TransportError
 from pyon.util.fsm import FSM
 from pyon.core.bootstrap import CFG
 import sys
@@ -342,6 +342,8 @@ class SendChannel(BaseChannel):
     A channel that can only send.
     """
     _send_name = None           # name that this channel is sending to - tuple (exchange, routing_key)
+    _confirms = False           # publisher confirm mode (see enable_confirms)
+    _failed_confirms = 0        # publishes not confirmed by transports that have closed since
 
     def connect(self, name):
         """
@@ -353,9 +355,64 @@ class SendChannel(BaseChannel):
         self._send_name = name
         self._exchange = name.exchange
 
-    def send(self, data, headers=None):
+    def send(self, data, headers=None, name=None):
+        """
+        Sends data to the connected name.
+        @param  name    Optional NameTrio to send to instead of the connected name (e.g. another routing key)
+        """
         #log.debug("SendChannel.send")
-        self._send(self._send_name, data, headers=headers)
+        return self._send(name or self._send_name, data, headers=headers)
+
+    def enable_confirms(self, max_pending=1000):
+        """
+        Puts this channel into publisher confirm mode. Sends no longer block on the broker but
+        return an AsyncResult that is set once the broker has confirmed the message.
+        @param max_pending  Number of unconfirmed messages after which send blocks
+        """
+        with self._ensure_transport():
+            self._transport.confirm_delivery_impl(max_pending=max_pending)
+        self._confirms = True
+
+    def flush(self, timeout=None):
+        """
+        Waits for the broker to confirm all messages sent on this channel so far.
+        No-op if the channel is not in confirm mode.
+        @retval Number of messages that were waited for
+        @raises TransportError  If any message was nacked or lost because the channel closed
+        """
+        num_pending = self.wait_confirms(timeout=timeout)
+        failed = self.pop_failed_confirms()
+        if failed:
+            raise TransportError("%s messages were not confirmed by the broker" % failed)
+        return num_pending
+
+    def wait_confirms(self, timeout=None):
+        """
+        Waits for the broker to confirm or reject all messages sent on this channel so far,
+        without raising for rejected messages (see pop_failed_confirms).
+        @retval Number of messages that were waited for
+        """
+        if not self._confirms or not self._transport:
+            return 0
+        return self._transport.wait_confirms_impl(timeout=timeout)
+
+    def pop_failed_confirms(self):
+        """
+        Returns the number of messages sent on this channel that were nacked or lost in a channel
+        close since the last call, including messages sent on a transport that has closed since.
+        """
+        if not self._confirms:
+            return 0
+        failed, self._failed_confirms = self._failed_confirms, 0
+        if self._transport:
+            failed += self._transport.pop_failed_confirms_impl()
+        return failed
+
+    def on_channel_close(self, transport, code, text):
+        # Keep count of unconfirmed publishes, which the transport failed when it closed
+        if self._confirms and transport is not None:
+            self._failed_confirms += transport.pop_failed_confirms_impl()
+        BaseChannel.on_channel_close(self, transport, code, text)
 
     def _send(self, name, data, headers=None):
         #log.debug("SendChannel._send\n\tname: %s\n\tdata: %s\n\theaders: %s", name, "-", headers)
@@ -371,17 +428,17 @@ class SendChannel(BaseChannel):
         # @TODO is this the best way to tell?
         # basically is checking to see if send_name is an XO
         durable_msg = False
-        if hasattr(self._send_name, 'queue_durable'):
-            durable_msg = self._send_name.queue_durable
+        if hasattr(name, 'queue_durable'):
+            durable_msg = name.queue_durable
 
         with self._ensure_transport():
-            self._transport.publish_impl(exchange=exchange,
-                                         routing_key=routing_key,
-                                         body=data,
-                                         properties=headers,
-                                         immediate=False,
-                                         mandatory=False,
-                                         durable_msg=durable_msg)
+            return self._transport.publish_impl(exchange=exchange,
+                                                routing_key=routing_key,
+                                                body=data,
+                                                properties=headers,
+                                                immediate=False,
+                                                mandatory=False,
+                                                durable_msg=durable_msg)
 
 class RecvChannel(BaseChannel):
     """
@@ -725,14 +782,25 @@ class RecvChannel(BaseChannel):
         # put body, headers, delivery tag (for acking) in the recv queue
         self._recv_queue.put((body, header_frame.headers, delivery_tag))
 
-    def ack(self, delivery_tag):
+    def ack(self, delivery_tag, multiple=False):
         """
-        Acks a message using the delivery tag.
+        Acks a message using the delivery tag. With multiple set, acks all unacked messages
+        received on this channel up to and including the delivery tag.
         Should be called by the EP layer.
         """
         #log.debug("RecvChannel.ack: %s", delivery_tag)
         with self._ensure_transport():
-            self._transport.ack_impl(delivery_tag)
+            if multiple:
+                self._transport.ack_impl(delivery_tag, multiple=True)
+            else:
+                self._transport.ack_impl(delivery_tag)
+
+    def set_qos(self, prefetch_count):
+        """
+        Sets the number of unacked messages the broker delivers to consumers on this channel.
+        """
+        with self._ensure_transport():
+            self._transport.qos_impl(prefetch_count=prefetch_count)
 
     def reject(self, delivery_tag, requeue=False):
         """
@@ -766,15 +834,22 @@ class RecvChannel(BaseChannel):
 
 class PublisherChannel(SendChannel):
 
-    def send(self, data, headers=None):
+    _declared_exchange = None
+
+    def send(self, data, headers=None, name=None):
         """
         Send override that ensures the exchange is declared, always.
 
         Avoids the auto-delete exchange problem in integration tests with Publishers.
+        In confirm mode, the exchange is only declared once per channel, so that
+        sends do not wait for a broker round trip.
         """
-        assert self._send_name and self._send_name.exchange
-        self._declare_exchange(self._send_name.exchange)
-        SendChannel.send(self, data, headers=headers)
+        send_name = name or self._send_name
+        assert send_name and send_name.exchange
+        if not self._confirms or self._declared_exchange != send_name.exchange:
+            self._declare_exchange(send_name.exchange)
+            self._declared_exchange = send_name.exchange
+        return SendChannel.send(self, data, headers=headers, name=send_name)
 
 class BidirClientChannel(SendChannel, RecvChannel):
     """
@@ -798,7 +873,15 @@ class BidirClientChannel(SendChannel, RecvChannel):
         if not 'reply-to' in headers:
             headers['reply-to'] = "%s,%s" % (self._recv_name.exchange, self._recv_name.queue)
 
-        SendChannel._send(self, name, data, headers=headers)
+        return SendChannel._send(self, name, data, headers=headers)
+
+class ReplyChannel(RecvChannel):
+    """
+    Receives the responses to many RPC requests on one anonymous, exclusive queue.
+    Used by the endpoint layer's ReplyDispatcher; the queue is removed when consuming stops.
+    """
+    _queue_auto_delete = True
+    _consumer_exclusive = True
 
 class ListenChannel(RecvChannel):
     """
@@ -820,6 +903,7 @@ class ListenChannel(RecvChannel):
         def __init__(self, name=None, binding=None, parent_channel=None, **kwargs):
             RecvChannel.__init__(self, name=name, binding=binding, **kwargs)
             self._delivery_tags = set()
+            self._last_delivery_tag = None
             self._parent_channel = parent_channel
 
         def close_impl(self):
@@ -834,6 +918,7 @@ class ListenChannel(RecvChannel):
             """
             msg = RecvChannel.recv(self, timeout=timeout)
             self._delivery_tags.add(msg[2])
+            self._last_delivery_tag = msg[2]
             return msg
 
         def _checkin(self, delivery_tag):
@@ -868,6 +953,18 @@ class ListenChannel(RecvChannel):
             RecvChannel.reject(self, delivery_tag, requeue=requeue)
             self._checkin(delivery_tag)
 
+        def ack_all(self):
+            """
+            Acks all messages received on this channel and not yet acked or rejected.
+            Uses a single ack of the last received delivery tag with multiple set, so must
+            only be used if messages are received, acked and rejected in delivery order.
+            """
+            if not self._delivery_tags:
+                return
+            RecvChannel.ack(self, self._last_delivery_tag, multiple=True)
+            self._delivery_tags.clear()
+            self._parent_channel.exit_accept()
+
     def __init__(self, name=None, binding=None, **kwargs):
         RecvChannel.__init__(self, name=name, binding=binding, **kwargs)
 
@@ -904,13 +1001,14 @@ class ListenChannel(RecvChannel):
         self.stop_consume()
         self._on_close(fsm)
 
-    def accept(self, n=1, timeout=None):
+    def accept(self, n=1, timeout=None, max_n=None):
         """
         Accepts new connections for listening endpoints.
 
         Can accept more than one message at at time before it returns a new channel back to the
         caller. Optionally can specify a timeout - if n messages aren't received in that time,
-        will raise an Empty exception.
+        will raise an Empty exception. If max_n is given, up to max_n messages are accepted if
+        already received at the time n messages are available.
 
         Sets the channel in the ACCEPTED state - caller is responsible for acking all messages
         received on the returned channel in order to put this channel back in the CONSUMING
@@ -941,6 +1039,9 @@ class ListenChannel(RecvChannel):
                 else:
                     log.debug("accept should turn consume off, but queue is auto_delete and this would destroy the queue")
 
+        if max_n and max_n > n:
+            n = max(n, min(max_n, self._recv_queue.qsize()))
+
         ms = [self.recv() for x in xrange(n)]
 
         ch = self._create_accepted_channel(self._transport, ms)
@@ -2,11 +2,16 @@
 
 """Provides the communication layer above channels."""
 
+import gevent
 from gevent import event
+import bisect
+import json
+import weakref
 from gevent.lock import RLock
 from gevent.timeout import Timeout
 from zope import interface
 import pprint
+from collections import OrderedDict
 import uuid
 import time
 import inspect
@@ -18,11 +23,12 @@ import threading
 from pyon.core import bootstrap, exception
 from pyon.core.bootstrap import CFG, IonObject
 from pyon.core.exception import ExceptionFactory, IonException, BadRequest, Unauthorized
-from pyon.net.channel import ChannelClosedError, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel
+from pyon.net.channel import ChannelError, ChannelClosedError, PublisherChannel, ListenChannel, SubscriberChannel, ServerChannel, BidirClientChannel, \
+    ReplyChannel
 from pyon.core.interceptor.interceptor import Invocation, process_interceptors
 from pyon.util.containers import get_ion_ts, get_ion_ts_millis
 from pyon.util.log import log
-from pyon.net.transport import NameTrio, BaseTransport, XOTransport
+from pyon.net.transport import NameTrio, BaseTransport, XOTransport, TransportError
 
 # create special logging category for RPC message tracking
 import logging
@@ -478,7 +484,13 @@ class ListeningBaseEndpoint(BaseEndpoint):
 
             self.endpoint._message_received(self.body, self.headers)
 
-    def __init__(self, node=None, name=None, from_name=None, binding=None, transport=None):
+    def __init__(self, node=None, name=None, from_name=None, binding=None, transport=None, batch_size=None, prefetch_count=None):
+        """
+        @param  batch_size      If > 1, listen accepts up to this many ready messages at once, routes them
+                                and acks them with a single ack
+        @param  prefetch_count  Number of unacked messages the broker delivers while listening. Defaults to
+                                batch_size if batching, otherwise to the container default
+        """
         BaseEndpoint.__init__(self, node=node, transport=transport)
 
         if name:
@@ -498,6 +510,8 @@ class ListeningBaseEndpoint(BaseEndpoint):
         self._ready_event = event.Event()
         self._binding = binding
         self._chan = None
+        self._batch_size = max(int(batch_size or 1), 1)
+        self._prefetch_count = prefetch_count or (self._batch_size if self._batch_size > 1 else None)
 
     def _create_channel(self, **kwargs):
         """
@@ -536,6 +550,9 @@ class ListeningBaseEndpoint(BaseEndpoint):
         # notify any listeners of our readiness
         self._ready_event.set()
 
+        if self._batch_size > 1:
+            return self._listen_batch()
+
         while True:
             m = None
             try:
@@ -549,6 +566,35 @@ class ListeningBaseEndpoint(BaseEndpoint):
                 if m is not None:
                     m.ack()
 
+    def _listen_batch(self):
+        """
+        Listen loop for batch mode: accepts up to batch_size ready messages, routes them in order
+        and acks the whole batch with one ack.
+        """
+        while True:
+            newch, mos = None, []
+            routed = 0
+            try:
+                newch, mos = self._accept_msgs(num=1, max_num=self._batch_size)
+                for m in mos:
+                    m.route()       # call default handler
+                    routed += 1
+
+            except ChannelClosedError as ex:
+                break
+            finally:
+                if mos:
+                    if routed >= len(mos) - 1:
+                        # all messages handled (or failed on the last one, which is acked as in non-batch mode)
+                        newch.ack_all()
+                    else:
+                        # routing failed: ack handled and failed message, requeue the rest
+                        for i, m in enumerate(mos):
+                            if i <= routed:
+                                m.ack()
+                            else:
+                                m.reject(requeue=True)
+
     def prepare_listener(self, binding=None):
         """
         Creates a channel, prepares it, and begins consuming on it.
@@ -583,6 +629,8 @@ class ListeningBaseEndpoint(BaseEndpoint):
         You must have called initialize first.
         """
         assert self._chan
+        if self._prefetch_count:
+            self._chan.set_qos(self._prefetch_count)
         self._chan.start_consume()
 
     def deactivate(self):
@@ -602,14 +650,25 @@ class ListeningBaseEndpoint(BaseEndpoint):
         the response will be sent immediatly and the MessageObject returned to you will not have
         body/headers set and will have error set. You should expect to check body/headers or error.
         """
+        newch, mos = self._accept_msgs(num=num, timeout=timeout)
+        return mos
+
+    def _accept_msgs(self, num=1, timeout=None, max_num=None):
+        """
+        Accepts n (or up to max_num, if already received) messages and returns a tuple of the
+        accepted channel and the list of MessageObjects.
+        """
         assert self._chan, "_get_n_msgs: needs the endpoint to have been initialized"
 
         mos = []
-        newch = self._chan.accept(n=num, timeout=timeout)
+        if max_num:
+            newch = self._chan.accept(n=num, timeout=timeout, max_n=max_num)
+        else:
+            newch = self._chan.accept(n=num, timeout=timeout)
         qsize = newch._recv_queue.qsize()
         if qsize == 0:
             self._chan.exit_accept()
-            return []
+            return newch, []
 
         for x in xrange(newch._recv_queue.qsize()):
             mo = self.MessageObject(newch.recv(), newch.ack, newch.reject, self.create_endpoint(existing_channel=newch))
@@ -617,7 +676,7 @@ class ListeningBaseEndpoint(BaseEndpoint):
             mos.append(mo)
             log_message("MESSAGE RECV >>> RPC-request", mo.raw_body, mo.raw_headers, self._recv_name, mo.delivery_tag, is_send=False)
 
-        return mos
+        return newch, mos
 
     def get_one_msg(self, timeout=None):
         """
@@ -693,19 +752,49 @@ class ListeningBaseEndpoint(BaseEndpoint):
 #
 
 class PublisherEndpointUnit(EndpointUnit):
-    pass
+
+    def _send(self, msg, headers=None, send_name=None, **kwargs):
+        """
+        Sends to the given NameTrio (if provided) instead of the name the channel is connected to,
+        so that concurrent publishes to different routes can share the channel.
+        """
+        new_msg, new_headers = self.intercept_out(msg, headers)
+
+        # Provide a hook for all outgoing messages before they hit transport
+        trigger_msg_out_callback(new_msg, new_headers, self, send_name=send_name)
+
+        self.channel.send(new_msg, new_headers, name=send_name)
+
+        return new_msg, new_headers
 
 
 class Publisher(SendingBaseEndpoint):
     """
     Simple publisher sends out broadcast messages.
+
+    Publishing channels are kept open for reuse (one per destination exchange), so call close()
+    when done with a Publisher instance.
+
+    With confirm=True, publishing channels use publisher confirms: publish does not wait for the
+    broker, while flush() waits until the broker has confirmed all messages published so far.
     """
 
     endpoint_unit_type = PublisherEndpointUnit
     channel_type = PublisherChannel
 
-    def __init__(self, **kwargs):
+    def __init__(self, confirm=None, **kwargs):
+        """
+        @param  confirm     Use publisher confirms. Defaults to container.messaging.endpoint.publisher_confirms
+        """
         self._pub_ep = None
+        self._pub_eps = OrderedDict()   # exchange -> cached ep for publishing with to_name, in LRU order
+        self._pub_lock = RLock()
+        self._max_pub_eps = max(int(CFG.get_safe('container.messaging.endpoint.publisher_channel_cache', 10)), 1)
+        if confirm is None:
+            confirm = CFG.get_safe('container.messaging.endpoint.publisher_confirms', False)
+        self._confirm = bool(confirm)
+        self._max_unconfirmed = int(CFG.get_safe('container.messaging.endpoint.publisher_max_unconfirmed', 1000))
+        self._failed_confirms = 0       # Not confirmed messages of channels closed since the last flush
         SendingBaseEndpoint.__init__(self, **kwargs)
 
     def publish(self, msg, to_name=None, headers=None):
@@ -713,35 +802,127 @@ class Publisher(SendingBaseEndpoint):
             if not isinstance(to_name, NameTrio):
                 to_name = NameTrio(bootstrap.get_sys_name(), to_name)   # ensure NT before
 
-        # only use the cached pub_ep if to_name is None
-        ep = None
-        if to_name is None:
-
-            # we may have to create the cached ep
-            if self._pub_ep is None:
-
-                # send_name better have been specified in the constructor then
-                if self._send_name is None:
-                    raise EndpointError("Publisher has no address to send to, specify to_name on publish or send_name in initializer")
+        # send_name better have been specified in the constructor then
+        elif self._send_name is None:
+            raise EndpointError("Publisher has no address to send to, specify to_name on publish or send_name in initializer")
 
-                self._pub_ep = self.create_endpoint(self._send_name)
+        try:
+            self._publish(msg, to_name, headers)
+        except (ChannelError, ChannelClosedError) as ex:
+            # The cached channel was closed underneath us: replace it and retry once
+            log.info("Publishing channel closed (%s), retrying with new channel", ex)
+            self._remove_pub_ep(to_name)
+            self._publish(msg, to_name, headers)
+
+    def _publish(self, msg, to_name, headers):
+        # Only the endpoint lookup is locked; sends (and confirm back-pressure waits) run concurrently
+        old_eps = []
+        with self._pub_lock:
+            ep = self._get_pub_ep(to_name, old_eps)
+        for old_ep in old_eps:
+            self._close_pub_ep(old_ep)
+        # The routing key is just a send argument, so one channel per exchange serves all routes
+        ep.send(msg, headers, send_name=to_name)
+
+    def _get_pub_ep(self, to_name, old_eps):
+        """
+        Returns a cached, open publishing endpoint unit for the given destination, creating it if needed.
+        Endpoints for explicit destinations are cached per exchange, bounded in number.
+        Replaced (closed) and evicted endpoints are added to old_eps, to be closed by the caller.
+        Must be called with the _pub_lock held.
+        """
+        if to_name is None:
+            if self._pub_ep is None or self._pub_ep.channel.get_channel_id() is None:
+                if self._pub_ep is not None:
+                    old_eps.append(self._pub_ep)
+                self._pub_ep = self._create_pub_ep(self._send_name)
                 self._pub_ep.channel.connect(self._send_name)
-
-            ep = self._pub_ep
-        else:
-            ep = self.create_endpoint(to_name)
-            ep.channel.connect(to_name)
-
-        ep.send(msg, headers)
-        if ep != self._pub_ep:
+            return self._pub_ep
+
+        ep = self._pub_eps.pop(to_name.exchange, None)
+        if ep is not None and ep.channel.get_channel_id() is None:
+            old_eps.append(ep)
+            ep = None
+        if ep is None:
+            while len(self._pub_eps) >= self._max_pub_eps:
+                _, old_ep = self._pub_eps.popitem(last=False)
+                old_eps.append(old_ep)
+            ep = self._create_pub_ep(to_name)
+        self._pub_eps[to_name.exchange] = ep
+        return ep
+
+    def _close_pub_ep(self, ep):
+        """
+        Closes a publishing endpoint that is no longer cached. In confirm mode, first waits for its
+        outstanding confirms and keeps count of its messages that were not confirmed for flush().
+        """
+        if self._confirm:
+            try:
+                ep.channel.wait_confirms(timeout=CFG.get_safe('container.messaging.endpoint.publisher_flush_timeout', 10))
+            except Timeout:
+                log.warn("Timeout waiting for confirms of publishing channel to close")
+            self._failed_confirms += ep.channel.pop_failed_confirms()
+        try:
             ep.close()
+        except Exception:
+            log.debug("Error closing publishing channel", exc_info=True)
+        if self._confirm:
+            self._failed_confirms += ep.channel.pop_failed_confirms()
+
+    def _create_pub_ep(self, to_name):
+        ep = self.create_endpoint(to_name)
+        if self._confirm:
+            ep.channel.enable_confirms(max_pending=self._max_unconfirmed)
+        return ep
+
+    def flush(self, timeout=None):
+        """
+        Waits until the broker has confirmed all messages published so far on any of the
+        publishing channels. No-op unless publisher confirms are enabled.
+        @param  timeout     Max seconds to wait; raises Timeout if exceeded
+        @retval Number of messages that were waited for
+        @raises TransportError  If the broker rejected a message or a channel closed
+        """
+        if not self._confirm:
+            return 0
+        with self._pub_lock:
+            eps = ([self._pub_ep] if self._pub_ep else []) + self._pub_eps.values()
+        count = 0
+        with Timeout(timeout):
+            for ep in eps:
+                count += ep.channel.wait_confirms()
+        with self._pub_lock:
+            failed, self._failed_confirms = self._failed_confirms, 0
+        failed += sum(ep.channel.pop_failed_confirms() for ep in eps)
+        if failed:
+            raise TransportError("%s messages were not confirmed by the broker" % failed)
+        return count
+
+    def _remove_pub_ep(self, to_name):
+        with self._pub_lock:
+            if to_name is None:
+                ep, self._pub_ep = self._pub_ep, None
+            else:
+                ep = self._pub_eps.pop(to_name.exchange, None)
+        if ep is not None:
+            self._close_pub_ep(ep)
 
     def close(self):
         """
-        Closes the opened publishing channel, if we've opened it previously.
+        Closes the opened publishing channels, if we've opened them previously.
+        In confirm mode, waits for outstanding confirms first.
         """
-        if self._pub_ep:
-            self._pub_ep.close()
+        if self._confirm:
+            try:
+                self.flush(timeout=CFG.get_safe('container.messaging.endpoint.publisher_flush_timeout', 10))
+            except Exception:
+                log.warn("Publisher closed with unconfirmed messages", exc_info=True)
+        with self._pub_lock:
+            eps = ([self._pub_ep] if self._pub_ep else []) + self._pub_eps.values()
+            self._pub_ep = None
+            self._pub_eps.clear()
+        for ep in eps:
+            ep.close()
 
 
 class SubscriberEndpointUnit(EndpointUnit):
@@ -816,6 +997,113 @@ class BidirectionalListeningEndpointUnit(EndpointUnit):
 #  REQ / RESP (and RPC)
 #
 
+class ReplyDispatcher(object):
+    """
+    Long-lived reply queue shared by all RPC requests sent through a node to one exchange.
+
+    Instead of declaring, consuming from and deleting a reply queue for every request, requests set
+    the reply-to header to the dispatcher's queue and register their conv-id before sending.
+    A single receiving greenlet routes each response to the AsyncResult registered for its conv-id.
+    Responses for unknown conv-ids (e.g. requests that timed out) are discarded.
+    """
+    channel_type = ReplyChannel
+    _create_lock = RLock()
+
+    def __init__(self, node, exchange):
+        self.node = node
+        self.exchange = exchange
+        self.reply_to = None
+        self._pending = {}      # conv-id -> AsyncResult
+        self._chan = None
+        self._recv_gl = None
+        self._closed = False
+
+    @classmethod
+    def get_dispatcher(cls, node, exchange):
+        """
+        Returns the running dispatcher of the node for given exchange, starting one if necessary.
+        Returns None if the node does not support shared reply queues.
+        """
+        dispatchers = getattr(node, "reply_dispatchers", None)
+        if dispatchers is None or not getattr(node, "running", False):
+            return None
+        dispatcher = dispatchers.get(exchange, None)
+        if dispatcher is None:
+            with cls._create_lock:
+                dispatcher = dispatchers.get(exchange, None)
+                if dispatcher is None:
+                    dispatcher = cls(node, exchange)
+                    dispatcher.start()
+                    dispatchers[exchange] = dispatcher
+        return dispatcher
+
+    def start(self):
+        self._chan = self.node.channel(self.channel_type)
+        self._chan.setup_listener(NameTrio(self.exchange))  # anon queue
+        self._chan.start_consume()
+        self.reply_to = "%s,%s" % (self._chan._recv_name.exchange, self._chan._recv_name.queue)
+        self._recv_gl = gevent.spawn(self._receive_loop)
+        log.debug("Started RPC reply dispatcher on %s", self.reply_to)
+
+    def close(self, close_channel=True):
+        if self._closed:
+            return
+        self._closed = True
+        if self.node.reply_dispatchers.get(self.exchange, None) is self:
+            del self.node.reply_dispatchers[self.exchange]
+        if self._chan and close_channel:
+            self._chan.close()
+        if self._recv_gl and self._recv_gl is not gevent.getcurrent():
+            self._recv_gl.join(timeout=3)
+        self._fail_pending("RPC reply queue %s closed" % self.reply_to)
+
+    def register(self, conv_id):
+        """
+        Registers a request by conv-id and returns an AsyncResult that will receive the
+        (body, headers, delivery_tag) of the response. Returns None if the conv-id is already waiting.
+        """
+        if self._closed or conv_id in self._pending:
+            return None
+        ar = event.AsyncResult()
+        self._pending[conv_id] = ar
+        return ar
+
+    def unregister(self, conv_id):
+        self._pending.pop(conv_id, None)
+
+    def get_stats(self):
+        return dict(reply_to=self.reply_to, pending=len(self._pending))
+
+    def _receive_loop(self):
+        while True:
+            try:
+                rmsg, rheaders, rdtag = self._chan.recv()
+            except ChannelClosedError:
+                break
+
+            try:
+                self._chan.ack(rdtag)
+            except Exception:
+                log.exception("Error acking RPC response")
+
+            conv_id = rheaders.get('conv-id', None)
+            ar = self._pending.pop(conv_id, None)
+            if ar is not None:
+                ar.set((rmsg, rheaders, rdtag))
+            else:
+                log.warn("Discarding unknown message, likely from a previous timed out request (conv-id: %s, seq: %s, perf: %s)", conv_id or "no conv id", rheaders.get('conv-seq', 'no conv seq'), rheaders.get('performative', 'None'))
+
+        # Channel closed: make sure the next request gets a new dispatcher
+        if not self._closed:
+            log.warn("RPC reply queue %s closed unexpectedly", self.reply_to)
+            self.close(close_channel=False)
+
+    def _fail_pending(self, message):
+        pending, self._pending = self._pending, {}
+        for ar in pending.itervalues():
+            ar.set_exception(exception.ServiceUnavailable(message))
+
+
 class RequestEndpointUnit(BidirectionalEndpointUnit):
     def _get_response(self, conv_id, timeout):
         """
@@ -859,6 +1147,14 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
 
         # we have a timeout, update reply-by header
         headers['reply-by'] = str(int(headers['ts']) + int(timeout * 1000))
+
+        dispatcher = self._get_reply_dispatcher(headers)
+        if dispatcher:
+            conv_id = headers['conv-id']
+            ar = dispatcher.register(conv_id)
+            if ar is not None:
+                return self._send_shared_reply(dispatcher, ar, msg, headers, timeout)
+
         # TODO: Set a better name for RPC response queue with system prefix
         ep_name = NameTrio(self.channel._send_name.exchange)
         #ep_name = NameTrio(self.channel._send_name.exchange, self._unique_name)
@@ -873,6 +1169,40 @@ class RequestEndpointUnit(BidirectionalEndpointUnit):
             raise exception.Timeout('Request timed out (%d sec) waiting for response from %s, conv %s' % (timeout, str(self.channel._send_name), sent_headers['conv-id']))
         return result_data, result_headers
 
+    def _get_reply_dispatcher(self, headers):
+        """
+        Returns the shared reply queue dispatcher to use for this request, or None if the request
+        needs its own reply queue (no conv-id, custom reply-to or transport, or disabled in config).
+        """
+        if not CFG.get_safe('container.messaging.endpoint.shared_reply_queue', False):
+            return None
+        if 'conv-id' not in headers or 'reply-to' in headers:
+            return None
+        if self.endpoint is None or self.endpoint._transport is not None:
+            return None
+        send_name = self.channel._send_name
+        if not isinstance(send_name, NameTrio) or isinstance(send_name, BaseTransport):
+            return None
+        return ReplyDispatcher.get_dispatcher(self.endpoint.node, send_name.exchange)
+
+    def _send_shared_reply(self, dispatcher, ar, msg, headers, timeout):
+        """Sends a request with the shared reply queue as reply-to and waits for the dispatched response"""
+        conv_id = headers['conv-id']
+        headers['reply-to'] = dispatcher.reply_to
+        try:
+            BidirectionalEndpointUnit._send(self, msg, headers=headers)
+            try:
+                rmsg, rheaders, rdtag = ar.get(timeout=timeout)
+            except Timeout:
+                raise exception.Timeout('Request timed out (%d sec) waiting for response from %s, conv %s' % (timeout, str(self.channel._send_name), conv_id))
+        finally:
+            dispatcher.unregister(conv_id)
+
+        # Provide a hook for any message received
+        trigger_msg_in_callback(rmsg, rheaders, rdtag, self)
+
+        return self.intercept_in(rmsg, rheaders)
+
     def _build_header(self, raw_msg, raw_headers):
         """
         Sets headers common to Request-Response patterns, non-ion-specific.
@@ -1101,10 +1431,141 @@ class RPCClient(RequestResponseClient):
         return RequestResponseClient.request(self, msg, headers=headers, timeout=timeout)
 
 
+class RPCOperation(object):
+    """
+    Dispatch table entry for one RPC operation of a routing object: the signature information
+    needed to check the incoming arguments and the call metrics for the operation.
+    """
+    # Upper bounds (seconds) of the latency histogram buckets
+    LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+    def __init__(self, name, method, timeout=None):
+        self.name = name
+        self.timeout = timeout      # Default timeout if the request does not define one
+        self.set_method(method)
+
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+
+    def set_method(self, method):
+        self.func = getattr(method, "__func__", None)
+        self.arg_names = None       # Set of accepted argument names, None if any
+        # check arguments (as long as it is a function. might be a mock in testing.)
+        if isinstance(method, MethodType):
+            ro_meth_args = inspect.getargspec(method)
+            # if the keyword one is not none, we can support anything
+            if ro_meth_args[2] is None:
+                self.arg_names = frozenset(ro_meth_args[0])
+
+    def record(self, op_time, error=False):
+        self.count += 1
+        if error:
+            self.errors += 1
+        self.total_time += op_time
+        self.max_time = max(self.max_time, op_time)
+        self.histogram[bisect.bisect_left(self.LATENCY_BUCKETS, op_time)] += 1
+
+    def get_stats(self):
+        return dict(count=self.count, errors=self.errors,
+                    total_time=round(self.total_time, 6),
+                    avg_time=round(self.total_time / self.count, 6) if self.count else 0.0,
+                    max_time=round(self.max_time, 6),
+                    histogram=zip(self.LATENCY_BUCKETS + (None,), self.histogram))
+
+    def reset_stats(self):
+        self.count = self.errors = 0
+        self.total_time = self.max_time = 0.0
+        self.histogram = [0] * (len(self.LATENCY_BUCKETS) + 1)
+
+
+class RPCOpTable(object):
+    """
+    Per service dispatch table of RPCOperation entries, built when the RPC server is created.
+    Operations declared in the service's generated interface (SCHEMA_JSON) are added upfront,
+    other operations when first called.
+    """
+    # All live op tables, for container level metrics
+    _tables = weakref.WeakSet()
+
+    def __init__(self, routing_obj, name=None):
+        self._routing_obj = routing_obj
+        svc_name = getattr(routing_obj, "name", None)
+        self.name = name or (svc_name if isinstance(svc_name, basestring) else type(routing_obj).__name__)
+        self._ops = {}
+
+        schema = self._get_service_schema(routing_obj)
+        for op_name in schema.get("op_list", None) or []:
+            op_name = str(op_name)
+            if hasattr(routing_obj, op_name):
+                op_def = schema.get("operations", {}).get(op_name, None) or {}
+                self._ops[op_name] = RPCOperation(op_name, getattr(routing_obj, op_name), timeout=op_def.get("timeout", None))
+        RPCOpTable._tables.add(self)
+
+    @staticmethod
+    def _get_service_schema(routing_obj):
+        schema_json = getattr(type(routing_obj), "SCHEMA_JSON", None)
+        if not isinstance(schema_json, basestring):
+            return {}
+        try:
+            return json.loads(schema_json)
+        except Exception:
+            log.debug("Cannot parse service schema for %s", type(routing_obj).__name__)
+            return {}
+
+    def get_op(self, op_name):
+        """
+        Returns the bound method and RPCOperation for given op name.
+        @raises BadRequest  If the routing object has no such op
+        """
+        op = self._ops.get(op_name, None)
+        method = getattr(self._routing_obj, op_name, None) if op_name else None
+        if method is None:
+            raise BadRequest("Unknown op name: %s" % op_name)
+        if op is None:
+            op = RPCOperation(op_name, method)
+            self._ops[op_name] = op
+        elif op.func is not getattr(method, "__func__", None):
+            # The method was replaced after the table was built (e.g. patched)
+            op.set_method(method)
+        return method, op
+
+    def get_stats(self):
+        return {op_name: op.get_stats() for op_name, op in self._ops.iteritems() if op.count}
+
+    def reset_stats(self):
+        for op in self._ops.itervalues():
+            op.reset_stats()
+
+    @classmethod
+    def get_all_stats(cls, reset=False):
+        """Returns RPC operation stats of all RPC servers in this process, aggregated per service name"""
+        all_stats = {}
+        for table in list(cls._tables):
+            for op_name, op_stats in table.get_stats().iteritems():
+                svc_stats = all_stats.setdefault(table.name, {})
+                if op_name in svc_stats:
+                    agg = svc_stats[op_name]
+                    agg["count"] += op_stats["count"]
+                    agg["errors"] += op_stats["errors"]
+                    agg["total_time"] += op_stats["total_time"]
+                    agg["max_time"] = max(agg["max_time"], op_stats["max_time"])
+                    agg["avg_time"] = round(agg["total_time"] / agg["count"], 6)
+                    agg["histogram"] = [(b, c1 + c2) for (b, c1), (_, c2) in zip(agg["histogram"], op_stats["histogram"])]
+                else:
+                    svc_stats[op_name] = op_stats
+            if reset:
+                table.reset_stats()
+        return all_stats
+
+
 class RPCResponseEndpointUnit(ResponseEndpointUnit):
-    def __init__(self, routing_obj=None, **kwargs):
+    def __init__(self, routing_obj=None, op_table=None, **kwargs):
         ResponseEndpointUnit.__init__(self, **kwargs)
         self._routing_obj = routing_obj
+        self._op_table = op_table
 
     def intercept_in(self, msg, headers):
         """
@@ -1228,27 +1689,31 @@ class RPCResponseEndpointUnit(ResponseEndpointUnit):
         else:
             raise BadRequest("Unknown message type, cannot convert into kwarg dict: %s" % type(cmd_arg_obj))
 
+        if self._op_table is None:
+            self._op_table = RPCOpTable(self._routing_obj)
+
         # op name must exist!
-        if not hasattr(self._routing_obj, cmd_op):
-            raise BadRequest("Unknown op name: %s" % cmd_op)
+        ro_meth, ro_op = self._op_table.get_op(cmd_op)
 
-        ro_meth = getattr(self._routing_obj, cmd_op)
+        # check arguments against op signature
+        if ro_op.arg_names is not None:
+            for arg_name in cmd_arg_obj:
+                if arg_name not in ro_op.arg_names:
+                    return None, self._create_error_response(code=400, msg="Argument %s not present in op signature" % arg_name)
 
-        # check arguments (as long as it is a function. might be a mock in testing.)
-        # @TODO doesn't really feel correct.
-        if isinstance(ro_meth, MethodType):
-            ro_meth_args = inspect.getargspec(ro_meth)
-
-            # if the keyword one is not none, we can support anything
-            if ro_meth_args[2] is None:
-                for arg_name in cmd_arg_obj:
-                    if not arg_name in ro_meth_args[0]:
-                        return None, self._create_error_response(code=400, msg="Argument %s not present in op signature" % arg_name)
+        if timeout is None:
+            timeout = ro_op.timeout
 
         ######
         ###### THIS IS WHERE THE ENDPOINT OPERATION IS CALLED ######
         ######
-        result = self._make_routing_call(ro_meth, timeout, **cmd_arg_obj)
+        start_time = time.time()
+        try:
+            result = self._make_routing_call(ro_meth, timeout, **cmd_arg_obj)
+        except Exception:
+            ro_op.record(time.time() - start_time, error=True)
+            raise
+        ro_op.record(time.time() - start_time)
         response_headers = {'status_code': 200,
                             'error_message': ''}
         ######
@@ -1312,13 +1777,14 @@ class RPCServer(RequestResponseServer):
     def __init__(self, service=None, **kwargs):
         assert service
         self._service = service
+        self.op_table = RPCOpTable(service)
         RequestResponseServer.__init__(self, **kwargs)
 
     def create_endpoint(self, **kwargs):
         """
         @TODO: push this into RequestResponseServer
         """
-        return RequestResponseServer.create_endpoint(self, routing_obj=self._service, **kwargs)
+        return RequestResponseServer.create_endpoint(self, routing_obj=self._service, op_table=self.op_table, **kwargs)
 
     def __str__(self):
         return "RPCServer: recv_name: %s" % (str(self._recv_name))
@@ -1353,12 +1819,17 @@ def log_message(prefix="MESSAGE", msg=None, headers=None, recv=None, delivery_ta
             log.warning("%s log error: %s", prefix, str(ex))
 
 
-def trigger_msg_out_callback(body, headers, ep_unit):
-    """Triggers a hook on message send"""
+def trigger_msg_out_callback(body, headers, ep_unit, send_name=None):
+    """
+    Triggers a hook on message send
+    @param send_name  NameTrio the message is sent to, if not the name the channel is connected to
+    """
     if callback_msg_out:
         try:
             env = {}
-            if hasattr(ep_unit, "channel"):
+            if send_name is not None:
+                env["routing_key"] = str(send_name)
+            elif hasattr(ep_unit, "channel"):
                 env["routing_key"] = str(getattr(ep_unit.channel, "_send_name", "?"))
             if hasattr(ep_unit, "_process"):
                 env["process"] = ep_unit._process
@@ -34,6 +34,7 @@ class BaseNode(object):
         self._lock = RLock()
 
         self.interceptors = {}  # endpoint interceptors
+        self.reply_dispatchers = {}  # exchange -> shared RPC reply queue (see endpoint.ReplyDispatcher)
 
     def on_connection_open(self, client):
         """
@@ -69,6 +70,17 @@ class BaseNode(object):
         log.debug("In Node.stop_node")
         self.running = False
 
+    def _close_reply_dispatchers(self):
+        """
+        Closes the shared RPC reply queues of this node, failing any requests still waiting.
+        """
+        for dispatcher in self.reply_dispatchers.values():
+            try:
+                dispatcher.close()
+            except Exception:
+                log.exception("Error closing reply dispatcher for exchange %s", dispatcher.exchange)
+        self.reply_dispatchers.clear()
+
     def channel(self, ch_type):
         """
         Create a channel on current node.
@@ -156,6 +168,7 @@ class NodeB(BaseNode):
         log.debug("NodeB.stop_node (running: %s)", self.running)
 
         if self.running:
+            self._close_reply_dispatchers()
             # clean up pooling before we shut connection
             self._destroy_pool()
             self.client.close()
@@ -413,6 +426,7 @@ class LocalNode(BaseNode):
 
     def stop_node(self):
         if self.running:
+            self._close_reply_dispatchers()
             if self._own_router:
                 self._local_router.stop()
         self.running = False
@@ -5,7 +5,7 @@ __author__ = 'Dave Foster <dfoster@asascience.com>'
 
 from nose.plugins.attrib import attr
 from mock import Mock, sentinel, patch, ANY, call, MagicMock
-from gevent import event, spawn
+from gevent import event, spawn, queue
 import unittest
 from zope.interface.declarations import implements
 from zope.interface.interface import Interface
@@ -17,11 +17,11 @@ from pyon.core import exception
 from pyon.core.bootstrap import get_sys_name, CFG
 from pyon.container.cc import Container
 from pyon.core.interceptor.interceptor import Invocation
-from pyon.net.channel import BaseChannel, SendChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, RecvChannel, ListenChannel
-from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint, ListeningBaseEndpoint
+from pyon.net.channel import ChannelError, BaseChannel, SendChannel, BidirClientChannel, SubscriberChannel, ChannelClosedError, ServerChannel, RecvChannel, ListenChannel, ReplyChannel
+from pyon.net.endpoint import EndpointUnit, BaseEndpoint, RPCServer, Subscriber, Publisher, RequestResponseClient, RequestEndpointUnit, RPCRequestEndpointUnit, RPCClient, RPCResponseEndpointUnit, EndpointError, SendingBaseEndpoint, ListeningBaseEndpoint, ReplyDispatcher, RPCOpTable
 from pyon.net.messaging import NodeB
 from pyon.ion.service import BaseService
-from pyon.net.transport import NameTrio, BaseTransport
+from pyon.net.transport import NameTrio, BaseTransport, TransportError
 
 # NO INTERCEPTORS - we use these mock-like objects up top here which deliver received messages that don't go through the interceptor stack.
 no_interceptors = {'message_incoming': [],
@@ -332,6 +332,31 @@ class TestListeningBaseEndpoint(PyonTestCase):
         chmock.accept.return_value.recv.assert_called_once_with()
         ep.create_endpoint.assert_called_once_with(existing_channel=chmock.accept.return_value)
 
+    def test_listen_batch(self):
+        # make a listen loop that accepts three messages at once, then gets closed
+        chmock = MagicMock(spec=ListenChannel)
+        newchmock = Mock()
+        newchmock.recv.side_effect = [("msg%s" % i, {}, i) for i in xrange(3)]
+        newchmock._recv_queue.qsize.return_value = 3
+        chmock.accept.side_effect = [newchmock, ChannelClosedError()]
+
+        nodemock = Mock(spec=NodeB)
+        nodemock.channel.return_value = chmock
+
+        ep = ListeningBaseEndpoint(node=nodemock, from_name=NameTrio(sentinel.ex, sentinel.queue), batch_size=3)
+        ep.create_endpoint = Mock(return_value=Mock(spec=EndpointUnit))
+        ep.create_endpoint.return_value.intercept_in.side_effect = lambda msg, headers: (msg, headers)
+        ep.listen()
+
+        chmock.set_qos.assert_called_once_with(3)
+        self.assertEquals(chmock.accept.call_args_list[0], call(n=1, timeout=None, max_n=3))
+        self.assertEquals(ep.create_endpoint.return_value._message_received.call_args_list,
+                          [call("msg0", {}), call("msg1", {}), call("msg2", {})])
+
+        # the batch is acked at once
+        newchmock.ack_all.assert_called_once_with()
+        self.assertEquals(newchmock.ack.call_count, 0)
+
     def test_get_stats_no_channel(self):
         ep = ListeningBaseEndpoint()
         self.assertRaises(EndpointError, ep.get_stats)
@@ -425,6 +450,67 @@ class TestPublisher(PyonTestCase):
         self._pub.close()
         self._pub._pub_ep.close.assert_called_once_with()
 
+    def test_publish_channel_cache(self):
+        # Routes to the same exchange share one channel
+        self._pub.publish("pub", to_name=NameTrio("ex1", "route1"))
+        self._pub.publish("pub", to_name=NameTrio("ex1", "route2"))
+        self.assertEquals(self._node.channel.call_count, 1)
+        self.assertEquals(self._ch.send.call_count, 2)
+        # The route is passed per send, the shared channel stays connected to the first route
+        self._ch.send.assert_called_with(ANY, ANY, name=NameTrio("ex1", "route2"))
+        self._ch.connect.assert_called_once_with(NameTrio("ex1", "route1"))
+
+        # Message tracing reports the route of each send
+        with patch('pyon.net.endpoint.callback_msg_out') as cb_mock:
+            self._pub.publish("pub", to_name=NameTrio("ex1", "route3"))
+            self.assertEquals(cb_mock.call_args[0][2]["routing_key"], str(NameTrio("ex1", "route3")))
+
+        self._pub._max_pub_eps = 2
+        self._pub.publish("pub", to_name=NameTrio("ex2", "route1"))
+        self.assertEquals(self._node.channel.call_count, 2)
+
+        # Cache is bounded, least recently used channel is closed
+        self._pub.publish("pub", to_name=NameTrio("ex3", "route1"))
+        self.assertEquals(self._node.channel.call_count, 3)
+        self.assertEquals(self._ch.close.call_count, 1)
+        self.assertEquals(self._pub._pub_eps.keys(), ["ex2", "ex3"])
+
+        # Closed channel is replaced
+        self._ch.get_channel_id.return_value = None
+        self._pub.publish("pub", to_name=NameTrio("ex3", "route1"))
+        self.assertEquals(self._node.channel.call_count, 4)
+        self._ch.get_channel_id.return_value = 1
+
+        # Channel closing during send is replaced and the send retried
+        self._ch.send.side_effect = [ChannelError("No transport attached"), None]
+        self._pub.publish("pub", to_name=NameTrio("ex3", "route1"))
+        self.assertEquals(self._node.channel.call_count, 5)
+        self.assertEquals(self._ch.send.call_count, 8)
+
+        self._pub.close()
+        self.assertEquals(self._pub._pub_eps, {})
+
+    def test_flush_closed_channel(self):
+        pub = Publisher(node=self._node, to_name="testpub", confirm=True)
+        ch1, ch2 = Mock(spec=SendChannel), Mock(spec=SendChannel)
+        ch2.pop_failed_confirms.return_value = 0
+        self._node.channel.side_effect = [ch1, ch2]
+
+        pub.publish("pub")
+        ch1.enable_confirms.assert_called_once_with(max_pending=ANY)
+
+        # Channel closed with pending confirms, the next publish replaces it
+        ch1.get_channel_id.return_value = None
+        ch1.pop_failed_confirms.side_effect = [2, 0]
+        pub.publish("pub")
+        self.assertEquals(self._node.channel.call_count, 2)
+        self.assertEquals(ch1.close.call_count, 1)
+
+        # Messages lost on the replaced channel are reported once
+        self.assertRaises(TransportError, pub.flush)
+        ch2.wait_confirms.return_value = 1
+        self.assertEquals(pub.flush(), 1)
+
 
 class RecvMockMixin(object):
     """
@@ -527,6 +613,52 @@ class TestRequestResponse(PyonTestCase, RecvMockMixin):
         pass
 
 
+@attr('UNIT')
+class TestReplyDispatcher(PyonTestCase):
+
+    def test_dispatch(self):
+        node = Mock()
+        node.running = True
+        node.reply_dispatchers = {}
+        ch = Mock(spec=ReplyChannel)
+        ch._recv_name = NameTrio("ex", "ex.reply1")
+        node.channel.return_value = ch
+        recv_queue = queue.Queue()
+
+        def _recv():
+            item = recv_queue.get()
+            if isinstance(item, Exception):
+                raise item
+            return item
+        ch.recv.side_effect = _recv
+
+        disp = ReplyDispatcher.get_dispatcher(node, "ex")
+        self.assertIs(ReplyDispatcher.get_dispatcher(node, "ex"), disp)
+        self.assertEquals(node.channel.call_count, 1)
+        self.assertEquals(disp.reply_to, "ex,ex.reply1")
+
+        ar = disp.register("conv1")
+        self.assertIsNone(disp.register("conv1"))
+
+        # Responses are routed by conv-id, unknown ones are discarded
+        recv_queue.put(("body2", {'conv-id': "conv2"}, 2))
+        recv_queue.put(("body1", {'conv-id': "conv1"}, 1))
+        self.assertEquals(ar.get(timeout=1), ("body1", {'conv-id': "conv1"}, 1))
+        self.assertEquals(ch.ack.call_count, 2)
+        self.assertEquals(disp.get_stats()["pending"], 0)
+
+        # Timed out requests unregister
+        disp.register("conv3")
+        disp.unregister("conv3")
+        self.assertEquals(disp.get_stats()["pending"], 0)
+
+        # Closed channel fails waiting requests and removes the dispatcher
+        ar = disp.register("conv4")
+        recv_queue.put(ChannelClosedError())
+        self.assertRaises(exception.ServiceUnavailable, ar.get, timeout=1)
+        self.assertEquals(node.reply_dispatchers, {})
+
+
 class ISimpleInterface(Interface):
     """
 Defines a simple interface for testing rpc client/servers.
@@ -751,6 +883,78 @@ Routing method for next test, raises an IonException.
 
         self.assertRaises(exception.BadRequest, e.message_received, 3, {})
 
+    def test_op_table(self):
+        class FakeService(object):
+            name = "fake_service"
+            SCHEMA_JSON = '{"op_list": ["op_one", "op_any"], "operations": {}}'
+
+            def op_one(self, first='', second=None):
+                return first
+
+            def op_any(self, **kwargs):
+                return kwargs
+
+            def op_other(self, arg=None):
+                return arg
+
+        svc = FakeService()
+        table = RPCOpTable(svc)
+        self.assertEquals(table.name, "fake_service")
+        self.assertEquals(set(table._ops.keys()), {"op_one", "op_any"})
+        self.assertEquals(table._ops["op_one"].arg_names, {"self", "first", "second"})
+        self.assertIsNone(table._ops["op_any"].arg_names)
+        self.assertRaises(exception.BadRequest, table.get_op, "op_none")
+
+        e = RPCResponseEndpointUnit(routing_obj=svc, op_table=table)
+        result, headers = e.message_received({'first': 'one'}, {'op': 'op_one'})
+        self.assertEquals(result, 'one')
+        result, headers = e.message_received({'third': 3}, {'op': 'op_one'})
+        self.assertEquals(headers['status_code'], 400)
+        result, headers = e.message_received({'arg': 'other'}, {'op': 'op_other'})
+        self.assertEquals(result, 'other')
+        self.assertIn("op_other", table._ops)
+
+        stats = table.get_stats()
+        self.assertEquals(set(stats.keys()), {"op_one", "op_other"})
+        self.assertEquals(stats["op_one"]["count"], 1)
+        self.assertEquals(sum(count for bucket, count in stats["op_one"]["histogram"]), 1)
+        self.assertIn("op_one", RPCOpTable.get_all_stats()["fake_service"])
+
+        # Replaced methods are picked up
+        svc.op_one = Mock(return_value='mocked')
+        result, headers = e.message_received({'any': 1}, {'op': 'op_one'})
+        self.assertEquals(result, 'mocked')
+
+    def test_op_table_timeout(self):
+        class FakeService(object):
+            name = "fake_service"
+            SCHEMA_JSON = '{"op_list": ["op_slow", "op_fast"], "operations": {"op_slow": {"timeout": 30.0}}}'
+
+            def op_slow(self):
+                return "slow"
+
+            def op_fast(self):
+                return "fast"
+
+        svc = FakeService()
+        table = RPCOpTable(svc)
+        self.assertEquals(table._ops["op_slow"].timeout, 30.0)
+        self.assertIsNone(table._ops["op_fast"].timeout)
+
+        e = RPCResponseEndpointUnit(routing_obj=svc, op_table=table)
+        e._make_routing_call = Mock(return_value="result")
+
+        # The op's timeout from the service interface applies if the request does not define one
+        e.message_received({}, {'op': 'op_slow'})
+        self.assertEquals(e._make_routing_call.call_args[0][1], 30.0)
+        e.message_received({}, {'op': 'op_fast'})
+        self.assertIsNone(e._make_routing_call.call_args[0][1])
+
+        # A request timeout takes precedence
+        e._calculate_timeout = Mock(return_value=5)
+        e.message_received({}, {'op': 'op_slow'})
+        self.assertEquals(e._make_routing_call.call_args[0][1], 5)
+
 
 @attr('UNIT')
 class TestRPCServer(PyonTestCase, RecvMockMixin):
@@ -34,6 +34,10 @@ class TestTransport(PyonTestCase):
         self.assertRaises(NotImplementedError, bt.purge_impl, sentinel.queue)
         self.assertRaises(NotImplementedError, bt.qos_impl)
         self.assertRaises(NotImplementedError, bt.publish_impl, sentinel.exchange, sentinel.rkey, sentinel.body, sentinel.props)
+        self.assertRaises(NotImplementedError, bt.confirm_delivery_impl)
+        self.assertRaises(NotImplementedError, bt.flush_impl)
+        self.assertRaises(NotImplementedError, bt.wait_confirms_impl)
+        self.assertRaises(NotImplementedError, bt.pop_failed_confirms_impl)
         self.assertRaises(NotImplementedError, bt.close)
         with self.assertRaises(NotImplementedError):
             cn = bt.channel_number
@@ -64,7 +68,11 @@ class TestComposableTransport(PyonTestCase):
                                         'stop_consume_impl'    : right.stop_consume_impl,
                                         'get_stats_impl'       : right.get_stats_impl,
                                         'qos_impl'             : right.qos_impl,
-                                        'publish_impl'         : right.publish_impl, })
+                                        'publish_impl'         : right.publish_impl,
+                                        'confirm_delivery_impl': right.confirm_delivery_impl,
+                                        'flush_impl'           : right.flush_impl,
+                                        'wait_confirms_impl'   : right.wait_confirms_impl,
+                                        'pop_failed_confirms_impl': right.pop_failed_confirms_impl, })
 
     def test_overlay(self):
         left = Mock()
@@ -121,7 +129,7 @@ class TestComposableTransport(PyonTestCase):
         left.purge_impl.assert_called_once_with(sentinel.queue)
         left.setup_listener.assert_called_once_with(sentinel.binding, sentinel.callback)
 
-        right.ack_impl.assert_called_once_with(sentinel.dtag)
+        right.ack_impl.assert_called_once_with(sentinel.dtag, multiple=False)
         right.reject_impl.assert_called_once_with(sentinel.dtag, requeue=False)
         right.start_consume_impl.assert_called_once_with(sentinel.callback, sentinel.queue, no_ack=False, exclusive=False)
         right.stop_consume_impl.assert_called_once_with(sentinel.ctag)
@@ -433,7 +441,7 @@ class TestAMQPTransportCommonMethods(PyonTestCase):
     def test_ack_impl(self):
         self.tp.ack_impl(sentinel.dtag)
 
-        self.tp._client.basic_ack.assert_called_once_with(sentinel.dtag)
+        self.tp._client.basic_ack.assert_called_once_with(sentinel.dtag, multiple=False)
 
     def test_reject_impl(self):
         self.tp.reject_impl(sentinel.dtag)
@@ -527,6 +535,41 @@ class TestAMQPTransportCommonMethods(PyonTestCase):
                                                               immediate=False,
                                                               mandatory=False)
 
+    @patch('pyon.net.transport.BasicProperties')
+    def test_publish_confirms(self, bpmock):
+        self.tp.confirm_delivery_impl(max_pending=10)
+        self.tp._client.confirm_delivery.assert_called_once_with(callback=self.tp._on_confirm)
+
+        ars = [self.tp.publish_impl(sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.properties)
+               for i in xrange(4)]
+        self.assertEquals(self.tp._client.basic_publish.call_count, 4)
+        self.assertEquals(self.tp._unconfirmed.keys(), [1, 2, 3, 4])
+        self.assertFalse(any(ar.ready() for ar in ars))
+
+        def frame(name, tag, multiple=False):
+            return Mock(method=Mock(NAME=name, delivery_tag=tag, multiple=multiple))
+
+        # multiple ack confirms all up to the delivery tag
+        self.tp._on_confirm(frame('Basic.Ack', 2, multiple=True))
+        self.assertTrue(ars[0].successful() and ars[1].successful())
+        self.assertEquals(self.tp._unconfirmed.keys(), [3, 4])
+
+        self.tp._on_confirm(frame('Basic.Nack', 3))
+        self.tp._on_confirm(frame('Basic.Ack', 4))
+        self.assertIsInstance(ars[2].exception, TransportError)
+        self.assertTrue(ars[3].successful())
+
+        # flush reports failures since the last flush
+        self.assertRaises(TransportError, self.tp.flush_impl)
+        self.assertEquals(self.tp.flush_impl(), 0)
+
+        # closing the channel fails outstanding publishes
+        ar = self.tp.publish_impl(sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.properties)
+        self.tp._on_underlying_close(320, 'shutdown')
+        self.assertEquals(self.tp._unconfirmed, {})
+        self.assertIsInstance(ar.exception, TransportError)
+        self.assertRaises(TransportError, self.tp.flush_impl)
+
 @attr('UNIT')
 class TestNameTrio(PyonTestCase):
     def test_init(self):
@@ -600,6 +643,25 @@ class TestTopicTrie(PyonTestCase):
         self.assertEquals({sentinel.wild},
                           set(self.tt.get_all_matches('a.b.b.b.b.b.b')))
 
+    def test_match_cache(self):
+        bindings = ['a.b.c', 'a.*.c', '#', '#.c', 'a.#', 'a.#.c', '*.#.*', 'a.#.#.c', '#.b.#', 'x.y']
+        for binding in bindings:
+            self.tt.add_topic_tree(binding, binding)
+
+        # iterative matching is equivalent to the recursive node matching
+        for rkey in ['a', 'c', 'a.c', 'a.b.c', 'a.b.b.c', 'b', 'x.y', 'x.y.z', 'a.b.c.d.e.f.c']:
+            self.assertEquals(self.tt.get_all_matches(rkey), set(self.tt.root.get_all_matches(rkey.split('.'))))
+
+        self.assertIn('a.b.c', self.tt._match_cache)
+        self.assertIn('x.y', self.tt.get_all_matches('x.y'))
+
+        # cache is invalidated on add and remove
+        self.tt.remove_topic_tree('x.y', 'x.y')
+        self.assertEquals(self.tt._match_cache, {})
+        self.assertNotIn('x.y', self.tt.get_all_matches('x.y'))
+        self.tt.add_topic_tree('x.*', 'x.*')
+        self.assertIn('x.*', self.tt.get_all_matches('x.y'))
+
 @attr('UNIT')
 class TestLocalRouter(PyonTestCase):
 
@@ -968,7 +1030,7 @@ class TestLocalTransport(PyonTestCase):
         self.broker.publish.assert_called_once_with(sentinel.exchange, sentinel.routing_key, sentinel.body, sentinel.properties, immediate=False, mandatory=False)
         self.broker.start_consume.assert_called_once_with(sentinel.callback, sentinel.queue, no_ack=False, exclusive=False)
         self.broker.stop_consume.assert_called_once_with(sentinel.consumer_tag)
-        self.broker.ack.assert_called_once_with(sentinel.delivery_tag)
+        self.broker.ack.assert_called_once_with(sentinel.delivery_tag, multiple=False)
         self.broker.reject.assert_called_once_with(sentinel.delivery_tag, requeue=False)
         self.broker.get_stats(sentinel.queue)
         self.broker.purge(sentinel.queue)
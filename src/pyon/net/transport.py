@@ -12,7 +12,7 @@ __author__ = 'Dave Foster <dfoster@asascience.com>'
 import os
 from contextlib import contextmanager
 from uuid import uuid4
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from pika import BasicProperties
 from gevent.event import AsyncResult, Event
 from gevent.queue import Queue
@@ -50,7 +50,7 @@ class BaseTransport(object):
     def unbind_impl(self, exchange, queue, binding):
         raise NotImplementedError()
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         raise NotImplementedError()
 
     def reject_impl(self, delivery_tag, requeue=False):
@@ -77,6 +77,18 @@ class BaseTransport(object):
     def publish_impl(self, exchange, routing_key, body, properties, immediate=False, mandatory=False, durable_msg=False):
         raise NotImplementedError()
 
+    def confirm_delivery_impl(self, max_pending=1000):
+        raise NotImplementedError()
+
+    def flush_impl(self, timeout=None):
+        raise NotImplementedError()
+
+    def wait_confirms_impl(self, timeout=None):
+        raise NotImplementedError()
+
+    def pop_failed_confirms_impl(self):
+        raise NotImplementedError()
+
     def close(self):
         raise NotImplementedError()
 
@@ -105,6 +117,8 @@ class ComposableTransport(BaseTransport):
         - qos_impl
         - get_stats_impl
         - publish_impl      (solely for publish rates, not needed for identity in protocol)
+        - confirm_delivery_impl, flush_impl, wait_confirms_impl, pop_failed_confirms_impl
+          (publisher confirms are per publishing channel)
     """
     common_methods = ['ack_impl',
                       'reject_impl',
@@ -112,7 +126,11 @@ class ComposableTransport(BaseTransport):
                       'stop_consume_impl',
                       'qos_impl',
                       'get_stats_impl',
-                      'publish_impl']
+                      'publish_impl',
+                      'confirm_delivery_impl',
+                      'flush_impl',
+                      'wait_confirms_impl',
+                      'pop_failed_confirms_impl']
 
     def __init__(self, left, right, *methods):
         self._transports = [left]
@@ -133,7 +151,11 @@ class ComposableTransport(BaseTransport):
                           'get_stats_impl'       : left.get_stats_impl,
                           'purge_impl'           : left.purge_impl,
                           'qos_impl'             : left.qos_impl,
-                          'publish_impl'         : left.publish_impl, }
+                          'publish_impl'         : left.publish_impl,
+                          'confirm_delivery_impl': left.confirm_delivery_impl,
+                          'flush_impl'           : left.flush_impl,
+                          'wait_confirms_impl'   : left.wait_confirms_impl,
+                          'pop_failed_confirms_impl': left.pop_failed_confirms_impl, }
 
         if right is not None:
             self.overlay(right, *methods)
@@ -171,9 +193,9 @@ class ComposableTransport(BaseTransport):
         m = self._methods['unbind_impl']
         return m(exchange, queue, binding)
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         m = self._methods['ack_impl']
-        return m(delivery_tag)
+        return m(delivery_tag, multiple=multiple)
 
     def reject_impl(self, delivery_tag, requeue=False):
         m = self._methods['reject_impl']
@@ -207,6 +229,22 @@ class ComposableTransport(BaseTransport):
         m = self._methods['publish_impl']
         return m(exchange, routing_key, body, properties, immediate=immediate, mandatory=mandatory, durable_msg=durable_msg)
 
+    def confirm_delivery_impl(self, max_pending=1000):
+        m = self._methods['confirm_delivery_impl']
+        return m(max_pending=max_pending)
+
+    def flush_impl(self, timeout=None):
+        m = self._methods['flush_impl']
+        return m(timeout=timeout)
+
+    def wait_confirms_impl(self, timeout=None):
+        m = self._methods['wait_confirms_impl']
+        return m(timeout=timeout)
+
+    def pop_failed_confirms_impl(self):
+        m = self._methods['pop_failed_confirms_impl']
+        return m()
+
     def close(self):
         for t in self._transports:
             t.close()
@@ -242,6 +280,14 @@ class AMQPTransport(BaseTransport):
         self._close_callbacks = []
         self.lock = False
 
+        # Publisher confirms (off unless confirm_delivery_impl is called)
+        self._confirms = False
+        self._confirm_seq = 0                   # Sequence number (delivery tag) of the last publish
+        self._unconfirmed = OrderedDict()       # Sequence number -> AsyncResult, for outstanding publishes
+        self._max_unconfirmed = 1000
+        self._failed_confirms = 0               # Nacked or failed publishes since the last flush
+        self._publish_lock = RLock()            # Keeps sequence numbers in publish order with concurrent publishers
+
     def _on_underlying_close(self, code, text):
         if not (code == 0 or code == 200):
             log.error("AMQPTransport.underlying closed:\n\tchannel number: %s\n\tcode: %d\n\ttext: %s", self.channel_number, code, text)
@@ -261,6 +307,9 @@ class AMQPTransport(BaseTransport):
         #stro = pprint.pformat(callbacks._callbacks)
         #log.error(str(stro))
 
+        if self._unconfirmed:
+            self._fail_unconfirmed(TransportError("Channel closed with unconfirmed publishes (%s: %s)" % (code, text)))
+
         for cb in self._close_callbacks:
             cb(self, code, text)
 
@@ -385,12 +434,12 @@ class AMQPTransport(BaseTransport):
                                                      exchange=exchange,
                                                      routing_key=binding)
 
-    def ack_impl(self, delivery_tag):
+    def ack_impl(self, delivery_tag, multiple=False):
         """
-        Acks a message.
+        Acks a message, or with multiple set all unacked messages up to and including the delivery tag.
         """
         #log.debug("AMQPTransport.ack(%s): %s", self._client.channel_number, delivery_tag)
-        self._client.basic_ack(delivery_tag)
+        self._client.basic_ack(delivery_tag, multiple=multiple)
 
     def reject_impl(self, delivery_tag, requeue=False):
         """
@@ -482,12 +531,101 @@ class AMQPTransport(BaseTransport):
         props = BasicProperties(headers=properties,
                                 delivery_mode=delivery_mode)
 
-        self._client.basic_publish(exchange=exchange,       # todo
-                                   routing_key=routing_key, # todo
-                                   body=body,
-                                   properties=props,
-                                   immediate=immediate,     # todo
-                                   mandatory=mandatory)     # todo
+        if not self._confirms:
+            self._client.basic_publish(exchange=exchange,       # todo
+                                       routing_key=routing_key, # todo
+                                       body=body,
+                                       properties=props,
+                                       immediate=immediate,     # todo
+                                       mandatory=mandatory)     # todo
+            return None
+
+        # Backpressure: limit the number of outstanding publishes on this channel (outside of the lock)
+        if len(self._unconfirmed) >= self._max_unconfirmed:
+            next(self._unconfirmed.itervalues()).wait(timeout=20)
+        with self._publish_lock:
+            self._confirm_seq += 1
+            confirm_ar = AsyncResult()
+            self._unconfirmed[self._confirm_seq] = confirm_ar
+            self._client.basic_publish(exchange=exchange,
+                                       routing_key=routing_key,
+                                       body=body,
+                                       properties=props,
+                                       immediate=immediate,
+                                       mandatory=mandatory)
+        return confirm_ar
+
+    def confirm_delivery_impl(self, max_pending=1000):
+        """
+        Puts the channel into publisher confirm mode. Publishes are not waited for individually:
+        publish_impl returns an AsyncResult that is set when the broker acks (or fails when the
+        broker nacks) the message. Use flush_impl to wait for all outstanding publishes.
+        @param max_pending  Max number of unconfirmed publishes before publish_impl blocks
+        """
+        if self._confirms:
+            return
+        self._max_unconfirmed = max_pending
+        self._client.confirm_delivery(callback=self._on_confirm)
+        self._confirms = True
+
+    def _on_confirm(self, frame):
+        """
+        Callback for Basic.Ack and Basic.Nack frames in confirm mode.
+        """
+        method = frame.method
+        is_ack = method.NAME == 'Basic.Ack'
+        if method.multiple:
+            seqs = [seq for seq in self._unconfirmed if seq <= method.delivery_tag]
+        else:
+            seqs = [method.delivery_tag]
+        for seq in seqs:
+            ar = self._unconfirmed.pop(seq, None)
+            if ar is None:
+                continue
+            if is_ack:
+                ar.set(True)
+            else:
+                self._failed_confirms += 1
+                ar.set_exception(TransportError("Broker nacked message publish (seq %s)" % seq))
+
+    def _fail_unconfirmed(self, ex):
+        unconfirmed, self._unconfirmed = self._unconfirmed, OrderedDict()
+        self._failed_confirms += len(unconfirmed)
+        for ar in unconfirmed.itervalues():
+            ar.set_exception(ex)
+
+    def flush_impl(self, timeout=None):
+        """
+        Waits until all publishes made so far on this channel are confirmed.
+        @retval Number of publishes waited for
+        @raises TransportError  If any message since the last flush was nacked or the channel closed
+        @raises Timeout         If not all confirms were received within the timeout
+        """
+        num_pending = self.wait_confirms_impl(timeout=timeout)
+        failed = self.pop_failed_confirms_impl()
+        if failed:
+            raise TransportError("%s messages were not confirmed by the broker" % failed)
+        return num_pending
+
+    def wait_confirms_impl(self, timeout=None):
+        """
+        Waits until the broker confirmed or rejected all publishes made so far on this channel.
+        @retval Number of publishes waited for
+        @raises Timeout         If not all confirms were received within the timeout
+        """
+        pending = self._unconfirmed.values()
+        if pending:
+            with Timeout(timeout):
+                for ar in pending:
+                    ar.wait()
+        return len(pending)
+
+    def pop_failed_confirms_impl(self):
+        """
+        Returns the number of publishes that were nacked or lost in a channel close since the last call.
+        """
+        failed, self._failed_confirms = self._failed_confirms, 0
+        return failed
 
 
 class NameTrio(object):
@@ -575,6 +713,7 @@ class TopicTrie(object):
             Given a list of topic tokens, returns all patterns stored in child nodes/self that match the topic tokens.
 
             This is a depth-first search pruned by token, with special handling for both wildcard types.
+            Note: TopicTrie uses the iterative match_topics instead, which returns the same matches.
             """
             results = []
 
@@ -608,11 +747,15 @@ class TopicTrie(object):
 
             return results
 
+    # Max number of routing keys with cached matches
+    MAX_CACHE_SIZE = 10000
+
     def __init__(self):
         """
         Creates a dummy root node that all topic trees hang off of.
         """
         self.root = self.Node(None)
+        self._match_cache = {}      # topic tree -> frozenset of matching patterns, cleared on any change
 
     def add_topic_tree(self, topic_tree, pattern):
         """
@@ -628,6 +771,7 @@ class TopicTrie(object):
 
         if not pattern in curnode.patterns:
             curnode.patterns.append(pattern)
+        self._match_cache = {}
 
     def remove_topic_tree(self, topic_tree, pattern):
         """
@@ -643,15 +787,58 @@ class TopicTrie(object):
 
         if pattern in curnode.patterns:
             curnode.patterns.remove(pattern)
+        self._match_cache = {}
 
     def get_all_matches(self, topic_tree):
         """
-        Returns a list of all matches for a given topic tree string.
+        Returns a set of all matches for a given topic tree string.
         Creates a set out of the matching patterns, so multiple binds matching on the same pattern only
-        return once.
+        return once. Results are cached per topic tree until the next add or remove.
         """
-        topics = topic_tree.split(".")
-        return set(self.root.get_all_matches(topics))
+        match_cache = self._match_cache
+        matches = match_cache.get(topic_tree, None)
+        if matches is None:
+            matches = self.match_topics(topic_tree.split("."))
+            if len(match_cache) >= self.MAX_CACHE_SIZE:
+                match_cache.clear()
+            match_cache[topic_tree] = matches
+        return matches
+
+    def match_topics(self, topics):
+        """
+        Returns a frozenset of all patterns that match a list of topic tokens.
+        Iterative depth-first search over (node, token index) states, equivalent to Node.get_all_matches.
+        A '#' node is entered once per possible number of consumed tokens instead of re-descending
+        for every suffix of the topic list.
+        """
+        results = set()
+        num_topics = len(topics)
+        wild_seen = set()
+        stack = [(self.root, 0)]
+        while stack:
+            node, idx = stack.pop()
+            if idx == num_topics:
+                # terminal point, any pattern here matches
+                results.update(node.patterns)
+                continue
+
+            children = node.children
+            child = children.get(topics[idx], None)
+            if child is not None:
+                stack.append((child, idx + 1))
+            child = children.get('*', None)
+            if child is not None:
+                stack.append((child, idx + 1))
+            child = children.get('#', None)
+            if child is not None:
+                # '#' consumes any number of tokens, including all remaining ones
+                for next_idx in xrange(idx, num_topics + 1):
+                    state = (id(child), next_idx)
+                    if state not in wild_seen:
+                        wild_seen.add(state)
+                        stack.append((child, next_idx))
+
+        return frozenset(results)
 
 
 class LocalRouter(object):
@@ -675,7 +862,7 @@ class LocalRouter(object):
         self._exchanges = {}                            # names -> { subscriber, topictrie(queue name) }
         self._queues = {}                               # names -> gevent queue
         self._bindings_by_queue = defaultdict(list)     # queue name -> [(ex, binding)]
-        self._lock_declarables = RLock()                # exchanges, queues, bindings, routing method
+        self._lock_declarables = RLock()                # serializes changes to exchanges, queues, bindings
 
         # consumers
         self._consumers = defaultdict(list)             # queue name -> [ctag, channel._on_deliver]
@@ -718,8 +905,7 @@ class LocalRouter(object):
         while True:
             ex, rkey, body, props = self._queue_incoming.get()
             try:
-                with self._lock_declarables:
-                    self._route(ex, rkey, body, props)
+                self._route(ex, rkey, body, props)
             except Exception as e:
                 self.errors.append(e)
                 log.exception("Routing message")
@@ -727,18 +913,22 @@ class LocalRouter(object):
     def _route(self, exchange, routing_key, body, props):
         """
         Delivers incoming messages into queues based on known routes.
-        This entire method runs in a lock (likely pretty slow).
+        Routing only reads the declarables and does not take the declarables lock: changes
+        replace the cached matches of a TopicTrie, and a queue deleted concurrently is skipped.
         """
-        assert exchange in self._exchanges, "Unknown exchange %s" % exchange
+        topic_trie = self._exchanges.get(exchange, None)
+        assert topic_trie is not None, "Unknown exchange %s" % exchange
 
-        queues = self._exchanges[exchange].get_all_matches(routing_key)
-        log.debug("route: ex %s, rkey %s,  matched %s routes", exchange, routing_key, len(queues))
+        queues = topic_trie.get_all_matches(routing_key)
+        #log.debug("route: ex %s, rkey %s,  matched %s routes", exchange, routing_key, len(queues))
 
         # deliver to each queue
         for q in queues:
-            assert q in self._queues
-            log.debug("deliver -> %s", q)
-            self._queues[q].put((exchange, routing_key, body, props))
+            gqueue = self._queues.get(q, None)
+            if gqueue is None:
+                log.debug("route: queue %s deleted during routing", q)
+                continue
+            gqueue.put((exchange, routing_key, body, props))
 
     def _child_failed(self, gproc):
         """
@@ -907,11 +1097,19 @@ class LocalRouter(object):
         """
         return "%s-%s" % (ctag, cnt)
 
-    def ack(self, delivery_tag):
+    def ack(self, delivery_tag, multiple=False):
         assert delivery_tag in self._unacked
 
         with self._lock_unacked:
-            del self._unacked[delivery_tag]
+            if multiple:
+                # Ack all unacked messages of the same consumer delivered up to the given one
+                ctag, cnt = delivery_tag.rsplit("-", 1)
+                for dtag in self._unacked.keys():
+                    dtag_ctag, dtag_cnt = dtag.rsplit("-", 1)
+                    if dtag_ctag == ctag and int(dtag_cnt) <= int(cnt):
+                        del self._unacked[dtag]
+            else:
+                del self._unacked[delivery_tag]
 
     def reject(self, delivery_tag, requeue=False):
         assert delivery_tag in self._unacked
@@ -984,14 +1182,26 @@ class LocalTransport(BaseTransport):
     def publish_impl(self, exchange, routing_key, body, properties, immediate=False, mandatory=False, durable_msg=False):
         self._broker.publish(exchange, routing_key, body, properties, immediate=immediate, mandatory=mandatory)
 
+    def confirm_delivery_impl(self, max_pending=1000):
+        pass    # Local publishes are delivered synchronously
+
+    def flush_impl(self, timeout=None):
+        return 0
+
+    def wait_confirms_impl(self, timeout=None):
+        return 0
+
+    def pop_failed_confirms_impl(self):
+        return 0
+
     def start_consume_impl(self, callback, queue, no_ack=False, exclusive=False):
         return self._broker.start_consume(callback, queue, no_ack=no_ack, exclusive=exclusive)
 
     def stop_consume_impl(self, consumer_tag):
         self._broker.stop_consume(consumer_tag)
 
-    def ack_impl(self, delivery_tag):
-        self._broker.ack(delivery_tag)
+    def ack_impl(self, delivery_tag, multiple=False):
+        self._broker.ack(delivery_tag, multiple=multiple)
 
     def reject_impl(self, delivery_tag, requeue=False):
         self._broker.reject(delivery_tag, requeue=requeue)